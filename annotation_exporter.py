@@ -1,87 +1,210 @@
 import json
 import math
+import os
+import tempfile
+from collections import namedtuple
 from interactive_shapes import InteractiveRectangle, InteractiveCircle, InteractiveEllipse, InteractivePolygon, InteractivePolyline
+from geometry_utils import simplify_douglas_peucker
+from label_table import LABELS, DEFAULT_LABEL
 
-def export_annotations_to_json(shapes, image_width, image_height, filename="annotations.json"):
+# Copia immutabile di una forma, sicura da leggere in un altro thread mentre l'utente continua a disegnare.
+# coords: (x1, y1, x2, y2) per rettangoli e ovali, (cx, cy, radius) per i cerchi; points/original_points
+# sono tuple di vertici per poligoni e polilinee (original_points è None se non c'è una versione a piena risoluzione);
+# label è il nome dell'etichetta di classe (None equivale a DEFAULT_LABEL), non l'id della tabella del processo
+ShapeSnapshot = namedtuple("ShapeSnapshot", ["kind", "coords", "angle", "points", "original_points", "is_closed", "label"],
+                           defaults=(None,))
+
+def snapshot_shapes(shapes):
+    """
+    Cattura lo stato corrente delle forme in una tupla di ShapeSnapshot.
+    Va chiamata nel thread dell'interfaccia: copia solo coordinate e vertici, senza serializzare nulla.
+    """
+    snapshot = []
+    for shape in shapes:
+        label = LABELS.name(shape.label_id)
+        if isinstance(shape, InteractiveRectangle):
+            snapshot.append(ShapeSnapshot("rectangle", (shape.x1, shape.y1, shape.x2, shape.y2), shape.angle, None, None, True, label))
+        elif isinstance(shape, InteractiveCircle):
+            snapshot.append(ShapeSnapshot("circle", (shape.cx, shape.cy, shape.radius), 0.0, None, None, True, label))
+        elif isinstance(shape, InteractiveEllipse):
+            snapshot.append(ShapeSnapshot("ellipse", (shape.x1, shape.y1, shape.x2, shape.y2), 0.0, None, None, True, label))
+        elif isinstance(shape, (InteractivePolygon, InteractivePolyline)):
+            original = tuple(shape.original_points) if shape.original_points is not None else None
+            is_closed = isinstance(shape, InteractivePolygon) and shape.is_closed
+            kind = "polygon" if isinstance(shape, InteractivePolygon) else "polyline"
+            snapshot.append(ShapeSnapshot(kind, None, 0.0, tuple(shape.points), original, is_closed, label))
+    return tuple(snapshot)
+
+def _export_points(snapshot, simplify_tolerance, include_original, annotation):
+    """
+    Restituisce i vertici da esportare per poligoni/polilinee, eventualmente semplificati.
+    Se include_original è True e i vertici esportati differiscono da quelli a piena risoluzione,
+    questi ultimi vengono aggiunti all'annotazione in "original_coordinates".
+    """
+    points = snapshot.points
+    if simplify_tolerance:
+        points = simplify_douglas_peucker(points, simplify_tolerance, closed=snapshot.is_closed)
+
+    full_resolution = snapshot.original_points if snapshot.original_points is not None else snapshot.points
+    if include_original and len(full_resolution) != len(points):
+        annotation["original_coordinates"] = [(int(p[0]), int(p[1])) for p in full_resolution]
+    return [(int(p[0]), int(p[1])) for p in points]
+
+def snapshot_to_annotation(index, snapshot, simplify_tolerance=None, include_original=False):
+    """
+    Converte la copia di una forma nel dizionario esportato nel file JSON.
+    Non accede alle forme originali, quindi può essere eseguita in un thread di lavoro.
+    """
+    annotation = {
+        "id": index,
+        "type": snapshot.kind,
+        "label": snapshot.label or DEFAULT_LABEL, # Etichetta di classe
+        "coordinates": {}
+    }
+
+    if snapshot.kind == "rectangle":
+        x1, y1, x2, y2 = snapshot.coords
+        annotation["coordinates"] = {
+            "x1": int(x1),
+            "y1": int(y1),
+            "x2": int(x2),
+            "y2": int(y2),
+            "angle_rad": snapshot.angle, # Angolo in radianti
+            "angle_deg": math.degrees(snapshot.angle) # Angolo in gradi per comodità
+        }
+        # Puoi anche aggiungere il centro normalizzato, larghezza e altezza per YOLO bounding box
+        # cx_norm = ((x1 + x2) / 2) / image_width
+        # cy_norm = ((y1 + y2) / 2) / image_height
+        # w_norm = (x2 - x1) / image_width
+        # h_norm = (y2 - y1) / image_height
+        # annotation["yolo_bbox_normalized"] = [cx_norm, cy_norm, w_norm, h_norm]
+
+    elif snapshot.kind == "circle":
+        cx, cy, radius = snapshot.coords
+        annotation["coordinates"] = {
+            "cx": int(cx),
+            "cy": int(cy),
+            "radius": int(radius)
+        }
+
+    elif snapshot.kind == "ellipse":
+        x1, y1, x2, y2 = snapshot.coords
+        annotation["coordinates"] = {
+            "x1": int(x1),
+            "y1": int(y1),
+            "x2": int(x2),
+            "y2": int(y2)
+        }
+
+    elif snapshot.kind == "polygon":
+        # I poligoni per YOLOv8 segmentation sono spesso una lista piatta di coordinate normalizzate
+        # Esempio: [x1_norm, y1_norm, x2_norm, y2_norm, ...]
+
+        # Qui estraiamo i punti come lista di tuple (x, y)
+        annotation["coordinates"] = _export_points(snapshot, simplify_tolerance, include_original, annotation)
+        # Se il poligono è chiuso, puoi indicarlo
+        annotation["is_closed"] = snapshot.is_closed
+
+    elif snapshot.kind == "polyline":
+        annotation["coordinates"] = _export_points(snapshot, simplify_tolerance, include_original, annotation)
+        # Le polilinee sono per definizione aperte, non hanno is_closed
+
+    return annotation
+
+def annotation_to_snapshot(annotation):
+    """
+    Operazione inversa di snapshot_to_annotation: ricava la copia di una forma da un'annotazione
+    nel formato JSON esportato (es. letta con json.load). I file esportati prima delle etichette
+    non hanno "label": le loro forme ricevono DEFAULT_LABEL.
+    """
+    kind = annotation["type"]
+    coordinates = annotation["coordinates"]
+    label = annotation.get("label") or DEFAULT_LABEL
+    if kind == "rectangle":
+        coords = (coordinates["x1"], coordinates["y1"], coordinates["x2"], coordinates["y2"])
+        return ShapeSnapshot(kind, coords, coordinates.get("angle_rad", 0.0), None, None, True, label)
+    if kind == "circle":
+        return ShapeSnapshot(kind, (coordinates["cx"], coordinates["cy"], coordinates["radius"]), 0.0, None, None, True, label)
+    if kind == "ellipse":
+        coords = (coordinates["x1"], coordinates["y1"], coordinates["x2"], coordinates["y2"])
+        return ShapeSnapshot(kind, coords, 0.0, None, None, True, label)
+    if kind in ("polygon", "polyline"):
+        points = tuple((p[0], p[1]) for p in coordinates)
+        original = annotation.get("original_coordinates")
+        original = tuple((p[0], p[1]) for p in original) if original is not None else None
+        return ShapeSnapshot(kind, None, 0.0, points, original, kind == "polygon" and annotation.get("is_closed", False), label)
+    raise ValueError(f"Tipo di annotazione sconosciuto: {kind}")
+
+def shapes_from_snapshot(canvas, snapshot):
+    """Crea le forme interattive (non ancora disegnate) corrispondenti a una tupla di ShapeSnapshot."""
+    shapes = []
+    for shape_snapshot in snapshot:
+        kind = shape_snapshot.kind
+        if kind == "rectangle":
+            shape = InteractiveRectangle(canvas, *shape_snapshot.coords)
+            if shape_snapshot.angle:
+                shape.set_angle(shape_snapshot.angle)
+        elif kind == "circle":
+            shape = InteractiveCircle(canvas, *shape_snapshot.coords)
+        elif kind == "ellipse":
+            shape = InteractiveEllipse(canvas, *shape_snapshot.coords)
+        else:
+            shape = InteractivePolygon(canvas) if kind == "polygon" else InteractivePolyline(canvas)
+            original = list(shape_snapshot.original_points) if shape_snapshot.original_points is not None else None
+            shape.set_points(shape_snapshot.points, original)
+            if kind == "polygon":
+                shape.is_closed = shape_snapshot.is_closed
+        shape.label_id = LABELS.intern(shape_snapshot.label) # Registra le etichette nuove (es. da un file)
+        shapes.append(shape)
+    return shapes
+
+def _write_atomic(write, filename, suffix):
+    """
+    Scrive su un file temporaneo nella stessa cartella (con write(file)) e lo rinomina su filename:
+    chi legge il file vede sempre la versione precedente completa o quella nuova, mai una scrittura a metà.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp_", suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            write(f)
+        os.replace(temp_path, filename)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_json_atomic(data, filename):
+    """Scrive data in formato JSON su filename in modo atomico (vedi _write_atomic)."""
+    _write_atomic(lambda f: json.dump(data, f, indent=4), filename, ".json")
+
+def write_text_atomic(text, filename):
+    """Scrive il testo su filename in modo atomico (vedi _write_atomic)."""
+    _write_atomic(lambda f: f.write(text), filename, os.path.splitext(filename)[1])
+
+def export_annotations_to_json(shapes, image_width, image_height, filename="annotations.json",
+                               simplify_tolerance=None, include_original=False):
     """
     Estrae le coordinate delle forme disegnate e le salva in un file JSON.
     Il formato JSON sarà strutturato per essere leggibile e potenzialmente convertibile
     in formati specifici per il training (es. YOLOv8).
+    Versione sincrona: per non bloccare l'interfaccia usare ExportWorker (background_export.py);
+    per scrivere più formati (YOLO, COCO, CSV, VOC) con un solo passaggio usare export_pipeline.run_export.
 
     Args:
         shapes (list): Una lista di oggetti forma (InteractiveRectangle, InteractiveCircle, etc.).
         image_width (int): La larghezza dell'immagine su cui sono state disegnate le forme.
         image_height (int): L'altezza dell'immagine su cui sono state disegnate le forme.
         filename (str): Il nome del file JSON in cui salvare le annotazioni.
+        simplify_tolerance (float): Se indicata, poligoni e polilinee vengono esportati semplificati
+            con Douglas-Peucker (tolleranza in pixel), senza modificare le forme.
+        include_original (bool): Se True, esporta anche i vertici a piena risoluzione quando differiscono.
     """
-    annotations_data = []
-
-    for i, shape in enumerate(shapes):
-        annotation = {
-            "id": i,
-            "type": "",
-            "coordinates": {}
-        }
-
-        if isinstance(shape, InteractiveRectangle):
-            annotation["type"] = "rectangle"
-            annotation["coordinates"] = {
-                "x1": int(shape.x1),
-                "y1": int(shape.y1),
-                "x2": int(shape.x2),
-                "y2": int(shape.y2),
-                "angle_rad": shape.angle, # Angolo in radianti
-                "angle_deg": math.degrees(shape.angle) # Angolo in gradi per comodità
-            }
-            # Puoi anche aggiungere il centro normalizzato, larghezza e altezza per YOLO bounding box
-            # cx_norm = ((shape.x1 + shape.x2) / 2) / image_width
-            # cy_norm = ((shape.y1 + shape.y2) / 2) / image_height
-            # w_norm = (shape.x2 - shape.x1) / image_width
-            # h_norm = (shape.y2 - shape.y1) / image_height
-            # annotation["yolo_bbox_normalized"] = [cx_norm, cy_norm, w_norm, h_norm]
-
-        elif isinstance(shape, InteractiveCircle):
-            annotation["type"] = "circle"
-            annotation["coordinates"] = {
-                "cx": int(shape.cx),
-                "cy": int(shape.cy),
-                "radius": int(shape.radius)
-            }
-
-        elif isinstance(shape, InteractiveEllipse):
-            annotation["type"] = "ellipse"
-            annotation["coordinates"] = {
-                "x1": int(shape.x1),
-                "y1": int(shape.y1),
-                "x2": int(shape.x2),
-                "y2": int(shape.y2)
-            }
-
-        elif isinstance(shape, InteractivePolygon):
-            annotation["type"] = "polygon"
-            # I poligoni per YOLOv8 segmentation sono spesso una lista piatta di coordinate normalizzate
-            # Esempio: [x1_norm, y1_norm, x2_norm, y2_norm, ...]
-            
-            # Qui estraiamo i punti come lista di tuple (x, y)
-            annotation["coordinates"] = [
-                (int(p[0]), int(p[1])) for p in shape.points
-            ]
-            # Se il poligono è chiuso, puoi indicarlo
-            annotation["is_closed"] = shape.is_closed
-
-        elif isinstance(shape, InteractivePolyline):
-            annotation["type"] = "polyline"
-            annotation["coordinates"] = [
-                (int(p[0]), int(p[1])) for p in shape.points
-            ]
-            # Le polilinee sono per definizione aperte, non hanno is_closed
-
-        annotations_data.append(annotation)
+    annotations_data = [snapshot_to_annotation(i, snapshot, simplify_tolerance, include_original)
+                        for i, snapshot in enumerate(snapshot_shapes(shapes))]
 
     try:
-        with open(filename, 'w') as f:
-            json.dump(annotations_data, f, indent=4)
+        write_json_atomic(annotations_data, filename)
         print(f"Annotazioni esportate con successo in {filename}")
     except IOError as e:
         print(f"Errore durante l'esportazione delle annotazioni: {e}")
-
@@ -0,0 +1,341 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sqlite3
+from collections import namedtuple
+from image_utils import read_image_size
+from annotation_exporter import snapshot_to_annotation
+from session_format import load_session_snapshot, SessionFormatError, SESSION_EXTENSION
+
+# --- Configurazioni Globali dell'Indice delle Annotazioni ---
+DEFAULT_INDEX_PATH = "annotations_index.sqlite" # Database predefinito dell'indice
+ANNOTATION_FILE_SUFFIX = "_annotations.json" # File prodotti da export_current_annotations
+SESSION_FILE_SUFFIX = "_session" + SESSION_EXTENSION # File prodotti da save_current_session
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp") # Usate per trovare l'immagine di un file di annotazioni
+
+# Forma restituita dalle interrogazioni: annotation è il dizionario nel layout JSON esportato
+IndexedShape = namedtuple("IndexedShape", ["path", "shape_index", "type", "bbox", "area", "annotation"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    image_width INTEGER,
+    image_height INTEGER,
+    shape_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    shape_index INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    min_x REAL NOT NULL,
+    min_y REAL NOT NULL,
+    max_x REAL NOT NULL,
+    max_y REAL NOT NULL,
+    width REAL NOT NULL,
+    height REAL NOT NULL,
+    area REAL NOT NULL,
+    vertex_count INTEGER NOT NULL,
+    geometry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shapes_file ON shapes(file_id);
+CREATE INDEX IF NOT EXISTS shapes_type ON shapes(type, file_id);
+"""
+
+# --- Geometria delle annotazioni ---
+def annotation_geometry(annotation):
+    """
+    Calcola riquadro, area e numero di vertici di un'annotazione nel layout JSON esportato.
+    Returns:
+        tuple: (min_x, min_y, max_x, max_y, area, numero di vertici).
+    """
+    kind = annotation["type"]
+    coordinates = annotation["coordinates"]
+    if kind == "rectangle":
+        x1, y1, x2, y2 = coordinates["x1"], coordinates["y1"], coordinates["x2"], coordinates["y2"]
+        angle = coordinates.get("angle_rad", 0.0)
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        half_w, half_h = abs(x2 - x1) / 2, abs(y2 - y1) / 2
+        # Semiassi del riquadro che contiene il rettangolo ruotato
+        extent_x = half_w * abs(math.cos(angle)) + half_h * abs(math.sin(angle))
+        extent_y = half_w * abs(math.sin(angle)) + half_h * abs(math.cos(angle))
+        return cx - extent_x, cy - extent_y, cx + extent_x, cy + extent_y, 4 * half_w * half_h, 4
+    if kind == "circle":
+        cx, cy, radius = coordinates["cx"], coordinates["cy"], coordinates["radius"]
+        return cx - radius, cy - radius, cx + radius, cy + radius, math.pi * radius ** 2, 0
+    if kind == "ellipse":
+        x1, y1, x2, y2 = coordinates["x1"], coordinates["y1"], coordinates["x2"], coordinates["y2"]
+        area = math.pi * abs(x2 - x1) * abs(y2 - y1) / 4
+        return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2), area, 0
+
+    # Poligoni e polilinee: l'area (formula di Gauss) ha senso solo per i poligoni chiusi
+    if not coordinates:
+        return 0, 0, 0, 0, 0, 0
+    xs = [p[0] for p in coordinates]
+    ys = [p[1] for p in coordinates]
+    area = 0.0
+    if kind == "polygon" and annotation.get("is_closed") and len(coordinates) > 2:
+        area = abs(sum(xs[i - 1] * ys[i] - xs[i] * ys[i - 1] for i in range(len(xs)))) / 2
+    return min(xs), min(ys), max(xs), max(ys), area, len(coordinates)
+
+def _read_annotation_file(path, image_dir=None):
+    """
+    Legge un file di annotazioni (JSON esportato o sessione binaria).
+    Returns:
+        tuple: (lista di annotazioni nel layout JSON, larghezza, altezza) con le dimensioni None se sconosciute.
+    """
+    if path.endswith(SESSION_EXTENSION):
+        snapshot, width, height = load_session_snapshot(path)
+        annotations = [snapshot_to_annotation(i, shape) for i, shape in enumerate(snapshot)]
+        if width and height:
+            return annotations, width, height
+    else:
+        with open(path, 'r') as f:
+            annotations = json.load(f)
+
+    # L'esportazione JSON non contiene le dimensioni dell'immagine: le legge dall'intestazione dell'immagine
+    size = find_image_size(path, image_dir)
+    width, height = size if size is not None else (None, None)
+    return annotations, width, height
+
+def find_image_path(annotation_path, image_dir=None):
+    """Cerca l'immagine che ha lo stesso nome base del file di annotazioni. Restituisce None se non esiste."""
+    name = os.path.basename(annotation_path)
+    for suffix in (ANNOTATION_FILE_SUFFIX, SESSION_FILE_SUFFIX):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    directory = image_dir or os.path.dirname(annotation_path)
+    for extension in IMAGE_EXTENSIONS:
+        for candidate in (extension, extension.upper()):
+            image_path = os.path.join(directory, name + candidate)
+            if os.path.exists(image_path):
+                return image_path
+    return None
+
+def find_image_size(annotation_path, image_dir=None):
+    """Cerca l'immagine che ha lo stesso nome base del file di annotazioni e ne legge le dimensioni."""
+    image_path = find_image_path(annotation_path, image_dir)
+    return read_image_size(image_path) if image_path is not None else None
+
+# --- Indice ---
+class AnnotationIndex:
+    """
+    Indice SQLite delle annotazioni di un intero dataset. Ogni forma è una riga della tabella shapes
+    (con il dizionario dell'annotazione in formato JSON), e il suo riquadro è in una tabella virtuale R-tree,
+    quindi le interrogazioni non rileggono mai i file di annotazioni.
+    L'indicizzazione è incrementale: vengono rielaborati solo i file nuovi o modificati (mtime e dimensione).
+    """
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(_SCHEMA)
+        try:
+            self.connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS shape_bbox USING rtree(id, min_x, max_x, min_y, max_y)")
+            self.has_rtree = True
+        except sqlite3.OperationalError:
+            # SQLite compilato senza R-tree: stessa tabella, stesse interrogazioni, senza indice spaziale
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS shape_bbox (id INTEGER PRIMARY KEY, min_x REAL, max_x REAL, min_y REAL, max_y REAL)")
+            self.has_rtree = False
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # --- Indicizzazione ---
+    def index_directory(self, directory, image_dir=None, recursive=False):
+        """
+        Indicizza i file di annotazioni (*_annotations.json e *_session.anns) di una cartella.
+        I file già indicizzati e non modificati vengono saltati; quelli spariti dalla cartella vengono rimossi dall'indice,
+        come quelli modificati che non si riescono più a leggere (verranno riletti alla prossima indicizzazione).
+        Args:
+            directory (str): Cartella che contiene i file di annotazioni.
+            image_dir (str): Cartella delle immagini, se diversa (serve a leggerne le dimensioni).
+            recursive (bool): Se True cerca anche nelle sottocartelle.
+        Returns:
+            dict: Numero di file "added", "updated", "unchanged", "removed" e "failed".
+        """
+        directory = os.path.abspath(directory)
+        pattern_dir = os.path.join(directory, "**") if recursive else directory
+        paths = set()
+        for suffix in (ANNOTATION_FILE_SUFFIX, SESSION_FILE_SUFFIX):
+            paths.update(glob.glob(os.path.join(pattern_dir, "*" + suffix), recursive=recursive))
+
+        prefix = os.path.join(directory, "") # Percorsi indicizzati che stanno sotto la cartella
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        known = {path: (file_id, mtime_ns, size) for file_id, path, mtime_ns, size in
+                 self.connection.execute("SELECT id, path, mtime_ns, size FROM files WHERE substr(path, 1, ?) = ?",
+                                         (len(prefix), prefix))}
+
+        with self.connection: # Un'unica transazione per tutta la cartella
+            for path in sorted(paths):
+                stat = os.stat(path)
+                previous = known.get(path)
+                if previous is not None and previous[1:] == (stat.st_mtime_ns, stat.st_size):
+                    stats["unchanged"] += 1
+                    continue
+                try:
+                    annotations, width, height = _read_annotation_file(path, image_dir)
+                except (IOError, ValueError, KeyError, SessionFormatError) as e:
+                    print(f"Errore durante l'indicizzazione di {path}: {e}")
+                    stats["failed"] += 1
+                    if previous is not None: # Le forme della versione precedente non descrivono più il file
+                        self._remove_file(previous[0])
+                    continue
+                if previous is not None:
+                    self._remove_file(previous[0])
+                self._insert_file(path, stat, annotations, width, height)
+                stats["updated" if previous is not None else "added"] += 1
+
+            for path, (file_id, _, _) in known.items():
+                in_scope = recursive or os.path.dirname(path) == directory
+                if in_scope and path not in paths:
+                    self._remove_file(file_id)
+                    stats["removed"] += 1
+        return stats
+
+    def _insert_file(self, path, stat, annotations, width, height):
+        cursor = self.connection.execute(
+            "INSERT INTO files (path, mtime_ns, size, image_width, image_height, shape_count) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, stat.st_mtime_ns, stat.st_size, width, height, len(annotations)))
+        file_id = cursor.lastrowid
+
+        shape_rows = []
+        for i, annotation in enumerate(annotations):
+            min_x, min_y, max_x, max_y, area, vertex_count = annotation_geometry(annotation)
+            shape_rows.append((file_id, annotation.get("id", i), annotation["type"], min_x, min_y, max_x, max_y,
+                               max_x - min_x, max_y - min_y, area, vertex_count, json.dumps(annotation)))
+        self.connection.executemany(
+            "INSERT INTO shapes (file_id, shape_index, type, min_x, min_y, max_x, max_y, width, height, area, vertex_count, geometry) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", shape_rows)
+        # Le righe appena inserite hanno id consecutivi: il riquadro va nell'R-tree con lo stesso id
+        self.connection.execute(
+            "INSERT INTO shape_bbox (id, min_x, max_x, min_y, max_y) "
+            "SELECT id, min_x, max_x, min_y, max_y FROM shapes WHERE file_id = ?", (file_id,))
+
+    def _remove_file(self, file_id):
+        self.connection.execute("DELETE FROM shape_bbox WHERE id IN (SELECT id FROM shapes WHERE file_id = ?)", (file_id,))
+        self.connection.execute("DELETE FROM shapes WHERE file_id = ?", (file_id,))
+        self.connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    # --- Interrogazioni ---
+    def images_with(self, shape_type=None, min_count=1, max_count=None):
+        """
+        File di annotazioni che contengono almeno min_count (e al più max_count) forme del tipo indicato.
+        Esempio: images_with("polygon", min_count=51) -> immagini con più di 50 poligoni.
+        Returns:
+            list: Coppie (percorso del file, numero di forme), dalla più numerosa.
+        """
+        conditions, params = [], []
+        if shape_type is not None:
+            conditions.append("s.type = ?")
+            params.append(shape_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        having = "HAVING COUNT(*) >= ?"
+        params.append(min_count)
+        if max_count is not None:
+            having += " AND COUNT(*) <= ?"
+            params.append(max_count)
+        query = (f"SELECT f.path, COUNT(*) FROM shapes s JOIN files f ON f.id = s.file_id {where} "
+                 f"GROUP BY s.file_id {having} ORDER BY COUNT(*) DESC, f.path")
+        return self.connection.execute(query, params).fetchall()
+
+    def query_shapes(self, shape_type=None, region=None, min_area=None, max_area=None, min_width=None,
+                     min_height=None, near_border=None, path=None, limit=None):
+        """
+        Restituisce le forme indicizzate che soddisfano tutti i criteri indicati (senza leggere i file).
+        Args:
+            shape_type (str): "rectangle", "circle", "ellipse", "polygon" o "polyline".
+            region (tuple): (x1, y1, x2, y2): solo le forme il cui riquadro interseca la regione (tramite R-tree).
+            min_area, max_area (float): Limiti sull'area della forma in pixel quadrati.
+            min_width, min_height (float): Dimensioni minime del riquadro in pixel.
+            near_border (float): Solo le forme il cui riquadro arriva entro questa distanza (pixel) dal bordo
+                dell'immagine. I file con dimensioni dell'immagine sconosciute (immagine non trovata) sono
+                esclusi: unsized_files() li elenca.
+            path (str): Limita la ricerca a un file di annotazioni.
+            limit (int): Numero massimo di risultati.
+        Returns:
+            list: Lista di IndexedShape.
+        """
+        conditions, params = [], []
+        if shape_type is not None:
+            conditions.append("s.type = ?")
+            params.append(shape_type)
+        if region is not None:
+            x1, y1, x2, y2 = region
+            conditions.append("s.id IN (SELECT id FROM shape_bbox WHERE max_x >= ? AND min_x <= ? AND max_y >= ? AND min_y <= ?)")
+            params.extend((min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)))
+        for column, operator, value in (("s.area", ">=", min_area), ("s.area", "<=", max_area),
+                                        ("s.width", ">=", min_width), ("s.height", ">=", min_height)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        if near_border is not None:
+            conditions.append("f.image_width IS NOT NULL AND (s.min_x <= ? OR s.min_y <= ? "
+                              "OR s.max_x >= f.image_width - ? OR s.max_y >= f.image_height - ?)")
+            params.extend((near_border,) * 4)
+        if path is not None:
+            conditions.append("f.path = ?")
+            params.append(os.path.abspath(path))
+
+        query = ("SELECT f.path, s.shape_index, s.type, s.min_x, s.min_y, s.max_x, s.max_y, s.area, s.geometry "
+                 "FROM shapes s JOIN files f ON f.id = s.file_id")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY f.path, s.shape_index"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return [IndexedShape(row[0], row[1], row[2], tuple(row[3:7]), row[7], json.loads(row[8]))
+                for row in self.connection.execute(query, params)]
+
+    def unsized_files(self):
+        """File indicizzati di cui non si conoscono le dimensioni dell'immagine (esclusi dai filtri near_border)."""
+        return [path for path, in self.connection.execute("SELECT path FROM files WHERE image_width IS NULL ORDER BY path")]
+
+    def summary(self):
+        """Numero di forme indicizzate per tipo."""
+        return dict(self.connection.execute("SELECT type, COUNT(*) FROM shapes GROUP BY type"))
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indice SQLite delle annotazioni esportate.")
+    parser.add_argument("directory", help="Cartella con i file *_annotations.json / *_session.anns")
+    parser.add_argument("--db", default=DEFAULT_INDEX_PATH, help="Percorso del database dell'indice")
+    parser.add_argument("--images", default=None, help="Cartella delle immagini (per le dimensioni)")
+    parser.add_argument("--recursive", action="store_true", help="Cerca anche nelle sottocartelle")
+    parser.add_argument("--type", default=None, help="Tipo di forma da cercare")
+    parser.add_argument("--min-count", type=int, default=None, help="Elenca le immagini con almeno questo numero di forme")
+    parser.add_argument("--min-area", type=float, default=None, help="Area minima delle forme cercate")
+    parser.add_argument("--near-border", type=float, default=None, help="Distanza massima dal bordo delle forme cercate")
+    args = parser.parse_args()
+
+    with AnnotationIndex(args.db) as index:
+        print(f"Indicizzazione completata: {index.index_directory(args.directory, args.images, args.recursive)}")
+        if args.min_count is not None:
+            for path, count in index.images_with(args.type, args.min_count):
+                print(f"{count:6d}  {path}")
+        elif args.type or args.min_area is not None or args.near_border is not None:
+            for shape in index.query_shapes(args.type, min_area=args.min_area, near_border=args.near_border):
+                print(f"{shape.path}  #{shape.shape_index}  {shape.type}  bbox={shape.bbox}  area={shape.area:.0f}")
+            unsized = index.unsized_files() if args.near_border is not None else []
+            if unsized:
+                print(f"Esclusi da --near-border (dimensioni dell'immagine sconosciute): {len(unsized)} file, "
+                      f"es. {unsized[0]}")
+        else:
+            print(f"Forme indicizzate: {index.summary()}")
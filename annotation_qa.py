@@ -0,0 +1,326 @@
+import argparse
+import glob
+import json
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from interactive_shapes import HANDLE_SIZE
+from annotation_index import find_image_size, ANNOTATION_FILE_SUFFIX
+
+# --- Configurazioni Globali del Controllo Qualità ---
+QA_DUPLICATE_IOU = 0.95 # IoU oltre la quale due forme dello stesso tipo sono considerate duplicate
+QA_OVERLAP_IOU = 0.8 # IoU oltre la quale due forme si sovrappongono quasi completamente
+QA_MIN_SIZE = HANDLE_SIZE # Lato minimo (pixel) del riquadro di una forma, come i limiti applicati in on_mouse_up
+QA_MIN_AREA = HANDLE_SIZE * HANDLE_SIZE / 2 # Area minima (pixel quadrati) di una forma chiusa
+QA_ELLIPSE_SEGMENTS = 32 # Lati del poligono che approssima cerchi e ovali (intersezioni non circolari)
+QA_RASTER_SIZE = 256 # Risoluzione massima della maschera usata per le coppie con poligoni non convessi
+QA_BLOCK_SIZE = 128 # Righe confrontate per blocco nella ricerca vettoriale delle coppie candidate
+
+# Problema trovato: kind è "duplicate", "overlap", "degenerate", "out_of_bounds" o "outside";
+# ids sono gli id delle annotazioni coinvolte (indici nella lista delle forme)
+QAIssue = namedtuple("QAIssue", ["kind", "ids", "value", "message"])
+
+# --- Geometria ---
+class _Geometry:
+    """
+    Rappresentazione comune di tutte le annotazioni: array allineati, un elemento per forma.
+    Riquadri e aree di rettangoli, cerchi e ovali sono calcolati con operazioni vettoriali per tipo;
+    i vertici (necessari solo per le poche coppie da intersecare) sono generati su richiesta.
+    """
+    def __init__(self, annotations):
+        n = len(annotations)
+        self.annotations = annotations
+        self.ids = np.array([a.get("id", i) for i, a in enumerate(annotations)], dtype=np.int64)
+        self.types = np.array([a["type"] for a in annotations])
+        self.bboxes = np.zeros((n, 4), dtype=np.float64)
+        self.sizes = np.zeros((n, 2), dtype=np.float64) # Larghezza e altezza proprie (lati del rettangolo anche se ruotato)
+        self.areas = np.zeros(n, dtype=np.float64)
+        self.closed = np.zeros(n, dtype=bool) # Forme con un'area (le polilinee e i poligoni aperti no)
+        self.axis_aligned = np.zeros(n, dtype=bool) # Rettangoli non ruotati: IoU esatta dai soli riquadri
+        self.circles = np.full((n, 3), np.nan) # cx, cy, raggio per i cerchi: IoU esatta in forma chiusa
+        self.convex = np.zeros(n, dtype=bool)
+        self.vertex_counts = np.zeros(n, dtype=np.int64)
+        self._points = {} # indice -> vertici (M, 2) float32, per poligoni e polilinee
+
+        rects = np.flatnonzero(self.types == "rectangle")
+        if len(rects):
+            c = np.array([self._box(annotations[i]["coordinates"]) + (annotations[i]["coordinates"].get("angle_rad", 0.0),)
+                          for i in rects.tolist()], dtype=np.float64).reshape(-1, 5)
+            cx, cy = (c[:, 0] + c[:, 2]) / 2, (c[:, 1] + c[:, 3]) / 2
+            half_w, half_h = np.abs(c[:, 2] - c[:, 0]) / 2, np.abs(c[:, 3] - c[:, 1]) / 2
+            cos_a, sin_a = np.abs(np.cos(c[:, 4])), np.abs(np.sin(c[:, 4]))
+            extent_x, extent_y = half_w * cos_a + half_h * sin_a, half_w * sin_a + half_h * cos_a
+            self.bboxes[rects] = np.column_stack((cx - extent_x, cy - extent_y, cx + extent_x, cy + extent_y))
+            self.sizes[rects] = np.column_stack((2 * half_w, 2 * half_h))
+            self.areas[rects] = 4 * half_w * half_h
+            self.axis_aligned[rects] = (sin_a < 1e-9) | (cos_a < 1e-9)
+            self.convex[rects] = True
+            self.closed[rects] = True
+            self.vertex_counts[rects] = 4
+
+        circles = np.flatnonzero(self.types == "circle")
+        if len(circles):
+            c = np.array([[annotations[i]["coordinates"][k] for k in ("cx", "cy", "radius")] for i in circles.tolist()],
+                         dtype=np.float64).reshape(-1, 3)
+            self.circles[circles] = c
+            self.bboxes[circles] = np.column_stack((c[:, 0] - c[:, 2], c[:, 1] - c[:, 2], c[:, 0] + c[:, 2], c[:, 1] + c[:, 2]))
+            self.areas[circles] = np.pi * c[:, 2] ** 2
+
+        ellipses = np.flatnonzero(self.types == "ellipse")
+        if len(ellipses):
+            c = np.array([self._box(annotations[i]["coordinates"]) for i in ellipses.tolist()], dtype=np.float64).reshape(-1, 4)
+            self.bboxes[ellipses] = np.column_stack((np.minimum(c[:, 0], c[:, 2]), np.minimum(c[:, 1], c[:, 3]),
+                                                     np.maximum(c[:, 0], c[:, 2]), np.maximum(c[:, 1], c[:, 3])))
+            self.areas[ellipses] = np.pi * np.abs(c[:, 2] - c[:, 0]) * np.abs(c[:, 3] - c[:, 1]) / 4
+
+        round_shapes = np.concatenate((circles, ellipses))
+        self.sizes[round_shapes] = self.bboxes[round_shapes, 2:] - self.bboxes[round_shapes, :2]
+        self.convex[round_shapes] = True
+        self.closed[round_shapes] = True
+
+        for i in np.flatnonzero((self.types == "polygon") | (self.types == "polyline")).tolist():
+            points = np.asarray(annotations[i]["coordinates"], dtype=np.float64).reshape(-1, 2)
+            self._points[i] = points.astype(np.float32)
+            self.vertex_counts[i] = len(points)
+            if len(points):
+                self.bboxes[i] = (*points.min(axis=0), *points.max(axis=0))
+                self.sizes[i] = self.bboxes[i, 2:] - self.bboxes[i, :2]
+            if self.types[i] == "polygon" and annotations[i].get("is_closed") and len(points) > 2:
+                self.closed[i] = True
+                x, y = points[:, 0], points[:, 1]
+                self.areas[i] = abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2 # Formula di Gauss
+                self.convex[i] = bool(cv2.isContourConvex(self._points[i]))
+
+    @staticmethod
+    def _box(coordinates):
+        return coordinates["x1"], coordinates["y1"], coordinates["x2"], coordinates["y2"]
+
+    def polygon(self, i):
+        """Vertici (M, 2) float32 della forma i; cerchi e ovali sono approssimati con QA_ELLIPSE_SEGMENTS lati."""
+        if i in self._points:
+            return self._points[i]
+        coordinates = self.annotations[i]["coordinates"]
+        if self.types[i] == "rectangle":
+            x1, y1, x2, y2 = self._box(coordinates)
+            angle = coordinates.get("angle_rad", 0.0)
+            half = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * (abs(x2 - x1) / 2, abs(y2 - y1) / 2)
+            cos_a, sin_a = math.cos(angle), math.sin(angle)
+            points = half @ np.array([[cos_a, sin_a], [-sin_a, cos_a]]) + ((x1 + x2) / 2, (y1 + y2) / 2)
+        else:
+            x_min, y_min, x_max, y_max = self.bboxes[i]
+            t = np.linspace(0, 2 * np.pi, QA_ELLIPSE_SEGMENTS, endpoint=False)
+            points = np.column_stack(((x_min + x_max) / 2 + (x_max - x_min) / 2 * np.cos(t),
+                                      (y_min + y_max) / 2 + (y_max - y_min) / 2 * np.sin(t)))
+        self._points[i] = points.astype(np.float32)
+        return self._points[i]
+
+# --- Coppie candidate (potatura spaziale + broadcasting) ---
+def _candidate_pairs(geometry, min_iou):
+    """
+    Coppie (i, j), i < j, di forme chiuse i cui riquadri si intersecano abbastanza da poter avere IoU >= min_iou.
+    Le forme sono ordinate per x minima: ogni blocco di righe viene confrontato (con broadcasting)
+    solo con le forme che iniziano prima della fine del blocco.
+    """
+    index = np.flatnonzero(geometry.closed & (geometry.areas > 0))
+    if len(index) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    index = index[np.argsort(geometry.bboxes[index, 0], kind="stable")]
+    boxes = geometry.bboxes[index]
+    areas = geometry.areas[index]
+
+    pairs_i, pairs_j = [], []
+    for start in range(0, len(index), QA_BLOCK_SIZE):
+        rows = slice(start, min(start + QA_BLOCK_SIZE, len(index)))
+        # Colonne candidate: successive alla prima riga del blocco e con x minima entro la x massima del blocco
+        end = np.searchsorted(boxes[:, 0], boxes[rows, 2].max(), side="right")
+        if end <= start + 1:
+            continue
+        cols = slice(start, end)
+        a, b = boxes[rows, None, :], boxes[None, cols, :]
+        inter_w = np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+        inter_h = np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+        inter = np.maximum(inter_w, 0) * np.maximum(inter_h, 0)
+        # Limite superiore dell'IoU: intersezione dei riquadri / area maggiore (confronto senza divisione)
+        mask = inter >= min_iou * np.maximum(areas[rows, None], areas[None, cols])
+        mask &= np.arange(cols.start, cols.stop)[None, :] > np.arange(rows.start, rows.stop)[:, None]
+        ii, jj = np.nonzero(mask)
+        pairs_i.append(index[ii + rows.start])
+        pairs_j.append(index[jj + cols.start])
+    if not pairs_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+# --- IoU ---
+def _iou_axis_aligned(boxes_a, boxes_b):
+    inter_w = np.clip(np.minimum(boxes_a[:, 2], boxes_b[:, 2]) - np.maximum(boxes_a[:, 0], boxes_b[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(boxes_a[:, 3], boxes_b[:, 3]) - np.maximum(boxes_a[:, 1], boxes_b[:, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return inter / (area_a + area_b - inter)
+
+def _iou_circles(circles_a, circles_b):
+    """IoU esatta tra coppie di cerchi (area della lente di intersezione in forma chiusa)."""
+    r1, r2 = circles_a[:, 2], circles_b[:, 2]
+    d = np.hypot(circles_a[:, 0] - circles_b[:, 0], circles_a[:, 1] - circles_b[:, 1])
+    inter = np.zeros(len(d))
+    inside = d <= np.abs(r1 - r2)
+    inter[inside] = np.pi * np.minimum(r1, r2)[inside] ** 2
+    lens = (d < r1 + r2) & ~inside
+    if lens.any():
+        d_l, r1_l, r2_l = d[lens], r1[lens], r2[lens]
+        a1 = r1_l ** 2 * np.arccos(np.clip((d_l ** 2 + r1_l ** 2 - r2_l ** 2) / (2 * d_l * r1_l), -1, 1))
+        a2 = r2_l ** 2 * np.arccos(np.clip((d_l ** 2 + r2_l ** 2 - r1_l ** 2) / (2 * d_l * r2_l), -1, 1))
+        k = (-d_l + r1_l + r2_l) * (d_l + r1_l - r2_l) * (d_l - r1_l + r2_l) * (d_l + r1_l + r2_l)
+        inter[lens] = a1 + a2 - 0.5 * np.sqrt(np.clip(k, 0, None))
+    return inter / (np.pi * r1 ** 2 + np.pi * r2 ** 2 - inter)
+
+def _iou_raster(poly_a, poly_b):
+    """IoU approssimata su una maschera (per poligoni non convessi), alla risoluzione QA_RASTER_SIZE."""
+    both = np.vstack((poly_a, poly_b))
+    origin = both.min(axis=0)
+    scale = QA_RASTER_SIZE / max(float((both.max(axis=0) - origin).max()), 1.0)
+    size = (QA_RASTER_SIZE + 2, QA_RASTER_SIZE + 2)
+    mask_a = np.zeros(size, dtype=np.uint8)
+    mask_b = np.zeros(size, dtype=np.uint8)
+    cv2.fillPoly(mask_a, [np.round((poly_a - origin) * scale).astype(np.int32)], 1)
+    cv2.fillPoly(mask_b, [np.round((poly_b - origin) * scale).astype(np.int32)], 1)
+    union = np.count_nonzero(mask_a | mask_b)
+    return np.count_nonzero(mask_a & mask_b) / union if union else 0.0
+
+def pairwise_iou(geometry, min_iou):
+    """
+    IoU delle coppie candidate con IoU potenziale >= min_iou.
+    Rettangoli non ruotati e cerchi: formula esatta vettoriale; forme convesse: intersezione
+    convessa esatta (OpenCV); poligoni non convessi: stima su maschera.
+    Returns:
+        tuple: (indici i, indici j, IoU) come array NumPy.
+    """
+    pairs_i, pairs_j = _candidate_pairs(geometry, min_iou)
+    iou = np.zeros(len(pairs_i))
+    if not len(pairs_i):
+        return pairs_i, pairs_j, iou
+
+    aligned = geometry.axis_aligned[pairs_i] & geometry.axis_aligned[pairs_j]
+    iou[aligned] = _iou_axis_aligned(geometry.bboxes[pairs_i[aligned]], geometry.bboxes[pairs_j[aligned]])
+    circles = ~np.isnan(geometry.circles[pairs_i, 0]) & ~np.isnan(geometry.circles[pairs_j, 0])
+    iou[circles] = _iou_circles(geometry.circles[pairs_i[circles]], geometry.circles[pairs_j[circles]])
+
+    for k in np.flatnonzero(~aligned & ~circles):
+        i, j = pairs_i[k], pairs_j[k]
+        if geometry.convex[i] and geometry.convex[j]:
+            inter, _ = cv2.intersectConvexConvex(geometry.polygon(i), geometry.polygon(j))
+            iou[k] = inter / (geometry.areas[i] + geometry.areas[j] - inter)
+        else:
+            iou[k] = _iou_raster(geometry.polygon(i), geometry.polygon(j))
+    return pairs_i, pairs_j, iou
+
+# --- Controlli ---
+def run_qa(annotations, image_width=None, image_height=None, duplicate_iou=QA_DUPLICATE_IOU,
+           overlap_iou=QA_OVERLAP_IOU, min_size=QA_MIN_SIZE, min_area=QA_MIN_AREA):
+    """
+    Esegue tutti i controlli su una lista di annotazioni nel layout JSON esportato.
+    Args:
+        annotations (list): Annotazioni (es. json.load di un file esportato).
+        image_width, image_height (int): Dimensioni dell'immagine; se assenti il controllo dei bordi viene saltato.
+    Returns:
+        list: Lista di QAIssue.
+    """
+    issues = []
+    if not annotations:
+        return issues
+    geometry = _Geometry(annotations)
+    ids = geometry.ids
+
+    # Forme degeneri (controlli vettoriali su tutte le forme)
+    widths, heights = geometry.sizes[:, 0], geometry.sizes[:, 1]
+    is_line = ~geometry.closed
+    min_vertices = np.select([geometry.types == "polygon", geometry.types == "polyline"], [3, 2], 0)
+    too_few = geometry.vertex_counts < min_vertices
+    too_small = ~is_line & ((widths < min_size) | (heights < min_size) | (geometry.areas < min_area))
+    too_short = is_line & (np.maximum(widths, heights) < min_size)
+    for i in np.flatnonzero(too_few | too_small | too_short).tolist():
+        if too_few[i]:
+            reason = f"{geometry.vertex_counts[i]} vertici"
+        elif too_short[i]:
+            reason = f"lunghezza {max(widths[i], heights[i]):.1f} px"
+        else:
+            reason = f"{widths[i]:.1f}x{heights[i]:.1f} px, area {geometry.areas[i]:.1f} px²"
+        issues.append(QAIssue("degenerate", (int(ids[i]),), float(geometry.areas[i]),
+                              f"Forma {ids[i]} ({geometry.types[i]}) degenere: {reason}"))
+
+    # Bordi dell'immagine
+    if image_width and image_height:
+        boxes = geometry.bboxes
+        outside = (boxes[:, 2] < 0) | (boxes[:, 3] < 0) | (boxes[:, 0] > image_width) | (boxes[:, 1] > image_height)
+        crossing = ~outside & ((boxes[:, 0] < 0) | (boxes[:, 1] < 0) | (boxes[:, 2] > image_width) | (boxes[:, 3] > image_height))
+        inside_w = np.clip(np.minimum(boxes[:, 2], image_width) - np.maximum(boxes[:, 0], 0), 0, None)
+        inside_h = np.clip(np.minimum(boxes[:, 3], image_height) - np.maximum(boxes[:, 1], 0), 0, None)
+        box_area = np.maximum((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), 1e-9)
+        for i in np.flatnonzero(outside).tolist():
+            issues.append(QAIssue("outside", (int(ids[i]),), 0.0, f"Forma {ids[i]} ({geometry.types[i]}) fuori dall'immagine"))
+        for i in np.flatnonzero(crossing).tolist():
+            fraction = float(inside_w[i] * inside_h[i] / box_area[i])
+            issues.append(QAIssue("out_of_bounds", (int(ids[i]),), fraction,
+                                  f"Forma {ids[i]} ({geometry.types[i]}) esce dall'immagine ({fraction:.0%} del riquadro all'interno)"))
+
+    # Duplicati e sovrapposizioni
+    pairs_i, pairs_j, iou = pairwise_iou(geometry, min(duplicate_iou, overlap_iou))
+    for i, j, value in zip(pairs_i.tolist(), pairs_j.tolist(), iou.tolist()):
+        pair = tuple(sorted((int(ids[i]), int(ids[j]))))
+        if value >= duplicate_iou and geometry.types[i] == geometry.types[j]:
+            issues.append(QAIssue("duplicate", pair, value, f"Forme {pair[0]} e {pair[1]} duplicate (IoU {value:.2f})"))
+        elif value >= overlap_iou:
+            issues.append(QAIssue("overlap", pair, value, f"Forme {pair[0]} e {pair[1]} quasi sovrapposte (IoU {value:.2f})"))
+    return issues
+
+# --- Controllo di un intero dataset ---
+def qa_file(path, image_dir=None):
+    """Controlla un file di annotazioni esportato. Returns: (percorso, lista di QAIssue o messaggio di errore)."""
+    try:
+        with open(path, 'r') as f:
+            annotations = json.load(f)
+    except (IOError, ValueError) as e:
+        return path, f"Errore di lettura: {e}"
+    size = find_image_size(path, image_dir)
+    width, height = size if size is not None else (None, None)
+    return path, run_qa(annotations, width, height)
+
+def qa_dataset(directory, image_dir=None, workers=None):
+    """
+    Controlla in parallelo (un processo per CPU) tutti i file *_annotations.json di una cartella.
+    Returns:
+        dict: percorso -> lista di QAIssue (o messaggio di errore).
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "*" + ANNOTATION_FILE_SUFFIX)))
+    with ProcessPoolExecutor(workers) as executor:
+        return dict(executor.map(qa_file, paths, [image_dir] * len(paths), chunksize=max(len(paths) // 64, 1)))
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Controllo qualità delle annotazioni esportate.")
+    parser.add_argument("directory", help="Cartella con i file *_annotations.json")
+    parser.add_argument("--images", default=None, help="Cartella delle immagini (per il controllo dei bordi)")
+    parser.add_argument("--workers", type=int, default=None, help="Numero di processi")
+    parser.add_argument("--report", default=None, help="File JSON in cui salvare il rapporto")
+    args = parser.parse_args()
+
+    results = qa_dataset(args.directory, args.images, args.workers)
+    report = {}
+    totals = {}
+    for path, issues in results.items():
+        if isinstance(issues, str):
+            print(f"{path}: {issues}")
+            report[path] = issues
+            continue
+        for issue in issues:
+            totals[issue.kind] = totals.get(issue.kind, 0) + 1
+            print(f"{os.path.basename(path)}: {issue.message}")
+        report[path] = [issue._asdict() for issue in issues]
+    print(f"File controllati: {len(results)}, problemi: {totals}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,586 @@
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from annotation_exporter import write_json_atomic, annotation_to_snapshot
+from annotation_index import ANNOTATION_FILE_SUFFIX
+
+# --- Configurazioni Globali del Servizio di Annotazione ---
+SERVICE_HOST = "127.0.0.1" # Indirizzo predefinito: il servizio è pensato per la rete locale
+SERVICE_PORT = 8765 # Porta predefinita
+SERVICE_BACKLOG = 1024 # Connessioni in attesa di accettazione (centinaia di client si collegano insieme)
+LONG_POLL_TIMEOUT = 25.0 # Secondi per cui il server trattiene una richiesta di modifiche senza novità
+CHANGE_LOG_LENGTH = 1000 # Modifiche conservate per immagine: un client più indietro riceve lo stato completo
+SAVE_DELAY = 1.0 # Secondi di inattività dopo cui le modifiche di un'immagine vengono scritte su disco
+MAX_BODY_SIZE = 16 * 1024 * 1024 # Dimensione massima (byte, decompressi) del corpo di una richiesta
+COMPRESSION_LEVEL = 6 # Livello zlib dei corpi di richieste e risposte
+SYNC_RETRY_DELAY = 2.0 # Secondi di attesa del client dopo un errore di rete
+SYNC_REQUEST_TIMEOUT = LONG_POLL_TIMEOUT + 10 # Timeout del client (oltre il tempo di attesa del long-poll)
+SYNC_CLOSE_TIMEOUT = 5.0 # Secondi concessi alla chiusura per inviare le ultime modifiche
+
+class ServiceError(Exception):
+    """Risposta di errore del servizio (o risposta non valida)."""
+    pass
+
+# --- Protocollo (HTTP/1.1 con corpi JSON compressi) ---
+# GET  /images/<nome>?since=<versione>&epoch=<epoca>&wait=<secondi>&client=<id>
+#      -> {"epoch": e, "version": v, "full": true, "shapes": {uid: annotazione}}  (prima richiesta, client troppo
+#                                                                                 indietro o di un'altra epoca)
+#      -> {"epoch": e, "version": v, "full": false, "changes": [{"version", "client", "upsert", "remove"}, ...]}
+#      Senza novità la risposta arriva dopo al più wait secondi, con "changes" vuota.
+#      L'epoca identifica il documento caricato dal server: dopo un riavvio le versioni ripartono e quelle
+#      note al client non sono più confrontabili, quindi un'epoca diversa riceve sempre lo stato completo.
+# POST /images/<nome>?client=<id>  corpo {"upsert": {uid: annotazione}, "remove": [uid, ...]}
+#      -> {"version": v}
+# GET  /status -> {"images": n, "shapes": n, "clients": n, "waiting": n}
+# Le risposte di errore (4xx, o 500 per un errore inatteso del servizio) hanno corpo {"error": messaggio}.
+# Le annotazioni sono nel layout JSON nativo (snapshot_to_annotation); ogni forma è identificata da un uid
+# scelto dal client. Ogni POST accettata incrementa la versione dell'immagine: a parità di forma vince
+# l'ultima scrittura ricevuta dal server (last-writer-wins), e i client lo sanno confrontando le versioni.
+def encode_body(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), COMPRESSION_LEVEL)
+
+def decode_body(body):
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(body, MAX_BODY_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ValueError("corpo troppo grande")
+    return json.loads(data.decode("utf-8"))
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def _is_valid_annotation(annotation):
+    """True se l'annotazione è nel layout JSON nativo e l'editor può ricostruirne la forma."""
+    if not isinstance(annotation, dict) or not isinstance(annotation.get("type"), str) or "coordinates" not in annotation:
+        return False
+    try:
+        snapshot = annotation_to_snapshot(annotation)
+    except (KeyError, TypeError, IndexError, ValueError, AttributeError):
+        return False
+    values = list(snapshot.coords or ()) + [snapshot.angle]
+    for points in (snapshot.points, snapshot.original_points):
+        values.extend(coordinate for point in points or () for coordinate in point)
+    return isinstance(snapshot.label, str) and all(_is_number(value) for value in values)
+
+def validate_delta(delta):
+    """
+    Controlla il corpo di una POST prima di applicarlo: un delta non valido, una volta accettato, verrebbe
+    inviato a tutti i client e impedirebbe il salvataggio del file dell'immagine.
+    Returns:
+        tuple: (upsert, remove).
+    Raises:
+        ValueError: Se il delta non è {"upsert": {uid: annotazione}, "remove": [uid, ...]}.
+    """
+    if not isinstance(delta, dict):
+        raise ValueError("delta non valido")
+    upsert, remove = delta.get("upsert", {}), delta.get("remove", [])
+    if not isinstance(upsert, dict) or not isinstance(remove, list) or not all(isinstance(uid, str) for uid in remove):
+        raise ValueError("delta non valido")
+    for uid, annotation in upsert.items():
+        if not _is_valid_annotation(annotation):
+            raise ValueError(f"annotazione non valida: {uid}")
+    return upsert, remove
+
+def build_message(start_line, body=b""):
+    """Messaggio HTTP/1.1 completo (richiesta o risposta) con corpo già codificato (encode_body)."""
+    lines = [start_line, f"Content-Length: {len(body)}"]
+    if body:
+        lines.append("Content-Type: application/json")
+        lines.append("Content-Encoding: deflate")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+async def read_message(reader):
+    """
+    Legge un messaggio HTTP/1.1 (richiesta o risposta) da uno StreamReader.
+    Returns:
+        tuple: (riga iniziale, intestazioni con nomi minuscoli, corpo), o None se la connessione è stata chiusa.
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise ServiceError("corpo troppo grande")
+    body = await reader.readexactly(length) if length else b""
+    return lines[0], headers, body
+
+# --- Archivio delle annotazioni (lato server) ---
+class ImageDocument:
+    """Forme di un'immagine con versione, registro delle ultime modifiche ed evento per i long-poll in attesa."""
+    def __init__(self, shapes=None):
+        self.shapes = dict(shapes or {}) # uid -> annotazione (in ordine di creazione)
+        self.epoch = uuid.uuid4().hex # Cambia a ogni caricamento (es. riavvio del server)
+        self.version = 0
+        self.log = deque(maxlen=CHANGE_LOG_LENGTH) # Modifiche {"version", "client", "upsert", "remove"}
+        self.changed = asyncio.Event() # Sostituito a ogni modifica: chi attende viene risvegliato una volta
+        self.save_handle = None # Salvataggio su disco programmato (None se non ci sono modifiche da scrivere)
+        self._encoded = {} # Versione nota al client -> risposta già compressa (valida fino alla prossima modifica)
+
+    def apply(self, client_id, upsert, remove):
+        """Applica un delta nell'ordine di arrivo (a parità di uid vince l'ultimo) e risveglia chi attende."""
+        for uid in remove:
+            self.shapes.pop(uid, None)
+        self.shapes.update(upsert)
+        self.version += 1
+        self.log.append({"version": self.version, "client": client_id, "upsert": upsert, "remove": list(remove)})
+        self._encoded.clear()
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+        return self.version
+
+    def changes_since(self, version, epoch=None):
+        """Risposta a un client che conosce la versione indicata dell'epoca indicata (None se non ci sono novità)."""
+        if epoch != self.epoch:
+            version = None # Versione di un altro caricamento del documento (es. prima di un riavvio)
+        if version == self.version:
+            return None
+        # Versione sconosciuta o modifiche già uscite dal registro: stato completo
+        if version is None or version > self.version or not self.log or version < self.log[0]["version"] - 1:
+            return {"epoch": self.epoch, "version": self.version, "full": True, "shapes": self.shapes}
+        skip = len(self.log) - (self.version - version)
+        return {"epoch": self.epoch, "version": self.version, "full": False,
+                "changes": [self.log[i] for i in range(skip, len(self.log))]}
+
+    def encoded_changes_since(self, version, epoch=None):
+        """
+        Come changes_since, ma già compressa: i client che attendevano la stessa versione (tutti quelli
+        aggiornati, risvegliati dalla stessa modifica) ricevono la stessa risposta, codificata una sola volta.
+        """
+        if epoch != self.epoch:
+            version = None
+        if version == self.version:
+            return None
+        encoded = self._encoded.get(version)
+        if encoded is None:
+            encoded = self._encoded[version] = encode_body(self.changes_since(version, self.epoch))
+        return encoded
+
+class AnnotationStore:
+    """
+    Documenti delle immagini di una cartella, caricati dai file *_annotations.json alla prima richiesta
+    e riscritti (in modo atomico, fuori dal ciclo di eventi) SAVE_DELAY secondi dopo l'ultima modifica.
+    """
+    def __init__(self, directory, save_delay=SAVE_DELAY):
+        self.directory = directory
+        self.save_delay = save_delay
+        self.documents = {} # nome dell'immagine -> ImageDocument
+
+    def _path(self, image):
+        return os.path.join(self.directory, image + ANNOTATION_FILE_SUFFIX)
+
+    def document(self, image):
+        document = self.documents.get(image)
+        if document is None:
+            shapes = {}
+            try:
+                with open(self._path(image), 'r') as f:
+                    shapes = {uuid.uuid4().hex: annotation for annotation in json.load(f)}
+            except FileNotFoundError:
+                pass
+            except (IOError, ValueError) as e:
+                print(f"Errore di lettura di {self._path(image)}: {e}")
+            document = self.documents[image] = ImageDocument(shapes)
+        return document
+
+    def schedule_save(self, image):
+        document = self.documents[image]
+        if document.save_handle is not None:
+            document.save_handle.cancel()
+        loop = asyncio.get_running_loop()
+        document.save_handle = loop.call_later(self.save_delay, lambda: loop.create_task(self.save(image)))
+
+    async def save(self, image):
+        document = self.documents[image]
+        document.save_handle = None
+        # Copia (con gli id rinumerati) presa nel ciclo di eventi, scritta in un thread
+        annotations = [dict(annotation, id=index) for index, annotation in enumerate(document.shapes.values())]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_json_atomic, annotations, self._path(image))
+        except OSError as e:
+            print(f"Errore durante il salvataggio di {self._path(image)}: {e}")
+
+    async def flush(self):
+        """Scrive subito tutte le modifiche programmate (alla chiusura del server)."""
+        for image, document in list(self.documents.items()):
+            if document.save_handle is not None:
+                document.save_handle.cancel()
+                await self.save(image)
+
+# --- Server ---
+class AnnotationServer:
+    """
+    Server asyncio (un solo thread) che possiede l'archivio delle annotazioni. Le richieste di modifiche
+    senza novità restano in attesa dell'evento del documento, quindi centinaia di client collegati
+    non costano nulla finché non cambia qualcosa.
+    """
+    def __init__(self, store, host=SERVICE_HOST, port=SERVICE_PORT, long_poll_timeout=LONG_POLL_TIMEOUT):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.long_poll_timeout = long_poll_timeout
+        self.server = None
+        self.clients = set() # Id dei client che hanno fatto almeno una richiesta
+        self.waiting = 0 # Long-poll in attesa
+        self.connections = set() # Task delle connessioni aperte (chiuse da close())
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=SERVICE_BACKLOG)
+        self.port = self.server.sockets[0].getsockname()[1] # Porta effettiva se era 0
+        return self
+
+    async def close(self):
+        self.server.close()
+        connections = list(self.connections)
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        await self.server.wait_closed()
+        await self.store.flush()
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True: # Connessione persistente (keep-alive)
+                message = await read_message(reader)
+                if message is None:
+                    break
+                start_line, headers, body = message
+                try:
+                    status, data = await self._dispatch(start_line, body)
+                except Exception as e: # Errore inatteso: il client riceve comunque una risposta
+                    print(f"Errore durante la richiesta {start_line!r}: {e!r}")
+                    status, data = "500 Internal Server Error", "errore interno del servizio"
+                if isinstance(data, str):
+                    data = {"error": data}
+                writer.write(build_message(f"HTTP/1.1 {status}", data if isinstance(data, bytes) else encode_body(data)))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ServiceError, ValueError):
+            pass # Client disconnesso o messaggio non valido: si chiude la connessione
+        except asyncio.CancelledError:
+            pass # Chiusura del server: la connessione termina senza errori
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def _dispatch(self, start_line, body):
+        """Instrada una richiesta. Returns: (stato, dati della risposta, già compressi o no, o messaggio di errore)."""
+        try:
+            method, target, _ = start_line.split(" ", 2)
+        except ValueError:
+            return "400 Bad Request", "richiesta non valida"
+        parts = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        client_id = query.get("client")
+        if client_id:
+            self.clients.add(client_id)
+        if parts.path == "/status" and method == "GET":
+            return "200 OK", {"images": len(self.store.documents), "clients": len(self.clients), "waiting": self.waiting,
+                              "shapes": sum(len(d.shapes) for d in self.store.documents.values())}
+        if not parts.path.startswith("/images/"):
+            return "404 Not Found", "risorsa sconosciuta"
+        image = unquote(parts.path[len("/images/"):]) # Nomi con spazi o caratteri non ASCII arrivano codificati
+        if not image or "/" in image or "\\" in image or "\0" in image or image.startswith("."):
+            return "400 Bad Request", "nome dell'immagine non valido" # Niente percorsi fuori dalla cartella
+        if method == "GET":
+            try:
+                since = int(query["since"]) if "since" in query else None
+                wait = min(float(query.get("wait", 0)), self.long_poll_timeout)
+            except ValueError:
+                return "400 Bad Request", "parametri non validi"
+            return "200 OK", await self._changes(image, since, query.get("epoch"), wait)
+        if method == "POST":
+            try:
+                upsert, remove = validate_delta(decode_body(body))
+            except (ValueError, zlib.error) as e:
+                return "400 Bad Request", str(e)
+            document = self.store.document(image)
+            version = document.apply(client_id, upsert, remove)
+            self.store.schedule_save(image)
+            return "200 OK", {"version": version}
+        return "405 Method Not Allowed", "metodo non supportato"
+
+    async def _changes(self, image, since, epoch, wait):
+        document = self.store.document(image)
+        response = document.encoded_changes_since(since, epoch)
+        if response is None and wait > 0:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(document.changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiting -= 1
+            response = document.encoded_changes_since(since, epoch)
+        return response or {"epoch": document.epoch, "version": document.version, "full": False, "changes": []}
+
+async def serve(directory, host=SERVICE_HOST, port=SERVICE_PORT):
+    """Avvia il servizio e lo mantiene attivo fino all'interruzione (le modifiche in sospeso vengono salvate)."""
+    server = await AnnotationServer(AnnotationStore(directory), host, port).start()
+    print(f"Servizio di annotazione su http://{server.host}:{server.port} (cartella: {os.path.abspath(directory)})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+# --- Client (lato editor) ---
+class AnnotationServiceClient:
+    """Client HTTP bloccante con connessione persistente (una per thread)."""
+    def __init__(self, url, client_id=None, timeout=SYNC_REQUEST_TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname or SERVICE_HOST
+        self.port = parts.port or SERVICE_PORT
+        self.client_id = client_id or uuid.uuid4().hex
+        self.timeout = timeout
+        self.connection = None
+
+    def _request(self, method, path, data=None):
+        body = encode_body(data) if data is not None else b""
+        headers = {"Content-Encoding": "deflate", "Content-Type": "application/json"} if body else {}
+        for attempt in range(2): # Una connessione persistente chiusa dal server viene riaperta una volta
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt:
+                    raise
+        data = decode_body(payload)
+        if response.status != 200:
+            raise ServiceError(f"{response.status} {data.get('error')}")
+        return data
+
+    def pull(self, image, since=None, wait=0, epoch=None):
+        path = f"/images/{quote(image, safe='')}?client={self.client_id}&wait={wait}"
+        if since is not None:
+            path += f"&since={since}&epoch={epoch}"
+        return self._request("GET", path)
+
+    def push(self, image, upsert, remove):
+        return self._request("POST", f"/images/{quote(image, safe='')}?client={self.client_id}",
+                             {"upsert": upsert, "remove": list(remove)})["version"]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class AnnotationSync:
+    """
+    Sincronizzazione delle forme di un'immagine con il servizio. Due thread di rete (invio e long-poll)
+    non toccano mai le forme: il thread dell'interfaccia consegna i delta con submit() e raccoglie
+    le modifiche degli altri con take_remote(), che decide anche i conflitti.
+    Le modifiche locali si accumulano finché il thread di invio è occupato, quindi un'intera sequenza
+    di gesti parte in un'unica richiesta compressa.
+    """
+    def __init__(self, url, image, client_id=None, long_poll_timeout=LONG_POLL_TIMEOUT):
+        self.client_id = client_id or uuid.uuid4().hex
+        self.url = url
+        self.long_poll_timeout = long_poll_timeout
+        self.error = None # Ultimo errore di rete (None se la connessione funziona)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._outbox = [] # Delta (immagine, upsert, remove) di immagini già lasciate, ancora da inviare
+        self._reset(image)
+        self._threads = [threading.Thread(target=self._send_loop, daemon=True),
+                         threading.Thread(target=self._poll_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def _reset(self, image):
+        self.image = image
+        self.synced = {} # uid -> annotazione come la conosce il servizio (solo thread dell'interfaccia)
+        self.initial = True # La prima risposta è lo stato completo dell'immagine
+        self._since = None # Ultima versione ricevuta
+        self._epoch = None # Epoca del documento a cui si riferisce self._since
+        self._pending_upsert = {} # Delta locale non ancora inviato
+        self._pending_remove = set()
+        self._in_flight = set() # Uid del delta in corso di invio
+        self._accepted = {} # uid -> versione dell'ultimo invio accettato che lo riguarda
+        self._remote = [] # Risposte del long-poll non ancora raccolte
+
+    def set_image(self, image):
+        """
+        Passa a un'altra immagine. Il delta non ancora inviato della precedente resta in coda e viene inviato
+        per primo: chi lascia un'immagine subito dopo una modifica (es. cambiando fotogramma) non la perde.
+        """
+        with self._lock:
+            if image != self.image:
+                if self._pending_upsert or self._pending_remove:
+                    self._outbox.append((self.image, self._pending_upsert, self._pending_remove))
+                self._reset(image)
+                self._wakeup.notify_all()
+
+    # --- Thread dell'interfaccia ---
+    def submit(self, current):
+        """
+        Confronta le forme correnti (uid -> annotazione) con quelle sincronizzate e accoda la differenza.
+        Returns:
+            bool: True se c'era qualcosa da inviare.
+        """
+        upsert = {uid: annotation for uid, annotation in current.items() if self.synced.get(uid) != annotation}
+        remove = [uid for uid in self.synced if uid not in current]
+        if not upsert and not remove:
+            return False
+        self.synced = dict(current)
+        with self._lock:
+            for uid in remove:
+                self._pending_upsert.pop(uid, None)
+            self._pending_remove.difference_update(upsert)
+            self._pending_remove.update(remove)
+            self._pending_upsert.update(upsert)
+            self._wakeup.notify_all()
+        return True
+
+    def _protected(self, uid, version):
+        # La versione locale vince se è ancora da inviare o se il server l'ha accettata dopo quella remota
+        return uid in self._pending_upsert or uid in self._pending_remove or uid in self._in_flight or \
+            self._accepted.get(uid, 0) > version or \
+            any(image == self.image and (uid in upsert or uid in remove) for image, upsert, remove in self._outbox)
+
+    def take_remote(self):
+        """
+        Modifiche degli altri client arrivate dall'ultima chiamata, già confrontate con quelle locali.
+        Returns:
+            tuple: (upsert, remove, full) da applicare alle forme (remove: uid da eliminare); full è True se
+            la risposta era lo stato completo, nel qual caso le forme mai sincronizzate vanno eliminate
+            alla prima risposta (self.initial) e mantenute (e poi inviate) nelle successive.
+        """
+        upsert, remove, full = {}, set(), False
+        with self._lock:
+            responses, self._remote = self._remote, []
+            for response in responses:
+                if response["full"]:
+                    full = True
+                    shapes = response["shapes"]
+                    version = response["version"]
+                    for uid in list(self.synced):
+                        if uid not in shapes and not self._protected(uid, version):
+                            del self.synced[uid]
+                            upsert.pop(uid, None)
+                            remove.add(uid)
+                    for uid, annotation in shapes.items():
+                        if self.synced.get(uid) != annotation and not self._protected(uid, version):
+                            self.synced[uid] = upsert[uid] = annotation
+                            remove.discard(uid)
+                    continue
+                for change in response["changes"]:
+                    if change["client"] == self.client_id:
+                        continue # Le proprie modifiche sono già nelle forme
+                    for uid in change["remove"]:
+                        if uid in self.synced and not self._protected(uid, change["version"]):
+                            del self.synced[uid]
+                            upsert.pop(uid, None)
+                            remove.add(uid)
+                    for uid, annotation in change["upsert"].items():
+                        if not self._protected(uid, change["version"]):
+                            self.synced[uid] = upsert[uid] = annotation
+                            remove.discard(uid)
+        return upsert, remove, full
+
+    def close(self, timeout=SYNC_CLOSE_TIMEOUT):
+        """Ferma la sincronizzazione, attendendo al più timeout secondi l'invio delle modifiche in coda."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify_all()
+        self._threads[0].join(timeout)
+
+    # --- Thread di rete ---
+    def _send_loop(self):
+        client = AnnotationServiceClient(self.url, self.client_id)
+        while True:
+            with self._lock:
+                while not self._closed and not self._outbox and not self._pending_upsert and not self._pending_remove:
+                    self._wakeup.wait()
+                queued = bool(self._outbox)
+                if queued: # Resta in coda (e protetto da take_remote) finché non viene accettato
+                    image, upsert, remove = self._outbox[0]
+                elif self._pending_upsert or self._pending_remove:
+                    image = self.image
+                    upsert, remove = self._pending_upsert, self._pending_remove
+                    self._pending_upsert, self._pending_remove = {}, set()
+                    self._in_flight = set(upsert) | remove
+                else:
+                    break # Chiuso e niente da inviare
+            try:
+                version = client.push(image, upsert, remove)
+            except (ServiceError, OSError, http.client.HTTPException, ValueError) as e:
+                self.error = str(e)
+                with self._lock:
+                    if not queued and image == self.image: # Rimette il delta in coda sotto quelli più recenti
+                        for uid, annotation in upsert.items():
+                            if uid not in self._pending_remove:
+                                self._pending_upsert.setdefault(uid, annotation)
+                        self._pending_remove.update(uid for uid in remove if uid not in self._pending_upsert)
+                        self._in_flight = set()
+                    elif not queued: # Immagine lasciata durante l'invio: il delta precede quelli accodati dopo
+                        self._outbox.insert(0, (image, upsert, remove))
+                    if self._closed:
+                        break # Alla chiusura non si ritenta: il servizio non è raggiungibile
+                time.sleep(SYNC_RETRY_DELAY)
+                continue
+            self.error = None
+            with self._lock:
+                if queued:
+                    self._outbox.pop(0)
+                elif image == self.image:
+                    for uid in self._in_flight:
+                        self._accepted[uid] = version
+                    self._in_flight = set()
+        client.close()
+
+    def _poll_loop(self):
+        client = AnnotationServiceClient(self.url, self.client_id)
+        while not self._closed:
+            with self._lock:
+                image, since, epoch = self.image, self._since, self._epoch
+            try:
+                response = client.pull(image, since, self.long_poll_timeout, epoch)
+            except (ServiceError, OSError, http.client.HTTPException, ValueError) as e:
+                self.error = str(e)
+                time.sleep(SYNC_RETRY_DELAY)
+                continue
+            self.error = None
+            with self._lock:
+                if image == self.image: # Risposta per un'immagine che nel frattempo è stata lasciata: scartata
+                    if response["epoch"] != self._epoch:
+                        self._accepted = {} # Versioni di un'altra epoca: non più confrontabili con quelle nuove
+                    self._since, self._epoch = response["version"], response["epoch"]
+                    if response["full"] or response["changes"]:
+                        self._remote.append(response)
+        client.close()
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servizio locale che condivide le annotazioni tra più editor.")
+    parser.add_argument("directory", nargs="?", default=".", help="Cartella dei file *_annotations.json")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Indirizzo di ascolto")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Porta di ascolto")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.directory, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
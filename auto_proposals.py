@@ -0,0 +1,170 @@
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from geometry_utils import simplify_douglas_peucker
+
+# --- Configurazioni Globali per le Proposte Automatiche ---
+PROPOSAL_MIN_AREA = 200 # Area minima (pixel quadrati) di un contorno proposto
+PROPOSAL_MAX_COUNT = 50 # Numero massimo di proposte per immagine (le più grandi)
+PROPOSAL_SIMPLIFY_TOLERANCE = 2.0 # Tolleranza Douglas-Peucker (pixel) applicata ai contorni proposti
+PROPOSAL_BLUR_KSIZE = 5 # Filtro gaussiano applicato prima della soglia di Otsu
+PROPOSAL_MORPH_KSIZE = 5 # Apertura/chiusura morfologica per ripulire la maschera
+GRABCUT_ITERATIONS = 3 # Iterazioni di GrabCut per la rifinitura di un rettangolo
+GRABCUT_MARGIN = 10 # Contesto (pixel) attorno al rettangolo passato a GrabCut per stimare lo sfondo
+PROPOSAL_CACHE_SIZE = 8 # Numero di immagini di cui si conservano le proposte
+PROPOSAL_POLL_MS = 50 # Intervallo (ms) con cui il thread dell'interfaccia controlla i risultati
+PROPOSAL_WORKERS = 2 # Processi del pool (la segmentazione è CPU-bound: i processi evitano il GIL)
+COLOR_PROPOSAL = "orange" # Contorno dei poligoni proposti, in attesa di essere accettati o rifiutati
+
+# --- Funzioni eseguite nei processi del pool (ricevono e restituiscono solo dati semplici) ---
+def _mask_to_polygons(mask, min_area, max_count, tolerance, offset=(0, 0)):
+    """Contorni esterni di una maschera binaria, dal più grande, come liste di tuple (x, y) semplificate."""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    areas = [cv2.contourArea(contour) for contour in contours]
+    order = sorted((i for i, area in enumerate(areas) if area >= min_area), key=lambda i: -areas[i])
+    polygons = []
+    for i in order[:max_count]:
+        points = [(int(x) + offset[0], int(y) + offset[1]) for x, y in contours[i].reshape(-1, 2)]
+        points = simplify_douglas_peucker(points, tolerance, closed=True)
+        if len(points) >= 3:
+            polygons.append(points)
+    return polygons
+
+def propose_contours(image, min_area=PROPOSAL_MIN_AREA, max_count=PROPOSAL_MAX_COUNT,
+                     tolerance=PROPOSAL_SIMPLIFY_TOLERANCE):
+    """
+    Propone i contorni degli oggetti dell'immagine: soglia di Otsu su scala di grigi sfocata,
+    pulizia morfologica e contorni esterni.
+    Returns:
+        list: Liste di vertici (tuple (x, y)) dei poligoni proposti, dal più grande.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gray = cv2.GaussianBlur(gray, (PROPOSAL_BLUR_KSIZE, PROPOSAL_BLUR_KSIZE), 0)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    if cv2.countNonZero(mask) > mask.size // 2:
+        mask = cv2.bitwise_not(mask) # Gli oggetti sono la parte minoritaria dell'immagine
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (PROPOSAL_MORPH_KSIZE, PROPOSAL_MORPH_KSIZE))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    return _mask_to_polygons(mask, min_area, max_count, tolerance)
+
+def refine_rectangle(crop, rect, offset, iterations=GRABCUT_ITERATIONS, tolerance=PROPOSAL_SIMPLIFY_TOLERANCE):
+    """
+    Rifinisce un rettangolo in un poligono aderente all'oggetto con GrabCut.
+    Lavora solo sul ritaglio dell'immagine attorno al rettangolo.
+    Args:
+        crop (numpy.ndarray): Ritaglio BGR che contiene il rettangolo (con un margine di contesto).
+        rect (tuple): (x, y, larghezza, altezza) del rettangolo nel ritaglio.
+        offset (tuple): Posizione del ritaglio nell'immagine, aggiunta ai vertici restituiti.
+    Returns:
+        list or None: Vertici del poligono (coordinate dell'immagine), o None se GrabCut non trova l'oggetto.
+    """
+    mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+    background_model = np.zeros((1, 65), dtype=np.float64)
+    foreground_model = np.zeros((1, 65), dtype=np.float64)
+    try:
+        cv2.grabCut(crop, mask, rect, background_model, foreground_model, iterations, cv2.GC_INIT_WITH_RECT)
+    except cv2.error:
+        return None # Es. rettangolo troppo piccolo per stimare i modelli di colore
+    foreground = np.where((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+    polygons = _mask_to_polygons(foreground, 1, 1, tolerance, offset)
+    return polygons[0] if polygons else None
+
+# --- Motore delle proposte (thread dell'interfaccia) ---
+class ProposalEngine:
+    """
+    Esegue segmentazione e rifinitura in un pool di processi e consegna i risultati
+    al thread dell'interfaccia tramite root.after, senza mai attendere un risultato.
+    Le proposte di ogni immagine sono in cache: tornando su un'immagine non vengono ricalcolate.
+    """
+    def __init__(self, root, max_workers=PROPOSAL_WORKERS, cache_size=PROPOSAL_CACHE_SIZE):
+        self.root = root
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._executor = None # Creato alla prima richiesta
+        self._cache = OrderedDict() # chiave dell'immagine -> lista di poligoni proposti
+        self._in_flight = {} # chiave dell'immagine -> callback in attesa dello stesso risultato
+        self._waiting = [] # Coppie (future, funzione da chiamare con il risultato)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # "spawn": i processi non ereditano lo stato di Tk e dei thread dell'applicazione
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def request_proposals(self, image, image_key, on_ready):
+        """
+        Chiede le proposte per un'immagine. on_ready(lista di poligoni) viene chiamata nel thread
+        dell'interfaccia: subito se le proposte sono in cache, altrimenti al termine del calcolo.
+        """
+        cached = self._cache.get(image_key)
+        if cached is not None:
+            self._cache.move_to_end(image_key)
+            on_ready(cached)
+            return
+        if image_key in self._in_flight: # Calcolo già in corso per la stessa immagine
+            self._in_flight[image_key].append(on_ready)
+            return
+        self._in_flight[image_key] = [on_ready]
+        future = self._get_executor().submit(propose_contours, image)
+        self._wait(future, lambda polygons: self._store(image_key, polygons))
+
+    def request_refinement(self, image, rect, on_ready):
+        """
+        Chiede la rifinitura di un rettangolo (x1, y1, x2, y2) in un poligono.
+        Al processo viene passato solo il ritaglio attorno al rettangolo; on_ready(vertici o None)
+        viene chiamata nel thread dell'interfaccia.
+        """
+        height, width = image.shape[:2]
+        x1, y1, x2, y2 = [int(round(v)) for v in rect]
+        x1, x2 = max(min(x1, x2), 0), min(max(x1, x2), width)
+        y1, y2 = max(min(y1, y2), 0), min(max(y1, y2), height)
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            on_ready(None)
+            return
+        cx1, cy1 = max(x1 - GRABCUT_MARGIN, 0), max(y1 - GRABCUT_MARGIN, 0)
+        cx2, cy2 = min(x2 + GRABCUT_MARGIN, width), min(y2 + GRABCUT_MARGIN, height)
+        crop = np.ascontiguousarray(image[cy1:cy2, cx1:cx2])
+        future = self._get_executor().submit(refine_rectangle, crop, (x1 - cx1, y1 - cy1, x2 - x1, y2 - y1), (cx1, cy1))
+        self._wait(future, on_ready)
+
+    def _store(self, image_key, polygons):
+        if polygons is None: # Calcolo fallito: non va in cache, così una nuova richiesta lo ripete
+            polygons = []
+        else:
+            self._cache[image_key] = polygons
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for callback in self._in_flight.pop(image_key, []):
+            callback(polygons)
+
+    def _wait(self, future, callback):
+        self._waiting.append((future, callback))
+        if len(self._waiting) == 1:
+            self.root.after(PROPOSAL_POLL_MS, self._poll)
+
+    def _poll(self):
+        # Controlla senza bloccare quali calcoli sono terminati (un solo done() per future: un calcolo che
+        # termina durante il controllo finisce in una sola delle due liste, mai in nessuna)
+        done, waiting = [], []
+        for entry in self._waiting:
+            (done if entry[0].done() else waiting).append(entry)
+        self._waiting = waiting
+        for future, callback in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Errore durante il calcolo delle proposte: {e}")
+                result = None
+            callback(result)
+        if self._waiting:
+            self.root.after(PROPOSAL_POLL_MS, self._poll)
+
+    def shutdown(self):
+        """Termina il pool di processi senza attendere i calcoli in corso."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,203 @@
+import queue
+import threading
+from annotation_exporter import snapshot_to_annotation, write_json_atomic
+
+# --- Configurazioni Globali per l'Esportazione in Background ---
+EXPORT_POLL_MS = 50 # Intervallo (ms) con cui il thread dell'interfaccia raccoglie progressi e completamenti
+EXPORT_PROGRESS_STEP = 256 # Numero di forme serializzate tra due controlli di annullamento/avanzamento
+
+class ExportCancelled(Exception):
+    """Sollevata dentro un lavoro di esportazione quando viene sostituito da un salvataggio più recente."""
+    pass
+
+# --- Lavori di esportazione ---
+class ExportJob:
+    """
+    Lavoro di esportazione eseguito dal thread di lavoro. Lavora solo su dati immutabili
+    (es. la tupla restituita da snapshot_shapes), mai sulle forme dell'applicazione.
+    Le sottoclassi implementano run(); i callback vengono sempre chiamati nel thread dell'interfaccia.
+    """
+    def __init__(self, filename, on_progress=None, on_done=None):
+        self.filename = filename
+        self.on_progress = on_progress # on_progress(lavoro, frazione tra 0 e 1)
+        self.on_done = on_done # on_done(lavoro, stato, errore) con stato "done", "cancelled" o "error"
+        self._cancelled = threading.Event()
+        self._report = None # Impostato dal thread di lavoro: accoda un evento (lavoro, tipo, valore)
+
+    def cancel(self):
+        """Chiede l'interruzione del lavoro (effettiva al successivo checkpoint)."""
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def checkpoint(self, fraction):
+        """Da chiamare periodicamente in run(): segnala l'avanzamento e interrompe il lavoro se annullato."""
+        if self._cancelled.is_set():
+            raise ExportCancelled()
+        if self._report is not None:
+            self._report((self, "progress", fraction))
+
+    def run(self):
+        raise NotImplementedError
+
+class JsonExportJob(ExportJob):
+    """Serializza una copia delle forme nel formato di export_annotations_to_json."""
+    def __init__(self, filename, snapshot, image_width, image_height, simplify_tolerance=None,
+                 include_original=False, on_progress=None, on_done=None):
+        super().__init__(filename, on_progress, on_done)
+        self.snapshot = snapshot
+        self.image_width = image_width
+        self.image_height = image_height
+        self.simplify_tolerance = simplify_tolerance
+        self.include_original = include_original
+
+    def run(self):
+        annotations_data = []
+        total = len(self.snapshot)
+        for i, shape_snapshot in enumerate(self.snapshot):
+            if i % EXPORT_PROGRESS_STEP == 0:
+                self.checkpoint(i / max(total, 1))
+            annotations_data.append(snapshot_to_annotation(i, shape_snapshot, self.simplify_tolerance, self.include_original))
+        self.checkpoint(1.0) # Ultima occasione di annullare prima di sostituire il file
+        write_json_atomic(annotations_data, self.filename)
+
+class PipelineExportJob(ExportJob):
+    """
+    Esporta una copia delle forme in più formati con un solo passaggio (export_pipeline.run_export).
+    filename è il percorso di uscita senza suffisso, quindi i salvataggi sovrapposti della stessa immagine
+    vengono uniti qualunque sia l'insieme di formati; al termine report contiene i tempi di ogni formato.
+    """
+    def __init__(self, base_filename, snapshot, image_width, image_height, formats, image_name=None, labels=None,
+                 simplify_tolerance=None, include_original=False, on_progress=None, on_done=None):
+        super().__init__(base_filename, on_progress, on_done)
+        self.snapshot = snapshot
+        self.image_width = image_width
+        self.image_height = image_height
+        self.formats = tuple(formats)
+        self.image_name = image_name
+        self.labels = labels # Nomi delle classi nell'ordine dei loro id (vedi run_export)
+        self.simplify_tolerance = simplify_tolerance
+        self.include_original = include_original
+        self.report = None # ExportReport, impostato a esportazione completata
+
+    def run(self):
+        from export_pipeline import run_export, create_writers
+        self.report = run_export(self.snapshot, self.image_width, self.image_height, self.filename,
+                                 create_writers(self.formats), image_name=self.image_name, labels=self.labels,
+                                 simplify_tolerance=self.simplify_tolerance, include_original=self.include_original,
+                                 checkpoint=self.checkpoint, checkpoint_step=EXPORT_PROGRESS_STEP)
+
+class SessionSaveJob(ExportJob):
+    """Salva una copia delle forme nel formato di sessione binario (session_format.py)."""
+    def __init__(self, filename, snapshot, image_width, image_height, on_progress=None, on_done=None):
+        super().__init__(filename, on_progress, on_done)
+        self.snapshot = snapshot
+        self.image_width = image_width
+        self.image_height = image_height
+
+    def run(self):
+        from session_format import save_session # NumPy viene caricato dal thread di lavoro, non all'avvio
+        self.checkpoint(0.0)
+        save_session(self.filename, self.snapshot, self.image_width, self.image_height)
+
+# --- Thread di lavoro ---
+class ExportWorker:
+    """
+    Esegue i lavori di esportazione su un unico thread in background, così l'interfaccia
+    resta reattiva durante serializzazione e scrittura su disco.
+    Salvataggi sovrapposti sullo stesso file vengono uniti: un lavoro in attesa viene sostituito
+    dal più recente, uno in esecuzione viene annullato (il file resta quello dell'ultimo salvataggio completato).
+    Progressi e completamenti passano da una coda letta con root.after, perché Tk non è thread-safe.
+    """
+    def __init__(self, root, poll_ms=EXPORT_POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._condition = threading.Condition()
+        self._pending = {} # filename -> lavoro in attesa (al massimo uno per file, il più recente)
+        self._running = None # Lavoro in esecuzione
+        self._events = queue.Queue() # (lavoro, tipo, valore) prodotti dal thread di lavoro
+        self._thread = None
+        self._stopping = False
+        self._polling = False
+
+    def submit(self, job):
+        """Accoda un lavoro. Eventuali salvataggi precedenti dello stesso file vengono superati."""
+        with self._condition:
+            superseded = self._pending.pop(job.filename, None)
+            if superseded is not None:
+                superseded.cancel()
+                self._events.put((superseded, "cancelled", None))
+            if self._running is not None and self._running.filename == job.filename:
+                self._running.cancel()
+            self._pending[job.filename] = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker_loop, name="export-worker", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        self._schedule_poll()
+        return job
+
+    def is_busy(self):
+        with self._condition:
+            return self._running is not None or bool(self._pending)
+
+    def shutdown(self, wait=True):
+        """Ferma il thread dopo aver completato i lavori accodati (se wait è True) e consegna gli ultimi eventi."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if wait and self._thread is not None:
+            self._thread.join()
+        self._drain_events()
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                filename = next(iter(self._pending)) # Lavori su file diversi in ordine di arrivo
+                job = self._running = self._pending.pop(filename)
+
+            job._report = self._events.put
+            try:
+                job.run()
+                self._events.put((job, "done", None))
+            except ExportCancelled:
+                self._events.put((job, "cancelled", None))
+            except Exception as e: # Un errore di scrittura non deve fermare il thread
+                self._events.put((job, "error", e))
+            finally:
+                with self._condition:
+                    self._running = None
+
+    def _schedule_poll(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        self._polling = False
+        self._drain_events()
+        if self.is_busy() or not self._events.empty():
+            self._schedule_poll()
+
+    def _drain_events(self):
+        last_progress = {} # Consegna solo l'ultimo avanzamento di ogni lavoro
+        while True:
+            try:
+                job, kind, value = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                if not job.is_cancelled():
+                    last_progress[job] = value
+                continue
+            last_progress.pop(job, None)
+            if job.on_done is not None:
+                job.on_done(job, kind, value)
+        for job, fraction in last_progress.items():
+            if job.on_progress is not None:
+                job.on_progress(job, fraction)
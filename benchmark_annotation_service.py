@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import quote
+from annotation_index import ANNOTATION_FILE_SUFFIX
+from annotation_service import (encode_body, decode_body, build_message, read_message, ServiceError,
+                                SERVICE_HOST, LONG_POLL_TIMEOUT)
+
+# --- Configurazioni Globali del Test di Carico ---
+LOAD_CLIENTS = 200 # Client simulati (ognuno con una connessione di invio e una di long-poll)
+LOAD_IMAGES = 10 # Immagini condivise: i client sono distribuiti a turno tra di esse
+LOAD_PUSHES = 20 # Delta inviati da ogni client
+LOAD_INTERVAL = 0.05 # Secondi (in media) tra due delta dello stesso client
+LOAD_SHAPES_PER_PUSH = 3 # Forme aggiunte o modificate in ogni delta
+LOAD_DRAIN_TIME = 2.0 # Secondi concessi alla propagazione delle ultime modifiche
+SERVER_START_TIMEOUT = 10.0 # Secondi entro cui il server deve rispondere
+LOAD_IMAGE_NAME = "immagine città {}" # Nomi delle immagini: spazi e caratteri non ASCII verificano la codifica negli URL
+
+# --- Client simulato ---
+class LoadClient:
+    """Annotatore simulato: invia rettangoli a intervalli casuali e riceve con il long-poll quelli degli altri."""
+    def __init__(self, host, port, image, stats):
+        self.host = host
+        self.port = port
+        self.image = image
+        self.image_path = quote(image, safe="")
+        self.client_id = uuid.uuid4().hex
+        self.stats = stats
+        self.uids = []
+
+    async def _request(self, connection, method, path, data=None):
+        reader, writer = connection
+        body = encode_body(data) if data is not None else b""
+        writer.write(build_message(f"{method} {path} HTTP/1.1", body))
+        await writer.drain()
+        self.stats["bytes_sent"] += len(body)
+        message = await read_message(reader)
+        if message is None:
+            raise ConnectionError("connessione chiusa dal server")
+        start_line, _, payload = message
+        self.stats["bytes_received"] += len(payload)
+        data = decode_body(payload) if payload else {}
+        if start_line.split(" ", 2)[1] != "200":
+            raise ServiceError(f"{start_line}: {data.get('error')}")
+        return data
+
+    def _random_rectangle(self):
+        x, y = random.randint(0, 1800), random.randint(0, 1000)
+        return {"id": 0, "type": "rectangle", "label": "object", "sent_at": time.perf_counter(),
+                "coordinates": {"x1": x, "y1": y, "x2": x + random.randint(10, 200), "y2": y + random.randint(10, 200),
+                                "angle_rad": 0.0, "angle_deg": 0.0}}
+
+    async def push_loop(self, pushes, interval, shapes_per_push):
+        connection = await asyncio.open_connection(self.host, self.port)
+        try:
+            for _ in range(pushes):
+                await asyncio.sleep(random.expovariate(1 / interval))
+                upsert = {}
+                for _ in range(shapes_per_push):
+                    # Metà delle volte modifica una forma già inviata (anche quelle degli altri restano intatte)
+                    uid = random.choice(self.uids) if self.uids and random.random() < 0.5 else uuid.uuid4().hex
+                    upsert[uid] = self._random_rectangle()
+                remove = [self.uids.pop(random.randrange(len(self.uids)))] if len(self.uids) > 10 else []
+                self.uids.extend(uid for uid in upsert if uid not in self.uids)
+                start = time.perf_counter()
+                try:
+                    await self._request(connection, "POST", f"/images/{self.image_path}?client={self.client_id}",
+                                        {"upsert": upsert, "remove": remove})
+                except (ServiceError, OSError) as e:
+                    self.stats["errors"].append(str(e))
+                    continue
+                self.stats["push_latency"].append(time.perf_counter() - start)
+        finally:
+            connection[1].close()
+
+    async def poll_loop(self, stop):
+        connection = await asyncio.open_connection(self.host, self.port)
+        since = epoch = None
+        try:
+            while not stop.is_set():
+                try:
+                    path = f"/images/{self.image_path}?client={self.client_id}&wait={LONG_POLL_TIMEOUT}"
+                    response = await self._request(connection, "GET",
+                                                   path + (f"&since={since}&epoch={epoch}" if since is not None else ""))
+                except (ServiceError, OSError) as e:
+                    self.stats["errors"].append(str(e))
+                    return
+                received = time.perf_counter()
+                since, epoch = response["version"], response["epoch"]
+                for change in response.get("changes", []):
+                    if change["client"] != self.client_id:
+                        self.stats["propagation_latency"].extend(received - annotation["sent_at"]
+                                                                 for annotation in change["upsert"].values())
+        finally:
+            connection[1].close()
+
+# --- Esecuzione ---
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind((SERVICE_HOST, 0))
+        return sock.getsockname()[1]
+
+async def _wait_for_server(host, port):
+    deadline = time.perf_counter() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+async def run_load_test(host, port, clients, images, pushes, interval, shapes_per_push):
+    """
+    Collega i client simulati al servizio, fa inviare a ognuno i suoi delta e raccoglie le misure.
+    Returns:
+        dict: Latenze di invio e di propagazione (secondi), errori, byte trasferiti e durata.
+    """
+    await _wait_for_server(host, port)
+    stats = {"push_latency": [], "propagation_latency": [], "errors": [], "bytes_sent": 0, "bytes_received": 0}
+    load_clients = [LoadClient(host, port, LOAD_IMAGE_NAME.format(i % images), stats) for i in range(clients)]
+    stop = asyncio.Event()
+    pollers = [asyncio.create_task(client.poll_loop(stop)) for client in load_clients]
+    start = time.perf_counter()
+    await asyncio.gather(*(client.push_loop(pushes, interval, shapes_per_push) for client in load_clients))
+    stats["duration"] = time.perf_counter() - start
+    await asyncio.sleep(LOAD_DRAIN_TIME)
+    stop.set()
+    for poller in pollers:
+        poller.cancel()
+    await asyncio.gather(*pollers, return_exceptions=True)
+    return stats
+
+def _percentiles(values):
+    if len(values) < 2:
+        return "n/d"
+    quantiles = statistics.quantiles(values, n=100)
+    return (f"p50 {quantiles[49] * 1000:.1f} ms, p95 {quantiles[94] * 1000:.1f} ms, "
+            f"p99 {quantiles[98] * 1000:.1f} ms, max {max(values) * 1000:.1f} ms")
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test di carico del servizio di annotazione con molti client simultanei.")
+    parser.add_argument("--clients", type=int, default=LOAD_CLIENTS, help="Client simultanei")
+    parser.add_argument("--images", type=int, default=LOAD_IMAGES, help="Immagini condivise dai client")
+    parser.add_argument("--pushes", type=int, default=LOAD_PUSHES, help="Delta inviati da ogni client")
+    parser.add_argument("--interval", type=float, default=LOAD_INTERVAL, help="Secondi medi tra due delta di un client")
+    parser.add_argument("--shapes", type=int, default=LOAD_SHAPES_PER_PUSH, help="Forme per delta")
+    parser.add_argument("--url", default=None, help="Servizio già avviato (default: ne avvia uno su una cartella temporanea)")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        host, _, port = args.url.split("://")[-1].rstrip("/").partition(":")
+        port = int(port)
+    else:
+        host, port = SERVICE_HOST, _free_port()
+        directory = tempfile.mkdtemp(prefix="annotation_service_")
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "annotation_service.py"),
+                                   directory, "--host", host, "--port", str(port)], stdout=subprocess.DEVNULL)
+    try:
+        stats = asyncio.run(run_load_test(host, port, args.clients, args.images, args.pushes, args.interval, args.shapes))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT) # Il server salva le modifiche in sospeso prima di uscire
+            server.wait()
+
+    total = len(stats["push_latency"])
+    print(f"Client: {args.clients}, immagini: {args.images}, delta inviati: {total} in {stats['duration']:.2f} s "
+          f"({total / stats['duration']:.0f} delta/s)")
+    print(f"Latenza di invio: {_percentiles(stats['push_latency'])}")
+    print(f"Latenza di propagazione: {_percentiles(stats['propagation_latency'])} "
+          f"({len(stats['propagation_latency'])} forme ricevute)")
+    print(f"Dati compressi: {stats['bytes_sent'] / 1024:.0f} KiB inviati, {stats['bytes_received'] / 1024:.0f} KiB ricevuti")
+    if stats["errors"]:
+        print(f"Errori: {len(stats['errors'])} (primo: {stats['errors'][0]})")
+    if server is not None:
+        # Ogni immagine deve essere salvata con il proprio nome (decodificato dall'URL), non con quello codificato
+        missing = [LOAD_IMAGE_NAME.format(i) for i in range(min(args.images, args.clients))
+                   if not os.path.exists(os.path.join(directory, LOAD_IMAGE_NAME.format(i) + ANNOTATION_FILE_SUFFIX))]
+        if missing:
+            print(f"File di annotazione mancanti: {', '.join(missing)} (presenti: {', '.join(sorted(os.listdir(directory)))})")
@@ -0,0 +1,97 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# --- Configurazioni Globali del Benchmark di Avvio ---
+BENCHMARK_REPEATS = 5 # Esecuzioni (ognuna in un interprete nuovo) di cui si riporta la mediana
+BENCHMARK_MODULES = ("usa_classe_cerchio", "interactive_shapes", "annotation_exporter", "mouse_events",
+                     "numpy", "cv2", "PIL.ImageTk") # Moduli di cui si misura il tempo di importazione
+HEAVY_MODULES = ("numpy", "cv2", "PIL") # Librerie che non devono essere caricate importando l'editor
+BENCHMARK_TIMEOUT = 60 # Secondi concessi a ogni esecuzione
+
+# --- Misure (eseguite in un processo figlio, con le cache dei moduli vuote) ---
+def _measure_import(module):
+    start = time.perf_counter()
+    __import__(module)
+    elapsed = time.perf_counter() - start
+    return {"import": elapsed, "heavy": [name for name in HEAVY_MODULES if name in sys.modules]}
+
+def _measure_startup(image_path):
+    """
+    Tempi dall'avvio dell'interprete: importazione dell'editor, finestra disegnata (prima di qualsiasi
+    decodifica) e immagine iniziale visualizzata.
+    """
+    start = time.perf_counter()
+    import tkinter as tk
+    from usa_classe_cerchio import ImageEditorApp
+    imported = time.perf_counter()
+    root = tk.Tk()
+    app = ImageEditorApp(root, image_path)
+    root.update_idletasks() # Geometria e disegno della finestra
+    window = time.perf_counter()
+    while app.original_cv_image is None:
+        root.update()
+        time.sleep(0.001)
+    root.update_idletasks()
+    image = time.perf_counter()
+    app.on_close()
+    return {"import": imported - start, "window": window - start, "image": image - start}
+
+def _run_child(args):
+    command = [sys.executable, __file__, "--child"] + args
+    result = subprocess.run(command, capture_output=True, text=True, timeout=BENCHMARK_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"codice {result.returncode}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def _median_runs(args, repeats):
+    runs = [_run_child(args) for _ in range(repeats)]
+    medians = {key: statistics.median(run[key] for run in runs) for key in runs[0] if key != "heavy"}
+    if "heavy" in runs[0]:
+        medians["heavy"] = runs[0]["heavy"]
+    return medians
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Misura i tempi di importazione e di avvio dell'editor.")
+    parser.add_argument("--image", default=None, help="Immagine iniziale (default: sfondo nero)")
+    parser.add_argument("--repeats", type=int, default=BENCHMARK_REPEATS, help="Esecuzioni per misura")
+    parser.add_argument("--report", default=None, help="File JSON in cui salvare i risultati")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS) # Uso interno: una singola misura
+    args = parser.parse_args()
+
+    if args.child:
+        kind, target = args.child[0], (args.child[1] if len(args.child) > 1 else None)
+        result = _measure_import(target) if kind == "import" else _measure_startup(target or None)
+        print(json.dumps(result))
+        sys.exit(0)
+
+    report = {"imports": {}, "startup": None}
+    print(f"Importazione (mediana di {args.repeats} esecuzioni):")
+    for module in BENCHMARK_MODULES:
+        try:
+            result = _median_runs(["import", module], args.repeats)
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"  {module:<22} non disponibile: {e}")
+            continue
+        report["imports"][module] = result
+        heavy = ", ".join(result["heavy"]) or "nessuna"
+        print(f"  {module:<22} {result['import'] * 1000:8.1f} ms   librerie pesanti caricate: {heavy}")
+
+    print("Avvio dell'editor:")
+    try:
+        startup = _median_runs(["startup"] + ([args.image] if args.image else []), args.repeats)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        print(f"  non disponibile (serve un display): {e}")
+    else:
+        report["startup"] = startup
+        print(f"  importazione           {startup['import'] * 1000:8.1f} ms")
+        print(f"  finestra visibile      {startup['window'] * 1000:8.1f} ms")
+        print(f"  immagine visualizzata  {startup['image'] * 1000:8.1f} ms")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,167 @@
+from collections import OrderedDict, namedtuple
+
+# --- Configurazioni Globali delle Regolazioni di Visualizzazione ---
+BRIGHTNESS_RANGE = (-128, 128) # Scostamento di luminosità aggiunto a ogni livello
+CONTRAST_RANGE = (0.1, 4.0) # Fattore di contrasto attorno al grigio medio
+GAMMA_RANGE = (0.1, 5.0) # Gamma (> 1 schiarisce i toni scuri, < 1 li scurisce)
+CLAHE_CLIP_LIMIT = 2.0 # Limite di contrasto di CLAHE
+CLAHE_TILE_GRID = 8 # Riquadri per lato usati da CLAHE
+CLAHE_CACHE_SIZE = 4 # Risultati CLAHE conservati (immagine e canale)
+LUT_CACHE_SIZE = 64 # Tabelle di conversione conservate (una per combinazione luminosità/contrasto/gamma)
+CHANNEL_VIEWS = ("all", "blue", "green", "red", "gray") # Canali visualizzabili (BGR, come OpenCV)
+
+# Parametri di visualizzazione: non modificano mai l'immagine né le annotazioni
+DisplaySettings = namedtuple("DisplaySettings", ["brightness", "contrast", "gamma", "clahe", "channel"])
+DEFAULT_DISPLAY_SETTINGS = DisplaySettings(0, 1.0, 1.0, False, "all")
+
+def build_lut(brightness, contrast, gamma):
+    """
+    Tabella di 256 livelli che applica contrasto (attorno al grigio medio), luminosità e gamma.
+    Returns:
+        numpy.ndarray: Array uint8 di 256 elementi, da usare con cv2.LUT.
+    """
+    import numpy as np
+    levels = np.arange(256, dtype=np.float64)
+    levels = np.clip((levels - 127.5) * contrast + 127.5 + brightness, 0, 255)
+    if gamma != 1.0:
+        levels = 255.0 * (levels / 255.0) ** (1.0 / gamma)
+    return np.round(levels).astype(np.uint8)
+
+def _channel_plane(image, channel):
+    """Canale da visualizzare: l'immagine BGR per "all", altrimenti un piano a un solo canale."""
+    import cv2
+    if image.ndim == 2:
+        return image
+    if channel == "gray":
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if channel in ("blue", "green", "red"):
+        return image[:, :, ("blue", "green", "red").index(channel)]
+    return image
+
+def _clamp(value, value_range):
+    return min(max(value, value_range[0]), value_range[1])
+
+class DisplayAdjuster:
+    """
+    Stadio di sola visualizzazione tra l'immagine originale e il canvas.
+    - Luminosità, contrasto e gamma sono un'unica tabella di 256 livelli (in cache per combinazione),
+      applicata con cv2.LUT: il costo per pixel non dipende dai parametri.
+    - CLAHE dipende dall'intera immagine, quindi viene calcolato una volta per immagine e canale e messo in cache.
+    - Solo la regione richiesta (quella visibile) viene elaborata, e solo se i parametri o l'immagine sono
+      cambiati: il risultato resta in un buffer riutilizzato finché la regione visibile è già aggiornata.
+    L'immagine di partenza non viene mai modificata.
+    """
+    def __init__(self, settings=DEFAULT_DISPLAY_SETTINGS):
+        self.settings = settings
+        self._luts = OrderedDict() # (luminosità, contrasto, gamma) -> tabella
+        self._clahe_results = OrderedDict() # (chiave dell'immagine, canale) -> (immagine, risultato CLAHE)
+        self._source = None # Immagine a cui si riferisce il buffer di uscita
+        self._output = None # Buffer BGR con l'immagine regolata (valida solo in _valid_region)
+        self._valid_region = None # (x0, y0, x1, y1) già elaborata con le impostazioni correnti
+
+    # --- Impostazioni ---
+    def set(self, **changes):
+        """
+        Modifica alcuni parametri (brightness, contrast, gamma, clahe, channel).
+        Returns:
+            bool: True se qualcosa è cambiato (e quindi la visualizzazione va aggiornata).
+        """
+        settings = self.settings._replace(**changes)
+        settings = settings._replace(
+            brightness=_clamp(settings.brightness, BRIGHTNESS_RANGE),
+            contrast=_clamp(settings.contrast, CONTRAST_RANGE),
+            gamma=_clamp(settings.gamma, GAMMA_RANGE),
+            clahe=bool(settings.clahe),
+            channel=settings.channel if settings.channel in CHANNEL_VIEWS else "all")
+        if settings == self.settings:
+            return False
+        self.settings = settings
+        self._valid_region = None
+        return True
+
+    def reset(self):
+        """Ripristina la visualizzazione dell'immagine originale. Restituisce True se qualcosa è cambiato."""
+        return self.set(**DEFAULT_DISPLAY_SETTINGS._asdict())
+
+    def is_identity(self):
+        return self.settings == DEFAULT_DISPLAY_SETTINGS
+
+    def _lut(self):
+        key = (self.settings.brightness, self.settings.contrast, self.settings.gamma)
+        if key == (0, 1.0, 1.0):
+            return None # Tabella identità: nessuna conversione
+        lut = self._luts.get(key)
+        if lut is None:
+            lut = self._luts[key] = build_lut(*key)
+            while len(self._luts) > LUT_CACHE_SIZE:
+                self._luts.popitem(last=False)
+        else:
+            self._luts.move_to_end(key)
+        return lut
+
+    def _clahe(self, image, image_key):
+        """Risultato CLAHE dell'intera immagine per il canale corrente (sulla luminanza L*a*b* per "all")."""
+        import cv2
+        channel = self.settings.channel
+        key = (image_key, channel)
+        cached = self._clahe_results.get(key)
+        if cached is not None and cached[0] is image:
+            self._clahe_results.move_to_end(key)
+            return cached[1]
+
+        clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=(CLAHE_TILE_GRID, CLAHE_TILE_GRID))
+        plane = _channel_plane(image, channel)
+        if plane.ndim == 3:
+            lab = cv2.cvtColor(plane, cv2.COLOR_BGR2LAB)
+            lab[:, :, 0] = clahe.apply(lab[:, :, 0])
+            result = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        else:
+            result = clahe.apply(plane)
+        self._clahe_results[key] = (image, result)
+        while len(self._clahe_results) > CLAHE_CACHE_SIZE:
+            self._clahe_results.popitem(last=False)
+        return result
+
+    # --- Applicazione ---
+    def apply(self, image, region=None, image_key=None):
+        """
+        Restituisce l'immagine da visualizzare: image stessa se non ci sono regolazioni, altrimenti
+        il buffer regolato, aggiornato almeno nella regione indicata.
+        Args:
+            image (numpy.ndarray): Immagine BGR di partenza (non viene modificata).
+            region (tuple): (x0, y0, x1, y1) visibile; None per l'intera immagine.
+            image_key: Chiave della cache CLAHE (es. il percorso del file); per default l'identità dell'array.
+        """
+        if self.is_identity():
+            return image
+        import cv2
+        import numpy as np
+        height, width = image.shape[:2]
+        if image is not self._source or self._output is None or self._output.shape[:2] != (height, width):
+            self._source = image
+            self._output = np.zeros((height, width, 3), dtype=np.uint8)
+            self._valid_region = None
+
+        x0, y0, x1, y1 = region if region is not None else (0, 0, width, height)
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), width), min(int(y1), height)
+        valid = self._valid_region
+        if valid is not None and valid[0] <= x0 and valid[1] <= y0 and valid[2] >= x1 and valid[3] >= y1:
+            return self._output # Regione visibile già aggiornata con questi parametri
+        if valid is not None: # Estende la regione valida a quella visibile (es. finestra ingrandita)
+            x0, y0, x1, y1 = min(x0, valid[0]), min(y0, valid[1]), max(x1, valid[2]), max(y1, valid[3])
+        if x0 >= x1 or y0 >= y1:
+            return self._output
+
+        if self.settings.clahe:
+            plane = self._clahe(image, image_key if image_key is not None else id(image))[y0:y1, x0:x1]
+        else:
+            plane = _channel_plane(image[y0:y1, x0:x1], self.settings.channel)
+        lut = self._lut()
+        if lut is not None:
+            plane = cv2.LUT(plane, lut) # Sui piani a un canale la tabella costa un terzo
+        if plane.ndim == 2:
+            plane = cv2.cvtColor(plane, cv2.COLOR_GRAY2BGR)
+        self._output[y0:y1, x0:x1] = plane
+        self._valid_region = (x0, y0, x1, y1)
+        return self._output
@@ -0,0 +1,125 @@
+import math
+import threading
+from collections import OrderedDict
+
+# --- Configurazioni Globali per l'Aggancio ai Bordi ---
+EDGE_BLUR_KSIZE = 5 # Lato del filtro gaussiano applicato prima di Canny (riduce i bordi dovuti al rumore)
+EDGE_CANNY_LOW = 50 # Soglia bassa dell'isteresi di Canny
+EDGE_CANNY_HIGH = 150 # Soglia alta: solo i bordi "forti" avviano un contorno
+SNAP_RADIUS = 12 # Distanza massima (pixel) entro cui un vertice viene agganciato al bordo più vicino
+EDGE_CACHE_SIZE = 4 # Numero di immagini di cui si conservano le mappe (es. avanti/indietro tra immagini)
+
+class EdgeMap:
+    """
+    Mappe precalcolate di un'immagine: per ogni pixel, coordinate del pixel di bordo più vicino
+    e distanza da esso. Con queste mappe l'aggancio di un punto è una semplice lettura di array.
+    """
+    def __init__(self, nearest_x, nearest_y, distance):
+        self.nearest_x = nearest_x
+        self.nearest_y = nearest_y
+        self.distance = distance
+        self.height, self.width = distance.shape
+
+    def nearest_edge(self, x, y):
+        """
+        Restituisce (x, y, distanza) del pixel di bordo più vicino a (x, y), o None se il punto
+        è fuori dall'immagine o l'immagine non ha bordi.
+        """
+        ix, iy = int(round(x)), int(round(y))
+        if not (0 <= ix < self.width and 0 <= iy < self.height):
+            return None
+        distance = self.distance[iy, ix]
+        if not math.isfinite(distance):
+            return None
+        return int(self.nearest_x[iy, ix]), int(self.nearest_y[iy, ix]), float(distance)
+
+def compute_edge_map(image, canny_low=EDGE_CANNY_LOW, canny_high=EDGE_CANNY_HIGH):
+    """
+    Calcola la mappa dei bordi (Canny) e, con una trasformata di distanza con etichette,
+    il pixel di bordo più vicino a ogni pixel dell'immagine.
+    Args:
+        image (numpy.ndarray): Immagine OpenCV (BGR o scala di grigi).
+    Returns:
+        EdgeMap: Mappe di aggancio dell'immagine.
+    """
+    # Importati qui: il calcolo avviene nel thread in background, quindi l'avvio dell'editor non li attende
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gray = cv2.GaussianBlur(gray, (EDGE_BLUR_KSIZE, EDGE_BLUR_KSIZE), 0)
+    edges = cv2.Canny(gray, canny_low, canny_high)
+
+    height, width = edges.shape
+    coord_dtype = np.int16 if max(width, height) <= np.iinfo(np.int16).max else np.int32
+    edge_ys, edge_xs = np.nonzero(edges)
+    if not len(edge_xs):
+        # Nessun bordo: distanza infinita ovunque, l'aggancio non sposta mai i punti
+        empty = np.zeros((height, width), dtype=coord_dtype)
+        return EdgeMap(empty, empty, np.full((height, width), np.inf, dtype=np.float32))
+
+    # I pixel di bordo sono gli zeri della trasformata; ogni pixel riceve l'etichetta del bordo più vicino
+    distance, labels = cv2.distanceTransformWithLabels(cv2.bitwise_not(edges), cv2.DIST_L2, cv2.DIST_MASK_5,
+                                                       labelType=cv2.DIST_LABEL_PIXEL)
+    # Tabella etichetta -> coordinate, letta dalle etichette dei pixel di bordo stessi
+    lut_x = np.zeros(labels.max() + 1, dtype=coord_dtype)
+    lut_y = np.zeros(labels.max() + 1, dtype=coord_dtype)
+    edge_labels = labels[edge_ys, edge_xs]
+    lut_x[edge_labels] = edge_xs
+    lut_y[edge_labels] = edge_ys
+    return EdgeMap(lut_x[labels], lut_y[labels], distance)
+
+class EdgeSnapper:
+    """
+    Aggancia i vertici al bordo più vicino dell'immagine corrente.
+    Le mappe vengono calcolate una volta per immagine in un thread in background e conservate
+    in una piccola cache; finché non sono pronte i punti restano dove sono.
+    """
+    def __init__(self, snap_radius=SNAP_RADIUS, cache_size=EDGE_CACHE_SIZE):
+        self.snap_radius = snap_radius
+        self.cache_size = cache_size
+        self.edge_map = None # Mappe dell'immagine corrente (None finché non sono pronte)
+        self._cache = OrderedDict() # chiave dell'immagine -> EdgeMap
+        self._current_key = None
+        self._lock = threading.Lock()
+
+    def set_image(self, image, key=None):
+        """
+        Imposta l'immagine corrente e ne avvia il calcolo delle mappe in background (se non già in cache).
+        Args:
+            image (numpy.ndarray): Immagine OpenCV.
+            key: Chiave della cache (es. il percorso del file); per default l'identità dell'array.
+        """
+        key = key if key is not None else id(image)
+        with self._lock:
+            self._current_key = key
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+            self.edge_map = cached
+        if cached is None:
+            threading.Thread(target=self._compute, args=(image, key), name="edge-map", daemon=True).start()
+
+    def _compute(self, image, key):
+        edge_map = compute_edge_map(image) # OpenCV rilascia il GIL: l'interfaccia resta reattiva
+        with self._lock:
+            self._cache[key] = edge_map
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            if key == self._current_key: # L'utente potrebbe aver già cambiato immagine
+                self.edge_map = edge_map
+
+    def is_ready(self):
+        return self.edge_map is not None
+
+    def snap(self, x, y):
+        """
+        Restituisce il punto agganciato al bordo più vicino, o (x, y) invariato se non c'è un bordo
+        entro snap_radius o le mappe non sono ancora pronte. Costo O(1): solo letture di array.
+        """
+        edge_map = self.edge_map
+        if edge_map is None:
+            return x, y
+        nearest = edge_map.nearest_edge(x, y)
+        if nearest is None or nearest[2] > self.snap_radius:
+            return x, y
+        return nearest[0], nearest[1]
@@ -0,0 +1,429 @@
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import time
+from collections import namedtuple
+from annotation_exporter import snapshot_to_annotation, annotation_to_snapshot, write_json_atomic, write_text_atomic
+from label_table import DEFAULT_LABEL
+
+# --- Configurazioni Globali della Pipeline di Esportazione ---
+YOLO_CLASSES_FILENAME = "classes.txt" # Nomi delle classi YOLO (uno per riga, nell'ordine degli id), nella cartella di uscita
+OUTLINE_SEGMENTS = 32 # Lati del poligono che approssima cerchi e ovali nei contorni esportati
+NORMALIZED_DECIMALS = 6 # Cifre decimali delle coordinate normalizzate (YOLO, CSV)
+DEFAULT_EXPORT_FORMATS = ("json",) # Formati scritti dall'editor se non ne vengono scelti altri
+
+# Dati derivati di una forma, calcolati una sola volta e condivisi da tutti i formati.
+# label_id: indice dell'etichetta in ExportContext.labels (id di classe YOLO; in COCO è label_id + 1); annotation: dizionario nel layout JSON nativo (snapshot_to_annotation); outline: vertici del contorno in pixel
+# (angoli ruotati per i rettangoli, poligono approssimato per cerchi e ovali); bbox e clipped_bbox: (min_x, min_y, max_x, max_y),
+# il secondo limitato all'immagine; normalized_bbox: (cx, cy, w, h) del riquadro limitato, diviso per le dimensioni dell'immagine;
+# normalized_outline: contorno normalizzato e limitato a [0, 1], come lista piatta (x1, y1, x2, y2, ...)
+ShapeRecord = namedtuple("ShapeRecord", ["index", "kind", "label", "label_id", "annotation", "closed", "outline", "bbox", "clipped_bbox",
+                                         "area", "normalized_bbox", "normalized_outline"])
+
+# Informazioni comuni a tutti i formati: base_filename è il percorso di uscita senza suffisso,
+# labels i nomi delle classi nell'ordine dei loro id
+ExportContext = namedtuple("ExportContext", ["base_filename", "image_name", "image_width", "image_height", "labels"])
+
+# Esito di run_export: tempi in secondi (preparazione dei dati derivati e, per ogni formato, aggiunta delle forme più scrittura)
+ExportReport = namedtuple("ExportReport", ["shapes", "prepare_time", "writer_times", "outputs"])
+
+# --- Dati derivati ---
+def _sample_ellipse(cx, cy, rx, ry):
+    step = 2 * math.pi / OUTLINE_SEGMENTS
+    return tuple((cx + rx * math.cos(i * step), cy + ry * math.sin(i * step)) for i in range(OUTLINE_SEGMENTS))
+
+def _clamp(value, upper):
+    return min(max(value, 0), upper)
+
+def _clip_edge(points, axis, bound, keep_above):
+    """Un passo di Sutherland-Hodgman: mantiene la parte del poligono da un lato della retta coordinata[axis] = bound."""
+    result = []
+    if not points:
+        return result
+    previous = points[-1]
+    previous_inside = previous[axis] >= bound if keep_above else previous[axis] <= bound
+    for current in points:
+        current_inside = current[axis] >= bound if keep_above else current[axis] <= bound
+        if current_inside != previous_inside:
+            t = (bound - previous[axis]) / (current[axis] - previous[axis])
+            other = previous[1 - axis] + t * (current[1 - axis] - previous[1 - axis])
+            result.append((bound, other) if axis == 0 else (other, bound))
+        if current_inside:
+            result.append(current)
+        previous, previous_inside = current, current_inside
+    return result
+
+def clip_polygon(points, x0, y0, x1, y1):
+    """
+    Ritaglia un poligono chiuso sul rettangolo [x0, x1] x [y0, y1] (Sutherland-Hodgman).
+    Returns:
+        list: Vertici del poligono ritagliato (vuota se il poligono è interamente fuori).
+    """
+    points = list(points)
+    for axis, bound, keep_above in ((0, x0, True), (0, x1, False), (1, y0, True), (1, y1, False)):
+        points = _clip_edge(points, axis, bound, keep_above)
+    # Vertici consecutivi coincidenti (un vertice esattamente sul bordo) non servono
+    return [p for i, p in enumerate(points) if p != points[i - 1]] if len(points) > 1 else points
+
+def polygon_area(points):
+    """Area di un poligono chiuso (formula di Gauss)."""
+    return abs(sum(points[i - 1][0] * points[i][1] - points[i][0] * points[i - 1][1] for i in range(len(points)))) / 2
+
+def build_record(index, annotation, image_width, image_height, label_id=0):
+    """
+    Calcola i dati derivati di un'annotazione nel layout JSON nativo.
+    Per poligoni e polilinee usa i vertici esportati (eventualmente semplificati), così tutti i formati
+    descrivono la stessa geometria.
+    """
+    kind = annotation["type"]
+    coordinates = annotation["coordinates"]
+    closed = True
+    if kind == "rectangle":
+        x1, y1, x2, y2 = coordinates["x1"], coordinates["y1"], coordinates["x2"], coordinates["y2"]
+        angle = coordinates["angle_rad"]
+        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2 # Stesso centro di rotazione dell'editor
+        half_w, half_h = (x2 - x1) / 2, (y2 - y1) / 2
+        cos_a, sin_a = math.cos(angle), math.sin(angle)
+        outline = tuple((cx + x * cos_a - y * sin_a, cy + x * sin_a + y * cos_a)
+                        for x, y in ((-half_w, -half_h), (half_w, -half_h), (half_w, half_h), (-half_w, half_h)))
+        area = abs(x2 - x1) * abs(y2 - y1)
+    elif kind == "circle":
+        cx, cy, radius = coordinates["cx"], coordinates["cy"], coordinates["radius"]
+        outline = _sample_ellipse(cx, cy, radius, radius)
+        area = math.pi * radius ** 2
+    elif kind == "ellipse":
+        x1, y1, x2, y2 = coordinates["x1"], coordinates["y1"], coordinates["x2"], coordinates["y2"]
+        outline = _sample_ellipse((x1 + x2) / 2, (y1 + y2) / 2, abs(x2 - x1) / 2, abs(y2 - y1) / 2)
+        area = math.pi * abs(x2 - x1) * abs(y2 - y1) / 4
+    else:
+        outline = tuple((x, y) for x, y in coordinates)
+        closed = kind == "polygon" and annotation.get("is_closed", False)
+        area = polygon_area(outline) if closed and len(outline) > 2 else 0.0
+
+    if kind in ("circle", "ellipse"): # Riquadro esatto, non quello del poligono approssimato
+        if kind == "circle":
+            bbox = (cx - radius, cy - radius, cx + radius, cy + radius)
+        else:
+            bbox = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+    elif outline:
+        xs = [x for x, _ in outline]
+        ys = [y for _, y in outline]
+        bbox = (min(xs), min(ys), max(xs), max(ys))
+    else:
+        bbox = (0, 0, 0, 0)
+
+    clipped_bbox = (_clamp(bbox[0], image_width), _clamp(bbox[1], image_height),
+                    _clamp(bbox[2], image_width), _clamp(bbox[3], image_height))
+    normalized_bbox = ((clipped_bbox[0] + clipped_bbox[2]) / 2 / image_width,
+                       (clipped_bbox[1] + clipped_bbox[3]) / 2 / image_height,
+                       (clipped_bbox[2] - clipped_bbox[0]) / image_width,
+                       (clipped_bbox[3] - clipped_bbox[1]) / image_height)
+    normalized_outline = []
+    for x, y in outline:
+        normalized_outline.append(_clamp(x / image_width, 1.0))
+        normalized_outline.append(_clamp(y / image_height, 1.0))
+    return ShapeRecord(index, kind, annotation["label"], label_id, annotation, closed, outline, bbox, clipped_bbox, area,
+                       normalized_bbox, normalized_outline)
+
+# --- Formati di uscita ---
+class ExportWriter:
+    """
+    Formato di esportazione: riceve i ShapeRecord uno alla volta durante l'unico passaggio sulle forme
+    e scrive il proprio file (in modo atomico) in finish(). Le sottoclassi definiscono NAME e SUFFIX
+    e implementano add() e finish(); nessun formato ricalcola la geometria.
+    """
+    NAME = None
+    SUFFIX = None # Aggiunto a ExportContext.base_filename
+    USES_GEOMETRY = True # False se il formato legge solo record.annotation (i dati derivati non vengono calcolati)
+
+    def begin(self, context):
+        self.context = context
+
+    def output_path(self):
+        return self.context.base_filename + self.SUFFIX
+
+    def add(self, record):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+EXPORT_WRITERS = {} # Nome del formato -> classe ExportWriter
+
+def register_writer(writer_class):
+    """Registra un formato (utilizzabile anche come decoratore di classe)."""
+    EXPORT_WRITERS[writer_class.NAME] = writer_class
+    return writer_class
+
+def create_writers(names):
+    """Istanzia i formati indicati per nome; solleva ValueError per i nomi sconosciuti."""
+    unknown = [name for name in names if name not in EXPORT_WRITERS]
+    if unknown:
+        raise ValueError(f"Formati di esportazione sconosciuti: {', '.join(unknown)}")
+    return [EXPORT_WRITERS[name]() for name in names]
+
+@register_writer
+class JsonWriter(ExportWriter):
+    """Formato nativo dell'editor (identico a export_annotations_to_json)."""
+    NAME = "json"
+    SUFFIX = "_annotations.json"
+    USES_GEOMETRY = False
+
+    def begin(self, context):
+        super().begin(context)
+        self.annotations = []
+
+    def add(self, record):
+        self.annotations.append(record.annotation)
+
+    def finish(self):
+        write_json_atomic(self.annotations, self.output_path())
+
+@register_writer
+class YoloWriter(ExportWriter):
+    """
+    File di testo YOLO, una riga per forma chiusa: "classe cx cy w h" normalizzati sul riquadro.
+    Le polilinee (forme aperte) non hanno un riquadro significativo e vengono saltate.
+    I nomi delle classi vengono scritti in YOLO_CLASSES_FILENAME, nella stessa cartella.
+    """
+    NAME = "yolo"
+    SUFFIX = ".txt"
+    SEGMENTATION = False # True: "classe x1 y1 x2 y2 ..." con il contorno normalizzato (YOLO segmentation)
+
+    def begin(self, context):
+        super().begin(context)
+        self.lines = []
+
+    def add(self, record):
+        if not record.closed:
+            return
+        values = record.normalized_outline if self.SEGMENTATION else record.normalized_bbox
+        if not values or (not self.SEGMENTATION and (values[2] <= 0 or values[3] <= 0)):
+            return # Forma interamente fuori dall'immagine
+        self.lines.append(f"{record.label_id} " + " ".join(f"{value:.{NORMALIZED_DECIMALS}f}" for value in values))
+
+    def finish(self):
+        write_text_atomic("".join(line + "\n" for line in self.lines), self.output_path())
+        classes_path = os.path.join(os.path.dirname(self.context.base_filename), YOLO_CLASSES_FILENAME)
+        write_text_atomic("".join(name + "\n" for name in self.context.labels), classes_path)
+
+@register_writer
+class YoloSegmentationWriter(YoloWriter):
+    NAME = "yolo_seg"
+    SUFFIX = "_seg.txt"
+    SEGMENTATION = True
+
+@register_writer
+class CocoWriter(ExportWriter):
+    """
+    File COCO (instances) con una sola immagine; riquadri in pixel [x, y, w, h] limitati all'immagine,
+    e contorno e area delle forme che escono dall'immagine calcolati sulla sola parte visibile.
+    """
+    NAME = "coco"
+    SUFFIX = "_coco.json"
+
+    def begin(self, context):
+        super().begin(context)
+        self.annotations = []
+
+    def add(self, record):
+        if not record.closed:
+            return
+        min_x, min_y, max_x, max_y = record.clipped_bbox
+        if max_x <= min_x or max_y <= min_y:
+            return
+        outline, area = record.outline, record.area
+        if record.clipped_bbox != record.bbox: # Stessa geometria del riquadro limitato
+            outline = clip_polygon(outline, 0, 0, self.context.image_width, self.context.image_height)
+            if len(outline) < 3:
+                return
+            area = polygon_area(outline)
+        segmentation = [coordinate for point in outline for coordinate in point]
+        self.annotations.append({
+            "id": len(self.annotations) + 1,
+            "image_id": 1,
+            "category_id": record.label_id + 1, # In COCO gli id partono da 1
+            "bbox": [min_x, min_y, max_x - min_x, max_y - min_y],
+            "area": area,
+            "segmentation": [segmentation],
+            "iscrowd": 0
+        })
+
+    def finish(self):
+        context = self.context
+        data = {
+            "images": [{"id": 1, "file_name": context.image_name, "width": context.image_width, "height": context.image_height}],
+            "annotations": self.annotations,
+            "categories": [{"id": i + 1, "name": name} for i, name in enumerate(context.labels)]
+        }
+        write_json_atomic(data, self.output_path())
+
+@register_writer
+class CsvWriter(ExportWriter):
+    """Tabella CSV con una riga per forma (anche aperta): riquadro in pixel, area e riquadro normalizzato."""
+    NAME = "csv"
+    SUFFIX = "_annotations.csv"
+    COLUMNS = ("id", "type", "label", "closed", "min_x", "min_y", "max_x", "max_y", "area",
+               "cx_norm", "cy_norm", "w_norm", "h_norm", "vertices")
+
+    def begin(self, context):
+        super().begin(context)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow(self.COLUMNS)
+
+    def add(self, record):
+        self.writer.writerow([record.index, record.kind, record.label, int(record.closed)] +
+                             [round(value, 2) for value in record.bbox] + [round(record.area, 2)] +
+                             [round(value, NORMALIZED_DECIMALS) for value in record.normalized_bbox] +
+                             [len(record.outline)])
+
+    def finish(self):
+        write_text_atomic(self.buffer.getvalue(), self.output_path())
+
+@register_writer
+class VocWriter(ExportWriter):
+    """File XML Pascal VOC: un <object> per forma chiusa, con il riquadro in pixel interi limitato all'immagine."""
+    NAME = "voc"
+    SUFFIX = ".xml"
+
+    def begin(self, context):
+        import xml.etree.ElementTree as ET # Caricato solo se il formato viene usato (pyexpat rallenta l'avvio)
+        super().begin(context)
+        self.root = ET.Element("annotation")
+        ET.SubElement(self.root, "filename").text = context.image_name
+        size = ET.SubElement(self.root, "size")
+        ET.SubElement(size, "width").text = str(context.image_width)
+        ET.SubElement(size, "height").text = str(context.image_height)
+        ET.SubElement(size, "depth").text = "3"
+
+    def add(self, record):
+        import xml.etree.ElementTree as ET
+        if not record.closed:
+            return
+        min_x, min_y, max_x, max_y = (int(round(value)) for value in record.clipped_bbox)
+        if max_x <= min_x or max_y <= min_y:
+            return
+        obj = ET.SubElement(self.root, "object")
+        ET.SubElement(obj, "name").text = record.label
+        ET.SubElement(obj, "pose").text = "Unspecified"
+        ET.SubElement(obj, "truncated").text = "1" if record.clipped_bbox != record.bbox else "0"
+        ET.SubElement(obj, "difficult").text = "0"
+        bndbox = ET.SubElement(obj, "bndbox")
+        for tag, value in (("xmin", min_x), ("ymin", min_y), ("xmax", max_x), ("ymax", max_y)):
+            ET.SubElement(bndbox, tag).text = str(value)
+
+    def finish(self):
+        import xml.etree.ElementTree as ET
+        ET.indent(self.root)
+        write_text_atomic(ET.tostring(self.root, encoding="unicode") + "\n", self.output_path())
+
+# --- Esportazione ---
+def run_export(snapshot, image_width, image_height, base_filename, writers, image_name=None, labels=None,
+               simplify_tolerance=None, include_original=False, checkpoint=None, checkpoint_step=256):
+    """
+    Esporta le forme in tutti i formati richiesti con un solo passaggio: per ogni forma l'annotazione nativa
+    e i dati derivati (ShapeRecord) vengono calcolati una volta e passati a ogni formato.
+    Args:
+        snapshot (tuple): ShapeSnapshot delle forme (snapshot_shapes).
+        base_filename (str): Percorso di uscita senza suffisso (es. "immagine"): ogni formato aggiunge il proprio.
+        writers (list): Istanze di ExportWriter (vedi create_writers).
+        image_name (str): Nome del file immagine riportato nei formati che lo richiedono (COCO, VOC).
+        labels (tuple): Nomi delle classi nell'ordine dei loro id (es. LABELS.names(), per avere gli stessi id
+                        in tutte le immagini); le etichette delle forme non presenti vengono aggiunte in fondo.
+                        Se None, le etichette delle forme nell'ordine in cui compaiono.
+        checkpoint (callable): Se indicata, chiamata con la frazione completata ogni checkpoint_step forme
+                               e prima della scrittura dei file (può sollevare un'eccezione per annullare).
+    Returns:
+        ExportReport: Numero di forme, tempi di preparazione e di ogni formato, file scritti.
+    """
+    label_ids = {name: i for i, name in enumerate(labels or ())}
+    for shape_snapshot in snapshot:
+        label_ids.setdefault(shape_snapshot.label or DEFAULT_LABEL, len(label_ids))
+    context = ExportContext(base_filename, image_name or os.path.basename(base_filename), image_width, image_height,
+                            tuple(label_ids))
+    writer_times = {writer.NAME: 0.0 for writer in writers}
+    for writer in writers:
+        start = time.perf_counter()
+        writer.begin(context)
+        writer_times[writer.NAME] += time.perf_counter() - start
+
+    uses_geometry = any(writer.USES_GEOMETRY for writer in writers)
+    prepare_time = 0.0
+    total = len(snapshot)
+    for i, shape_snapshot in enumerate(snapshot):
+        if checkpoint is not None and i % checkpoint_step == 0:
+            checkpoint(i / max(total, 1))
+        start = time.perf_counter()
+        annotation = snapshot_to_annotation(i, shape_snapshot, simplify_tolerance, include_original)
+        label_id = label_ids[annotation["label"]]
+        if uses_geometry:
+            record = build_record(i, annotation, image_width, image_height, label_id)
+        else:
+            record = ShapeRecord(i, annotation["type"], annotation["label"], label_id, annotation,
+                                 None, None, None, None, None, None, None)
+        prepare_time += time.perf_counter() - start
+        for writer in writers:
+            start = time.perf_counter()
+            writer.add(record)
+            writer_times[writer.NAME] += time.perf_counter() - start
+
+    if checkpoint is not None:
+        checkpoint(1.0) # Ultima occasione di annullare prima di sostituire i file
+    for writer in writers:
+        start = time.perf_counter()
+        writer.finish()
+        writer_times[writer.NAME] += time.perf_counter() - start
+    return ExportReport(total, prepare_time, writer_times, [writer.output_path() for writer in writers])
+
+def format_report(report):
+    """Riepilogo leggibile dei tempi di un'esportazione."""
+    parts = [f"preparazione {report.prepare_time * 1000:.1f} ms"]
+    parts += [f"{name} {elapsed * 1000:.1f} ms" for name, elapsed in report.writer_times.items()]
+    return f"{report.shapes} forme: " + ", ".join(parts)
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    from annotation_index import find_image_path, find_image_size, ANNOTATION_FILE_SUFFIX
+
+    parser = argparse.ArgumentParser(description="Converte file *_annotations.json negli altri formati di esportazione.")
+    parser.add_argument("files", nargs="+", help="File *_annotations.json")
+    parser.add_argument("--formats", default="yolo,coco,csv,voc",
+                        help=f"Formati separati da virgole (disponibili: {', '.join(EXPORT_WRITERS)})")
+    parser.add_argument("--images", default=None, help="Cartella delle immagini (default: quella delle annotazioni)")
+    parser.add_argument("--output", default=None, help="Cartella di uscita (default: quella delle annotazioni)")
+    parser.add_argument("--labels", default=None,
+                        help="Classi separate da virgole, nell'ordine degli id (default: quelle dei file, in ordine di apparizione)")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.formats.split(",") if name.strip()]
+    try:
+        create_writers(names)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Tutti i file vengono letti prima di scrivere, così gli id delle classi sono gli stessi in tutto il dataset
+    snapshots = []
+    labels = [name.strip() for name in args.labels.split(",") if name.strip()] if args.labels else []
+    for path in args.files:
+        with open(path, 'r') as f:
+            snapshot = tuple(annotation_to_snapshot(annotation) for annotation in json.load(f))
+        snapshots.append((path, snapshot))
+        for shape_snapshot in snapshot:
+            if shape_snapshot.label not in labels:
+                labels.append(shape_snapshot.label)
+
+    for path, snapshot in snapshots:
+        size = find_image_size(path, args.images)
+        if size is None:
+            print(f"Immagine non trovata per {path}")
+            continue
+        base_name = os.path.basename(path)
+        base_name = base_name[:-len(ANNOTATION_FILE_SUFFIX)] if base_name.endswith(ANNOTATION_FILE_SUFFIX) else os.path.splitext(base_name)[0]
+        base_filename = os.path.join(args.output or os.path.dirname(path), base_name)
+        report = run_export(snapshot, size[0], size[1], base_filename, create_writers(names),
+                            image_name=os.path.basename(find_image_path(path, args.images)), labels=labels)
+        print(f"{path}: {format_report(report)}")
@@ -0,0 +1,127 @@
+from geometry_utils import simplify_douglas_peucker, SIMPLIFY_TOLERANCE
+
+# --- Configurazioni Globali per il Lazo a Mano Libera ---
+LASSO_INITIAL_CAPACITY = 1024 # Capacità iniziale del buffer dei punti (raddoppia quando è pieno)
+LASSO_MIN_DISTANCE = 2.0 # Distanza minima (pixel) tra due punti acquisiti consecutivi
+COLOR_LASSO_PREVIEW = "cyan" # Colore del tracciato durante il disegno
+LASSO_PREVIEW_TAG = "lasso_preview" # Tag comune dei segmenti di anteprima sul canvas
+
+# --- Buffer di punti crescente ---
+class PointBuffer:
+    """
+    Buffer di punti (x, y) preallocato in un array NumPy contiguo.
+    Quando è pieno la capacità raddoppia, quindi l'aggiunta costa O(1) ammortizzato.
+    L'array viene allocato al primo punto (il buffer è creato all'avvio dell'editor, NumPy no).
+    """
+    def __init__(self, capacity=LASSO_INITIAL_CAPACITY):
+        self.capacity = capacity
+        self.data = None
+        self.size = 0
+
+    def append(self, x, y):
+        """Aggiunge un punto in coda al buffer."""
+        if self.data is None or self.size == len(self.data):
+            import numpy as np
+            if self.data is None:
+                self.data = np.empty((self.capacity, 2), dtype=np.float32)
+            else:
+                grown = np.empty((len(self.data) * 2, 2), dtype=np.float32)
+                grown[:self.size] = self.data[:self.size]
+                self.data = grown
+        self.data[self.size] = (x, y)
+        self.size += 1
+
+    def view(self, start=0, end=None):
+        """Restituisce una vista (senza copia) dei punti nell'intervallo indicato."""
+        return self.data[start:self.size if end is None else end]
+
+    def clear(self):
+        """Svuota il buffer mantenendo la memoria già allocata."""
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+# --- Acquisizione del lazo ---
+class LassoRecorder:
+    """
+    Acquisisce un tracciato a mano libera dagli eventi di trascinamento.
+    I punti grezzi finiscono in un PointBuffer; i vertici mantenuti vengono semplificati
+    durante il disegno e sul canvas viene aggiunto (o aggiornato) solo l'ultimo segmento.
+    """
+    def __init__(self, canvas, tolerance=SIMPLIFY_TOLERANCE, min_distance=LASSO_MIN_DISTANCE,
+                 color=COLOR_LASSO_PREVIEW, border_width=2):
+        self.canvas = canvas
+        self.tolerance = tolerance
+        self.min_distance = min_distance
+        self.color = color
+        self.border_width = border_width
+
+        self.raw_points = PointBuffer() # Tutti i punti acquisiti
+        self.kept_points = [] # Vertici mantenuti dopo la semplificazione incrementale
+        self.kept_indices = [] # Indici dei vertici mantenuti nel buffer dei punti grezzi
+        self.segment_ids = [] # ID dei segmenti di anteprima (uno per vertice mantenuto dopo il primo)
+
+    def start(self, x, y):
+        """Inizia un nuovo tracciato nel punto indicato."""
+        self.cancel()
+        self.raw_points.append(x, y)
+        self.kept_points.append((x, y))
+        self.kept_indices.append(0)
+
+    def add_point(self, x, y):
+        """
+        Aggiunge un punto al tracciato.
+        Se tutti i punti grezzi dall'ultimo vertice fisso stanno entro la tolleranza dal segmento
+        che termina nel nuovo punto, l'ultimo vertice viene spostato invece di aggiungerne uno nuovo.
+        """
+        if not self.kept_points:
+            self.start(x, y)
+            return
+
+        last_x, last_y = self.kept_points[-1]
+        if (x - last_x) ** 2 + (y - last_y) ** 2 < self.min_distance ** 2:
+            return # Filtro radiale: movimenti troppo piccoli non aggiungono informazione
+
+        self.raw_points.append(x, y)
+        new_index = len(self.raw_points) - 1
+
+        if len(self.kept_points) >= 2:
+            anchor_index = self.kept_indices[-2]
+            anchor_x, anchor_y = self.kept_points[-2]
+            import numpy as np
+            between = self.raw_points.view(anchor_index + 1, new_index) - (anchor_x, anchor_y)
+            seg_x, seg_y = x - anchor_x, y - anchor_y
+            seg_len = np.hypot(seg_x, seg_y)
+            if seg_len > 0:
+                deviation = np.abs(seg_x * between[:, 1] - seg_y * between[:, 0]) / seg_len
+                if deviation.max() <= self.tolerance:
+                    # Tratto ancora rettilineo: estende l'ultimo segmento
+                    self.kept_points[-1] = (x, y)
+                    self.kept_indices[-1] = new_index
+                    self.canvas.coords(self.segment_ids[-1], anchor_x, anchor_y, x, y)
+                    return
+
+        self.segment_ids.append(self.canvas.create_line(
+            last_x, last_y, x, y,
+            fill=self.color, width=self.border_width, tags=LASSO_PREVIEW_TAG
+        ))
+        self.kept_points.append((x, y))
+        self.kept_indices.append(new_index)
+
+    def finish(self):
+        """
+        Termina il tracciato, rimuove l'anteprima e restituisce i vertici del poligono chiuso
+        (con un'ultima passata di Douglas-Peucker sui soli vertici mantenuti).
+        """
+        points = simplify_douglas_peucker(self.kept_points, self.tolerance, closed=True)
+        self.cancel()
+        return points
+
+    def cancel(self):
+        """Annulla il tracciato corrente e rimuove l'anteprima dal canvas."""
+        self.canvas.delete(LASSO_PREVIEW_TAG)
+        self.raw_points.clear()
+        self.kept_points = []
+        self.kept_indices = []
+        self.segment_ids = []
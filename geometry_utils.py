@@ -0,0 +1,78 @@
+# NumPy viene importato alla prima semplificazione: questo modulo è caricato all'avvio dell'editor
+
+# --- Configurazioni Globali per la Semplificazione ---
+SIMPLIFY_TOLERANCE = 1.0 # Tolleranza predefinita in pixel per Douglas-Peucker
+
+def _douglas_peucker_mask(pts, tolerance, splits):
+    """
+    Calcola la maschera dei vertici da mantenere con l'algoritmo di Douglas-Peucker.
+    La ricorsione è sostituita da una pila esplicita; per ogni segmento le distanze
+    di tutti i vertici intermedi sono calcolate in un'unica operazione vettoriale.
+    Args:
+        pts (numpy.ndarray): Array (N, 2) dei vertici.
+        tolerance (float): Distanza massima ammessa in pixel.
+        splits (list): Indici iniziali sempre mantenuti (estremi della catena).
+    Returns:
+        numpy.ndarray: Maschera booleana di lunghezza N.
+    """
+    import numpy as np
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[splits] = True
+    stack = list(zip(splits[:-1], splits[1:]))
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        seg_x, seg_y = pts[end] - pts[start]
+        rel = pts[start + 1:end] - pts[start]
+        seg_len = np.hypot(seg_x, seg_y)
+        if seg_len == 0:
+            # Estremi coincidenti: distanza euclidea dal punto
+            distances = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            # Distanza perpendicolare dalla retta tramite prodotto vettoriale
+            distances = np.abs(seg_x * rel[:, 1] - seg_y * rel[:, 0]) / seg_len
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return keep
+
+def simplify_douglas_peucker(points, tolerance=SIMPLIFY_TOLERANCE, closed=False):
+    """
+    Semplifica una sequenza di vertici con l'algoritmo di Douglas-Peucker.
+    Args:
+        points (list): Lista di tuple (x, y).
+        tolerance (float): Distanza massima (in pixel) tra la forma originale e quella semplificata.
+        closed (bool): True se i punti descrivono un poligono chiuso (l'ultimo vertice si collega al primo).
+    Returns:
+        list: Sottoinsieme dei punti originali (stesse tuple, stesso ordine).
+    """
+    min_points = 3 if closed else 2
+    if tolerance <= 0 or len(points) <= min_points:
+        return list(points)
+
+    import numpy as np
+    pts = np.asarray(points, dtype=np.float64)
+    n = len(pts)
+
+    if closed:
+        # Chiude l'anello ripetendo il primo vertice e lo divide nel vertice più lontano dal primo,
+        # così entrambe le catene hanno estremi distinti
+        ring = np.vstack([pts, pts[:1]])
+        offsets = ring - ring[0]
+        farthest = int(np.argmax(offsets[:, 0] ** 2 + offsets[:, 1] ** 2))
+        keep = _douglas_peucker_mask(ring, tolerance, [0, farthest, n])[:n]
+    else:
+        keep = _douglas_peucker_mask(pts, tolerance, [0, n - 1])
+
+    indices = np.flatnonzero(keep)
+    if len(indices) < min_points:
+        return list(points) # La semplificazione degenererebbe la forma
+    return [points[i] for i in indices]
@@ -0,0 +1,99 @@
+import math
+from interactive_shapes import InteractiveRectangle, InteractiveCircle, InteractiveEllipse
+
+def _pack_coordinates(shapes):
+    """
+    Raccoglie in un unico array (N, 2) tutti i punti da trasformare di un gruppo di forme.
+    Rettangoli, cerchi e ovali contribuiscono con il solo centro (dimensioni e angolo sono
+    aggiornati a parte); poligoni e polilinee con tutti i vertici (anche quelli a piena risoluzione).
+    Returns:
+        tuple: (array dei punti, lista di (forma, indice iniziale, numero di vertici, numero di vertici originali)).
+    """
+    import numpy as np # Importato al primo uso, non all'avvio dell'editor
+    chunks = []
+    layout = []
+    offset = 0
+    for shape in shapes:
+        if isinstance(shape, (InteractiveRectangle, InteractiveEllipse)):
+            chunk = [((shape.x1 + shape.x2) / 2, (shape.y1 + shape.y2) / 2)]
+            original_count = 0
+        elif isinstance(shape, InteractiveCircle):
+            chunk = [(shape.cx, shape.cy)]
+            original_count = 0
+        else:
+            original = shape.original_points or []
+            chunk = list(shape.points) + list(original)
+            original_count = len(original)
+        chunks.extend(chunk)
+        layout.append((shape, offset, len(chunk) - original_count, original_count))
+        offset += len(chunk)
+    return np.asarray(chunks, dtype=np.float64).reshape(-1, 2), layout
+
+def apply_group_transform(shapes, dx=0, dy=0, scale=1.0, angle=0.0, origin=(0, 0)):
+    """
+    Applica a tutte le forme del gruppo la stessa trasformazione (rotazione di angle radianti e
+    scala uniforme attorno a origin, seguite da una traslazione dx, dy) in un'unica operazione
+    vettoriale sulle coordinate di tutte le forme.
+    Gli ovali sono allineati agli assi: ruotandoli si sposta solo il loro centro.
+    Returns:
+        list: Coppie (cerchio, coordinate precedenti) dei cerchi il cui raggio è stato limitato al minimo,
+        per i quali la trasformazione inversa non ripristinerebbe le coordinate di partenza.
+    """
+    points, layout = _pack_coordinates(shapes)
+    clamped = []
+    if not len(points):
+        return clamped
+
+    import numpy as np
+    translation_only = scale == 1 and angle == 0
+    if translation_only:
+        points += (dx, dy)
+        if float(dx).is_integer() and float(dy).is_integer() and np.array_equal(points, np.round(points)):
+            points = points.astype(np.int64) # Conserva le coordinate intere
+    else:
+        cos_a, sin_a = math.cos(angle) * scale, math.sin(angle) * scale
+        matrix = np.array([[cos_a, -sin_a], [sin_a, cos_a]])
+        points = (points - origin) @ matrix.T + origin + (dx, dy)
+
+    coords = points.tolist()
+    for shape, start, count, original_count in layout:
+        if isinstance(shape, (InteractiveRectangle, InteractiveEllipse)):
+            if translation_only:
+                shape.move(dx, dy)
+                continue
+            cx, cy = coords[start]
+            half_w = (shape.x2 - shape.x1) / 2 * scale
+            half_h = (shape.y2 - shape.y1) / 2 * scale
+            shape.update_coords(cx - half_w, cy - half_h, cx + half_w, cy + half_h)
+            if isinstance(shape, InteractiveRectangle):
+                shape.set_angle(shape.angle + angle)
+        elif isinstance(shape, InteractiveCircle):
+            if translation_only:
+                shape.move(dx, dy)
+                continue
+            cx, cy = coords[start]
+            old_coords = shape.get_coords()
+            shape.update_coords(cx, cy, shape.radius * scale)
+            if shape.radius != old_coords[2] * scale:
+                clamped.append((shape, old_coords))
+        else:
+            original = [tuple(p) for p in coords[start + count:start + count + original_count]] if original_count else None
+            shape.set_points([tuple(p) for p in coords[start:start + count]], original)
+    return clamped
+
+def group_center(shapes):
+    """Centro del riquadro che contiene tutte le forme (origine naturale per scala e rotazione)."""
+    import numpy as np
+    boxes = np.array([shape.get_bbox() for shape in shapes], dtype=np.float64).reshape(-1, 4)
+    return (boxes[:, 0].min() + boxes[:, 2].max()) / 2, (boxes[:, 1].min() + boxes[:, 3].max()) / 2
+
+def shapes_in_rect(shapes, x1, y1, x2, y2):
+    """Restituisce le forme interamente contenute nel rettangolo (selezione a riquadro), con un test vettoriale."""
+    if not shapes:
+        return []
+    x_min, x_max = min(x1, x2), max(x1, x2)
+    y_min, y_max = min(y1, y2), max(y1, y2)
+    import numpy as np
+    boxes = np.array([shape.get_bbox() for shape in shapes], dtype=np.float64).reshape(-1, 4)
+    inside = (boxes[:, 0] >= x_min) & (boxes[:, 1] >= y_min) & (boxes[:, 2] <= x_max) & (boxes[:, 3] <= y_max)
+    return [shapes[i] for i in np.flatnonzero(inside)]
@@ -1,5 +1,4 @@
-import cv2
-import numpy as np
+# OpenCV, NumPy e Pillow sono importati nelle funzioni, al primo uso: il modulo è caricato all'avvio dell'editor
 
 def create_blank_cv_image(width, height, color=(0, 0, 0)):
     """
@@ -11,6 +10,7 @@ def create_blank_cv_image(width, height, color=(0, 0, 0)):
     Returns:
         numpy.ndarray: L'immagine OpenCV creata.
     """
+    import numpy as np
     # Crea un'immagine nera di base
     image = np.zeros((height, width, 3), dtype=np.uint8)
     # Riempie l'immagine con il colore specificato
@@ -25,8 +25,25 @@ def load_cv_image(path):
     Returns:
         numpy.ndarray or None: L'immagine OpenCV caricata, o None se il caricamento fallisce.
     """
+    import cv2
     image = cv2.imread(path)
     if image is None:
         print(f"Errore: Impossibile caricare l'immagine da {path}")
     return image
 
+
+def read_image_size(path):
+    """
+    Legge le dimensioni di un'immagine dalla sola intestazione del file, senza decodificare i pixel.
+    Args:
+        path (str): Percorso del file immagine.
+    Returns:
+        tuple or None: (larghezza, altezza) in pixel, o None se il file non è un'immagine leggibile.
+    """
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (IOError, SyntaxError) as e:
+        print(f"Errore: Impossibile leggere le dimensioni dell'immagine {path}: {e}")
+        return None
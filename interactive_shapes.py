@@ -1,8 +1,7 @@
 import tkinter as tk
-from PIL import Image, ImageTk
-import cv2
-import numpy as np
 import math
+from geometry_utils import simplify_douglas_peucker, SIMPLIFY_TOLERANCE
+from label_table import LABELS, DEFAULT_LABEL_ID
 
 # --- Configurazioni Globali per le Forme ---
 HANDLE_SIZE = 10 # Dimensione delle maniglie quadrate
@@ -17,13 +16,32 @@ COLOR_POLYGON_BORDER = "cyan" # Colore per il poligono
 COLOR_POLYGON_VERTEX_HANDLE = "magenta" # Colore per le maniglie dei vertici del poligono
 COLOR_POLYLINE_BORDER = "orange" # Nuovo colore per la polilinea
 COLOR_POLYLINE_VERTEX_HANDLE = "lime" # Colore per le maniglie dei vertici della polilinea
+SELECTION_TAG = "selected" # Tag del canvas condiviso dagli elementi delle forme selezionate (selezione multipla)
+
+def label_item_options(label_id):
+    """Tag dell'etichetta e stato iniziale (nascosto se l'etichetta è nascosta) degli elementi del canvas di una forma."""
+    return {"tags": (LABELS.tag(label_id),), "state": LABELS.item_state(label_id)}
+
+def set_shape_label(shape, label_id):
+    """
+    Assegna un'etichetta a una forma di qualsiasi tipo, spostando i suoi elementi già disegnati
+    sul tag della nuova etichetta (senza ridisegnarli).
+    """
+    canvas = shape.canvas
+    if canvas is not None:
+        for item in [shape.get_body_id()] + shape.handle_ids:
+            if item:
+                canvas.dtag(item, LABELS.tag(shape.label_id))
+                canvas.addtag_withtag(LABELS.tag(label_id), item)
+                canvas.itemconfigure(item, state=LABELS.item_state(label_id))
+    shape.label_id = label_id
 
 # --- Classe per il Rettangolo Interattivo ---
 class InteractiveRectangle:
     """
     Rappresenta un rettangolo disegnabile, ridimensionabile, ruotabile e riempibile su un canvas Tkinter.
     """
-    def __init__(self, canvas, x1, y1, x2, y2, color=COLOR_RECTANGLE_BORDER, border_width=2, fill_color=""):
+    def __init__(self, canvas, x1, y1, x2, y2, color=COLOR_RECTANGLE_BORDER, border_width=2, fill_color="", label_id=DEFAULT_LABEL_ID):
         self.canvas = canvas
         self.x1 = x1
         self.y1 = y1
@@ -32,6 +50,8 @@ class InteractiveRectangle:
         self.color = color
         self.border_width = border_width
         self.fill_color = fill_color # Nuovo attributo per il colore di riempimento
+        self.label_id = label_id # Id dell'etichetta di classe nella tabella LABELS
+        self.sync_uid = None # Id della forma nel servizio di annotazione (assegnato alla prima sincronizzazione)
         self.angle = 0 # Angolo di rotazione in radianti (0 gradi inizialmente)
         
         self.rect_id = None # ID del poligono che rappresenta il rettangolo
@@ -43,28 +63,34 @@ class InteractiveRectangle:
         self.start_drag_y = 0
         self.start_angle = 0 # Angolo iniziale del rettangolo al momento del clic per la rotazione
 
-    def draw(self):
+        # Geometria derivata (angoli, maniglie, coordinate piatte, riquadro) calcolata una volta e riusata
+        # finché la forma non viene modificata tramite i suoi metodi
+        self._geometry_cache = {}
+        self.geometry_version = 0 # Incrementato a ogni modifica della geometria
+
+    def draw(self, show_handles=True):
         """
-        Disegna il rettangolo ruotato e le sue maniglie sul canvas Tkinter.
+        Disegna il rettangolo ruotato e, se show_handles è True, le sue maniglie sul canvas Tkinter.
         Rimuove le forme precedenti prima di ridisegnare.
         """
         self.delete_shapes() # Pulisce le forme precedenti
 
-        # Calcola i 4 angoli del rettangolo ruotato
-        rotated_corners = self._get_rotated_corners()
-        # Converte la lista di tuple in una lista piatta per create_polygon
-        polygon_points = []
-        for p in rotated_corners:
-            polygon_points.extend(p)
+        # Angoli del rettangolo ruotato come lista piatta per create_polygon (dalla cache se invariati)
+        polygon_points = self._get_flat_points()
 
         # Disegna il rettangolo come un poligono, usando il colore di riempimento
         self.rect_id = self.canvas.create_polygon(
             *polygon_points,
-            outline=self.color, width=self.border_width, fill=self.fill_color # Usa self.fill_color qui
+            outline=self.color, width=self.border_width, fill=self.fill_color, # Usa self.fill_color qui
+            **label_item_options(self.label_id)
         )
 
-        # Disegna le maniglie di ridimensionamento e rotazione
-        self.handle_ids = []
+        if show_handles:
+            self.draw_handles()
+
+    def draw_handles(self):
+        """Disegna (o ridisegna) solo le maniglie di ridimensionamento e rotazione."""
+        self.delete_handles()
         handles = self._get_handles_coords()
         for i, (hx, hy) in enumerate(handles):
             if i == 8: # Maniglia di rotazione
@@ -75,7 +101,8 @@ class InteractiveRectangle:
             handle_id = self.canvas.create_rectangle(
                 hx - HANDLE_SIZE // 2, hy - HANDLE_SIZE // 2,
                 hx + HANDLE_SIZE // 2, hy + HANDLE_SIZE // 2,
-                fill=handle_color, outline=handle_color
+                fill=handle_color, outline=handle_color,
+                **label_item_options(self.label_id)
             )
             self.handle_ids.append(handle_id)
 
@@ -86,10 +113,18 @@ class InteractiveRectangle:
         if self.rect_id:
             self.canvas.delete(self.rect_id)
             self.rect_id = None
+        self.delete_handles()
+
+    def delete_handles(self):
+        """Rimuove solo le maniglie dal canvas, lasciando il corpo della forma."""
         for handle_id in self.handle_ids:
             self.canvas.delete(handle_id)
         self.handle_ids = []
 
+    def get_body_id(self):
+        """Restituisce l'ID dell'elemento del canvas che rappresenta il corpo della forma."""
+        return self.rect_id
+
     def _get_center(self):
         """
         Calcola il centro del rettangolo.
@@ -98,13 +133,42 @@ class InteractiveRectangle:
         cy = (self.y1 + self.y2) // 2
         return cx, cy
 
+    def _invalidate_geometry(self):
+        """Scarta la geometria derivata in cache: va chiamato da ogni metodo che modifica la forma."""
+        self._geometry_cache = {}
+        self.geometry_version += 1
+
     def _get_rotated_corners(self):
         """
-        Calcola le coordinate dei 4 angoli del rettangolo dopo la rotazione.
+        Calcola le coordinate dei 4 angoli del rettangolo dopo la rotazione (in cache fino alla prossima modifica).
+        """
+        corners = self._geometry_cache.get("corners")
+        if corners is None:
+            self._compute_rotated_geometry()
+            corners = self._geometry_cache["corners"]
+        return corners
+
+    def _get_handles_coords(self):
+        """
+        Restituisce le coordinate centrali delle 8 maniglie di ridimensionamento
+        e della 1 maniglia di rotazione, tenendo conto della rotazione del rettangolo (in cache).
+        """
+        handles = self._geometry_cache.get("handles")
+        if handles is None:
+            self._compute_rotated_geometry()
+            handles = self._geometry_cache["handles"]
+        return handles
+
+    def _compute_rotated_geometry(self):
+        """
+        Calcola in un solo passaggio angoli e maniglie ruotati (seno e coseno una volta sola)
+        e li memorizza nella cache della geometria.
         """
         cx, cy = self._get_center()
-        
-        # Coordinate dei 4 angoli non ruotati rispetto al centro
+        cos_a = math.cos(self.angle)
+        sin_a = math.sin(self.angle)
+
+        # Coordinate non ruotate rispetto al centro
         half_w = (self.x2 - self.x1) / 2
         half_h = (self.y2 - self.y1) / 2
 
@@ -114,30 +178,6 @@ class InteractiveRectangle:
             (half_w, half_h),   # Bottom-right
             (-half_w, half_h)   # Bottom-left
         ]
-
-        rotated_corners = []
-        for x_unrotated, y_unrotated in corners_unrotated:
-            # Applica la rotazione
-            x_rotated = x_unrotated * math.cos(self.angle) - y_unrotated * math.sin(self.angle)
-            y_rotated = x_unrotated * math.sin(self.angle) + y_unrotated * math.cos(self.angle)
-            
-            # Trasla indietro al centro reale dell'immagine
-            rotated_corners.append((cx + x_rotated, cy + y_rotated))
-        
-        return rotated_corners
-
-    def _get_handles_coords(self):
-        """
-        Calcola e restituisce le coordinate centrali delle 8 maniglie di ridimensionamento
-        e della 1 maniglia di rotazione, tenendo conto della rotazione del rettangolo.
-        """
-        cx, cy = self._get_center()
-        
-        # Calcola le posizioni delle 8 maniglie di ridimensionamento
-        # rispetto al centro e poi ruotale
-        half_w = (self.x2 - self.x1) / 2
-        half_h = (self.y2 - self.y1) / 2
-
         handles_unrotated = [
             (-half_w, -half_h), # 0: Top-left
             (0, -half_h),       # 1: Top-mid
@@ -146,31 +186,30 @@ class InteractiveRectangle:
             (half_w, 0),        # 4: Mid-right
             (-half_w, half_h),  # 5: Bottom-left
             (0, half_h),        # 6: Bottom-mid
-            (half_w, half_h)    # 7: Bottom-right
+            (half_w, half_h),   # 7: Bottom-right
+            (0, -half_h - ROTATION_HANDLE_OFFSET) # 8: Rotazione, sopra il centro del lato superiore
         ]
-        
-        rotated_handles = []
-        for x_unrotated, y_unrotated in handles_unrotated:
-            x_rotated = x_unrotated * math.cos(self.angle) - y_unrotated * math.sin(self.angle)
-            y_rotated = x_unrotated * math.sin(self.angle) + y_unrotated * math.cos(self.angle)
-            rotated_handles.append((cx + x_rotated, cy + y_rotated))
 
-        # Aggiungi la maniglia di rotazione (indice 8)
-        # Posizionala sopra il centro del lato superiore ruotato
-        rot_handle_x_unrotated, rot_handle_y_unrotated = (0, -half_h - ROTATION_HANDLE_OFFSET)
-        rot_handle_x_rotated = rot_handle_x_unrotated * math.cos(self.angle) - rot_handle_y_unrotated * math.sin(self.angle)
-        rot_handle_y_rotated = rot_handle_x_unrotated * math.sin(self.angle) + rot_handle_y_unrotated * math.cos(self.angle)
-        rotated_handles.append((cx + rot_handle_x_rotated, cy + rot_handle_y_rotated))
+        # Applica la rotazione e trasla indietro al centro reale dell'immagine
+        self._geometry_cache["corners"] = [(cx + x * cos_a - y * sin_a, cy + x * sin_a + y * cos_a) for x, y in corners_unrotated]
+        self._geometry_cache["handles"] = [(cx + x * cos_a - y * sin_a, cy + x * sin_a + y * cos_a) for x, y in handles_unrotated]
 
-        return rotated_handles
+    def _get_flat_points(self):
+        """Lista piatta [x1, y1, x2, y2, ...] degli angoli ruotati, pronta per create_polygon (in cache)."""
+        flat_points = self._geometry_cache.get("flat_points")
+        if flat_points is None:
+            flat_points = [coord for corner in self._get_rotated_corners() for coord in corner]
+            self._geometry_cache["flat_points"] = flat_points
+        return flat_points
 
-    def check_hit(self, mouse_x, mouse_y):
+    def check_hit(self, mouse_x, mouse_y, check_handles=True):
         """
         Controlla se le coordinate del mouse colpiscono una maniglia o il corpo del rettangolo.
+        Le maniglie vengono considerate solo se check_handles è True (forma selezionata).
         Restituisce "handle" (con indice), "body" o None.
         """
         # Controlla prima le maniglie (incluse quelle di rotazione)
-        handles = self._get_handles_coords()
+        handles = self._get_handles_coords() if check_handles else []
         for i, (hx, hy) in enumerate(handles):
             if hx - HANDLE_SIZE // 2 <= mouse_x <= hx + HANDLE_SIZE // 2 and \
                hy - HANDLE_SIZE // 2 <= mouse_y <= hy + HANDLE_SIZE // 2:
@@ -184,10 +223,34 @@ class InteractiveRectangle:
             if self.rect_id in overlapping_objects:
                 self.active_handle_index = -1 # Nessuna maniglia attiva se clicco sul corpo
                 return "body" # Colpito il corpo del rettangolo
+        elif self.contains_point(mouse_x, mouse_y):
+            # Forma non presente sul canvas (es. composta nello sfondo in modalità raster): test geometrico
+            self.active_handle_index = -1
+            return "body"
             
         self.active_handle_index = -1
         return None # Nessun hit
 
+    def get_bbox(self):
+        """Restituisce il riquadro allineato agli assi (x_min, y_min, x_max, y_max) del rettangolo ruotato."""
+        bbox = self._geometry_cache.get("bbox")
+        if bbox is None:
+            corners = self._get_rotated_corners()
+            xs = [x for x, _ in corners]
+            ys = [y for _, y in corners]
+            bbox = self._geometry_cache["bbox"] = (min(xs), min(ys), max(xs), max(ys))
+        return bbox
+
+    def contains_point(self, x, y):
+        """Test geometrico: True se il punto cade dentro il rettangolo ruotato."""
+        cx, cy = self._get_center()
+        # Riporta il punto nel sistema di riferimento non ruotato del rettangolo
+        dx, dy = x - cx, y - cy
+        cos_a, sin_a = math.cos(self.angle), math.sin(self.angle)
+        local_x = dx * cos_a + dy * sin_a
+        local_y = -dx * sin_a + dy * cos_a
+        return abs(local_x) <= (self.x2 - self.x1) / 2 and abs(local_y) <= (self.y2 - self.y1) / 2
+
     def update_coords(self, new_x1, new_y1, new_x2, new_y2):
         """
         Aggiorna le coordinate del rettangolo, assicurandosi che x1 sia <= x2 e y1 sia <= y2.
@@ -197,6 +260,15 @@ class InteractiveRectangle:
         self.y1 = min(new_y1, new_y2)
         self.x2 = max(new_x1, new_x2)
         self.y2 = max(new_y1, new_y2)
+        self._invalidate_geometry()
+
+    def get_coords(self):
+        """Restituisce le coordinate correnti nel formato accettato da update_coords."""
+        return self.x1, self.y1, self.x2, self.y2
+
+    def move(self, dx, dy):
+        """Sposta l'intera forma di dx, dy."""
+        self.update_coords(self.x1 + dx, self.y1 + dy, self.x2 + dx, self.y2 + dy)
 
     def rotate(self, current_mouse_x, current_mouse_y):
         """
@@ -217,17 +289,22 @@ class InteractiveRectangle:
 
         # Calcola la differenza angolare e aggiungila all'angolo iniziale del rettangolo
         angle_diff = current_angle_rad - start_angle_rad
-        self.angle = self.start_angle + angle_diff
+        self.set_angle(self.start_angle + angle_diff)
 
         # NON aggiornare self.start_drag_x e self.start_drag_y qui.
         # Questi devono rimanere il punto di clic iniziale per il calcolo della differenza angolare.
 
+    def set_angle(self, angle):
+        """Imposta direttamente l'angolo di rotazione (in radianti)."""
+        self.angle = angle
+        self._invalidate_geometry()
+
 # --- Classe per il Cerchio Interattivo ---
 class InteractiveCircle:
     """
     Rappresenta un cerchio disegnabile e ridimensionabile su un canvas Tkinter.
     """
-    def __init__(self, canvas, cx, cy, radius, color=COLOR_CIRCLE_BORDER, border_width=2, fill_color=""):
+    def __init__(self, canvas, cx, cy, radius, color=COLOR_CIRCLE_BORDER, border_width=2, fill_color="", label_id=DEFAULT_LABEL_ID):
         self.canvas = canvas
         self.cx = cx
         self.cy = cy
@@ -235,6 +312,8 @@ class InteractiveCircle:
         self.color = color
         self.border_width = border_width
         self.fill_color = fill_color # Nuovo attributo per il colore di riempimento
+        self.label_id = label_id # Id dell'etichetta di classe nella tabella LABELS
+        self.sync_uid = None # Id della forma nel servizio di annotazione (assegnato alla prima sincronizzazione)
         
         self.oval_id = None # ID del cerchio (ovale) disegnato sul canvas
         self.handle_ids = [] # Lista di ID delle maniglie
@@ -243,9 +322,14 @@ class InteractiveCircle:
         self.start_drag_x = 0
         self.start_drag_y = 0
 
-    def draw(self):
+        # Geometria derivata (angoli, maniglie, coordinate piatte, riquadro) calcolata una volta e riusata
+        # finché la forma non viene modificata tramite i suoi metodi
+        self._geometry_cache = {}
+        self.geometry_version = 0 # Incrementato a ogni modifica della geometria
+
+    def draw(self, show_handles=True):
         """
-        Disegna il cerchio e le sue maniglie sul canvas Tkinter.
+        Disegna il cerchio e, se show_handles è True, le sue maniglie sul canvas Tkinter.
         Rimuove le forme precedenti prima di ridisegnare.
         """
         self.delete_shapes()
@@ -258,18 +342,24 @@ class InteractiveCircle:
 
         self.oval_id = self.canvas.create_oval(
             x1, y1, x2, y2,
-            outline=self.color, width=self.border_width, fill=self.fill_color # Usa self.fill_color qui
+            outline=self.color, width=self.border_width, fill=self.fill_color, # Usa self.fill_color qui
+            **label_item_options(self.label_id)
         )
 
-        # Disegna le maniglie
-        self.handle_ids = []
+        if show_handles:
+            self.draw_handles()
+
+    def draw_handles(self):
+        """Disegna (o ridisegna) solo le maniglie di ridimensionamento."""
+        self.delete_handles()
         handles = self._get_handles_coords()
         for i, (hx, hy) in enumerate(handles):
             handle_color = COLOR_HANDLE_ACTIVE if i == self.active_handle_index else COLOR_HANDLE_NORMAL
             handle_id = self.canvas.create_rectangle(
                 hx - HANDLE_SIZE // 2, hy - HANDLE_SIZE // 2,
                 hx + HANDLE_SIZE // 2, hy + HANDLE_SIZE // 2,
-                fill=handle_color, outline=handle_color
+                fill=handle_color, outline=handle_color,
+                **label_item_options(self.label_id)
             )
             self.handle_ids.append(handle_id)
 
@@ -280,28 +370,45 @@ class InteractiveCircle:
         if self.oval_id:
             self.canvas.delete(self.oval_id)
             self.oval_id = None
+        self.delete_handles()
+
+    def delete_handles(self):
+        """Rimuove solo le maniglie dal canvas, lasciando il corpo della forma."""
         for handle_id in self.handle_ids:
             self.canvas.delete(handle_id)
         self.handle_ids = []
 
+    def get_body_id(self):
+        """Restituisce l'ID dell'elemento del canvas che rappresenta il corpo della forma."""
+        return self.oval_id
+
+    def _invalidate_geometry(self):
+        """Scarta la geometria derivata in cache: va chiamato da ogni metodo che modifica la forma."""
+        self._geometry_cache = {}
+        self.geometry_version += 1
+
     def _get_handles_coords(self):
         """
-        Calcola e restituisce le coordinate centrali delle 4 maniglie cardinali per il cerchio.
+        Calcola e restituisce le coordinate centrali delle 4 maniglie cardinali per il cerchio (in cache).
         """
-        return [
-            (self.cx, self.cy - self.radius), # Top
-            (self.cx + self.radius, self.cy), # Right
-            (self.cx, self.cy + self.radius), # Bottom
-            (self.cx - self.radius, self.cy)  # Left
-        ]
-
-    def check_hit(self, mouse_x, mouse_y):
+        handles = self._geometry_cache.get("handles")
+        if handles is None:
+            handles = self._geometry_cache["handles"] = [
+                (self.cx, self.cy - self.radius), # Top
+                (self.cx + self.radius, self.cy), # Right
+                (self.cx, self.cy + self.radius), # Bottom
+                (self.cx - self.radius, self.cy)  # Left
+            ]
+        return handles
+
+    def check_hit(self, mouse_x, mouse_y, check_handles=True):
         """
         Controlla se le coordinate del mouse colpiscono una maniglia o il corpo del cerchio.
+        Le maniglie vengono considerate solo se check_handles è True (forma selezionata).
         Restituisce "handle" (con indice), "body" o None.
         """
         # Controlla le maniglie
-        handles = self._get_handles_coords()
+        handles = self._get_handles_coords() if check_handles else []
         for i, (hx, hy) in enumerate(handles):
             if hx - HANDLE_SIZE // 2 <= mouse_x <= hx + HANDLE_SIZE // 2 and \
                hy - HANDLE_SIZE // 2 <= mouse_y <= hy + HANDLE_SIZE // 2:
@@ -318,6 +425,14 @@ class InteractiveCircle:
         self.active_handle_index = -1
         return None
 
+    def get_bbox(self):
+        """Restituisce il riquadro allineato agli assi (x_min, y_min, x_max, y_max) del cerchio."""
+        return self.cx - self.radius, self.cy - self.radius, self.cx + self.radius, self.cy + self.radius
+
+    def contains_point(self, x, y):
+        """Test geometrico: True se il punto cade dentro il cerchio."""
+        return (x - self.cx) ** 2 + (y - self.cy) ** 2 <= self.radius ** 2
+
     def update_coords(self, new_cx, new_cy, new_radius):
         """
         Aggiorna le coordinate del centro e il raggio del cerchio.
@@ -325,13 +440,22 @@ class InteractiveCircle:
         self.cx = new_cx
         self.cy = new_cy
         self.radius = max(new_radius, HANDLE_SIZE // 2) # Raggio minimo
+        self._invalidate_geometry()
+
+    def get_coords(self):
+        """Restituisce le coordinate correnti nel formato accettato da update_coords."""
+        return self.cx, self.cy, self.radius
+
+    def move(self, dx, dy):
+        """Sposta il cerchio di dx, dy."""
+        self.update_coords(self.cx + dx, self.cy + dy, self.radius)
 
 # --- Classe per l'Ovale Interattivo ---
 class InteractiveEllipse:
     """
     Rappresenta un ovale disegnabile e ridimensionabile su un canvas Tkinter.
     """
-    def __init__(self, canvas, x1, y1, x2, y2, color=COLOR_ELLIPSE_BORDER, border_width=2, fill_color=""):
+    def __init__(self, canvas, x1, y1, x2, y2, color=COLOR_ELLIPSE_BORDER, border_width=2, fill_color="", label_id=DEFAULT_LABEL_ID):
         self.canvas = canvas
         self.x1 = x1
         self.y1 = y1
@@ -340,6 +464,8 @@ class InteractiveEllipse:
         self.color = color
         self.border_width = border_width
         self.fill_color = fill_color # Nuovo attributo per il colore di riempimento
+        self.label_id = label_id # Id dell'etichetta di classe nella tabella LABELS
+        self.sync_uid = None # Id della forma nel servizio di annotazione (assegnato alla prima sincronizzazione)
         
         self.oval_id = None # ID dell'ovale disegnato sul canvas
         self.handle_ids = [] # Lista di ID delle maniglie
@@ -348,27 +474,38 @@ class InteractiveEllipse:
         self.start_drag_x = 0
         self.start_drag_y = 0
 
-    def draw(self):
+        # Geometria derivata (angoli, maniglie, coordinate piatte, riquadro) calcolata una volta e riusata
+        # finché la forma non viene modificata tramite i suoi metodi
+        self._geometry_cache = {}
+        self.geometry_version = 0 # Incrementato a ogni modifica della geometria
+
+    def draw(self, show_handles=True):
         """
-        Disegna l'ovale e le sue maniglie sul canvas Tkinter.
+        Disegna l'ovale e, se show_handles è True, le sue maniglie sul canvas Tkinter.
         Rimuove le forme precedenti prima di ridisegnare.
         """
         self.delete_shapes()
 
         self.oval_id = self.canvas.create_oval(
             self.x1, self.y1, self.x2, self.y2,
-            outline=self.color, width=self.border_width, fill=self.fill_color # Usa self.fill_color qui
+            outline=self.color, width=self.border_width, fill=self.fill_color, # Usa self.fill_color qui
+            **label_item_options(self.label_id)
         )
 
-        # Disegna le maniglie
-        self.handle_ids = []
+        if show_handles:
+            self.draw_handles()
+
+    def draw_handles(self):
+        """Disegna (o ridisegna) solo le maniglie di ridimensionamento."""
+        self.delete_handles()
         handles = self._get_handles_coords()
         for i, (hx, hy) in enumerate(handles):
             handle_color = COLOR_HANDLE_ACTIVE if i == self.active_handle_index else COLOR_HANDLE_NORMAL
             handle_id = self.canvas.create_rectangle(
                 hx - HANDLE_SIZE // 2, hy - HANDLE_SIZE // 2,
                 hx + HANDLE_SIZE // 2, hy + HANDLE_SIZE // 2,
-                fill=handle_color, outline=handle_color
+                fill=handle_color, outline=handle_color,
+                **label_item_options(self.label_id)
             )
             self.handle_ids.append(handle_id)
 
@@ -379,31 +516,48 @@ class InteractiveEllipse:
         if self.oval_id:
             self.canvas.delete(self.oval_id)
             self.oval_id = None
+        self.delete_handles()
+
+    def delete_handles(self):
+        """Rimuove solo le maniglie dal canvas, lasciando il corpo della forma."""
         for handle_id in self.handle_ids:
             self.canvas.delete(handle_id)
         self.handle_ids = []
 
+    def get_body_id(self):
+        """Restituisce l'ID dell'elemento del canvas che rappresenta il corpo della forma."""
+        return self.oval_id
+
+    def _invalidate_geometry(self):
+        """Scarta la geometria derivata in cache: va chiamato da ogni metodo che modifica la forma."""
+        self._geometry_cache = {}
+        self.geometry_version += 1
+
     def _get_handles_coords(self):
         """
-        Calcola e restituisce le coordinate centrali delle 8 maniglie per l'ovale (bounding box).
+        Calcola e restituisce le coordinate centrali delle 8 maniglie per l'ovale (bounding box, in cache).
         """
-        x1, y1, x2, y2 = self.x1, self.y1, self.x2, self.y2
-        xm, ym = (x1 + x2) // 2, (y1 + y2) // 2
-        
-        return [
-            (x1, y1), (xm, y1), (x2, y1), # Top-left, Top-mid, Top-right
-            (x1, ym),                     # Mid-left
-            (x2, ym),                     # Mid-right
-            (x1, y2), (xm, y2), (x2, y2)  # Bottom-left, Bottom-mid, Bottom-right
-        ]
-
-    def check_hit(self, mouse_x, mouse_y):
+        handles = self._geometry_cache.get("handles")
+        if handles is None:
+            x1, y1, x2, y2 = self.x1, self.y1, self.x2, self.y2
+            xm, ym = (x1 + x2) // 2, (y1 + y2) // 2
+            
+            handles = self._geometry_cache["handles"] = [
+                (x1, y1), (xm, y1), (x2, y1), # Top-left, Top-mid, Top-right
+                (x1, ym),                     # Mid-left
+                (x2, ym),                     # Mid-right
+                (x1, y2), (xm, y2), (x2, y2)  # Bottom-left, Bottom-mid, Bottom-right
+            ]
+        return handles
+
+    def check_hit(self, mouse_x, mouse_y, check_handles=True):
         """
         Controlla se le coordinate del mouse colpiscono una maniglia o il corpo dell'ovale.
+        Le maniglie vengono considerate solo se check_handles è True (forma selezionata).
         Restituisce "handle" (con indice), "body" o None.
         """
         # Controlla le maniglie
-        handles = self._get_handles_coords()
+        handles = self._get_handles_coords() if check_handles else []
         for i, (hx, hy) in enumerate(handles):
             if hx - HANDLE_SIZE // 2 <= mouse_x <= hx + HANDLE_SIZE // 2 and \
                hy - HANDLE_SIZE // 2 <= mouse_y <= hy + HANDLE_SIZE // 2:
@@ -416,10 +570,28 @@ class InteractiveEllipse:
             if self.oval_id in overlapping_objects:
                 self.active_handle_index = -1
                 return "body"
+        elif self.contains_point(mouse_x, mouse_y):
+            # Forma non presente sul canvas (es. composta nello sfondo in modalità raster): test geometrico
+            self.active_handle_index = -1
+            return "body"
             
         self.active_handle_index = -1
         return None
 
+    def get_bbox(self):
+        """Restituisce il riquadro allineato agli assi (x_min, y_min, x_max, y_max) dell'ovale."""
+        return self.x1, self.y1, self.x2, self.y2
+
+    def contains_point(self, x, y):
+        """Test geometrico: True se il punto cade dentro l'ovale."""
+        rx = (self.x2 - self.x1) / 2
+        ry = (self.y2 - self.y1) / 2
+        if rx <= 0 or ry <= 0:
+            return False
+        nx = (x - (self.x1 + self.x2) / 2) / rx
+        ny = (y - (self.y1 + self.y2) / 2) / ry
+        return nx * nx + ny * ny <= 1
+
     def update_coords(self, new_x1, new_y1, new_x2, new_y2):
         """
         Aggiorna le coordinate del bounding box dell'ovale, assicurandosi che x1 <= x2 e y1 <= y2.
@@ -428,19 +600,31 @@ class InteractiveEllipse:
         self.y1 = min(new_y1, new_y2)
         self.x2 = max(new_x1, new_x2)
         self.y2 = max(new_y1, new_y2)
+        self._invalidate_geometry()
+
+    def get_coords(self):
+        """Restituisce le coordinate correnti nel formato accettato da update_coords."""
+        return self.x1, self.y1, self.x2, self.y2
+
+    def move(self, dx, dy):
+        """Sposta l'intera forma di dx, dy."""
+        self.update_coords(self.x1 + dx, self.y1 + dy, self.x2 + dx, self.y2 + dy)
 
 # --- Classe per il Poligono Interattivo ---
 class InteractivePolygon:
     """
     Rappresenta un poligono disegnabile e modificabile su un canvas Tkinter.
     """
-    def __init__(self, canvas, points=None, color=COLOR_POLYGON_BORDER, border_width=2, fill_color=""):
+    def __init__(self, canvas, points=None, color=COLOR_POLYGON_BORDER, border_width=2, fill_color="", label_id=DEFAULT_LABEL_ID):
         self.canvas = canvas
         # I punti sono una lista di tuple (x, y)
         self.points = points if points is not None else [] 
         self.color = color
         self.border_width = border_width
         self.fill_color = fill_color
+        self.label_id = label_id # Id dell'etichetta di classe nella tabella LABELS
+        self.sync_uid = None # Id della forma nel servizio di annotazione (assegnato alla prima sincronizzazione)
+        self.source_shape = None # Solo per le proposte: forma (rettangolo rifinito) sostituita quando la proposta viene accettata
         
         self.polygon_id = None # ID del poligono disegnato sul canvas
         self.handle_ids = [] # Lista di ID delle maniglie per i vertici
@@ -449,25 +633,51 @@ class InteractivePolygon:
         self.start_drag_x = 0
         self.start_drag_y = 0
         self.is_closed = False # Indica se il poligono è stato chiuso (es. con doppio clic)
+        self.original_points = None # Vertici a piena risoluzione, conservati dopo una semplificazione (opzionale)
+
+        # Geometria derivata (angoli, maniglie, coordinate piatte, riquadro) calcolata una volta e riusata
+        # finché la forma non viene modificata tramite i suoi metodi
+        self._geometry_cache = {}
+        self.geometry_version = 0 # Incrementato a ogni modifica della geometria
 
     def add_point(self, x, y):
         """Aggiunge un punto al poligono."""
         self.points.append((x, y))
-
-    def draw(self):
+        self._invalidate_geometry()
+
+    def _invalidate_geometry(self):
+        """Scarta la geometria derivata in cache: va chiamato da ogni metodo che modifica i vertici."""
+        self._geometry_cache = {}
+        self.geometry_version += 1
+
+    def _get_flat_points(self):
+        """Lista piatta [x1, y1, x2, y2, ...] dei vertici, pronta per il canvas (in cache)."""
+        flat_points = self._geometry_cache.get("flat_points")
+        if flat_points is None:
+            flat_points = self._geometry_cache["flat_points"] = [coord for point in self.points for coord in point]
+        return flat_points
+
+    def set_points(self, points, original_points=None):
+        """Sostituisce tutti i vertici (e quelli a piena risoluzione)."""
+        self.points = list(points)
+        self.original_points = original_points
+        self._invalidate_geometry()
+
+    def draw(self, show_handles=True):
         """
-        Disegna il poligono e le maniglie dei suoi vertici sul canvas Tkinter.
+        Disegna il poligono e, se show_handles è True, le maniglie dei suoi vertici sul canvas Tkinter.
         Rimuove le forme precedenti prima di ridisegnare.
         """
         self.delete_shapes()
 
         if len(self.points) > 1:
-            # Converte la lista di tuple (x,y) in una lista piatta [x1, y1, x2, y2, ...]
-            flat_points = [coord for point in self.points for coord in point]
+            # Lista piatta [x1, y1, x2, y2, ...] dei vertici (dalla cache se invariati)
+            flat_points = self._get_flat_points()
             
             self.polygon_id = self.canvas.create_polygon(
                 *flat_points,
-                outline=self.color, width=self.border_width, fill=self.fill_color
+                outline=self.color, width=self.border_width, fill=self.fill_color,
+                **label_item_options(self.label_id)
             )
             # Se il poligono è chiuso, assicurati che il riempimento sia applicato.
             # Altrimenti, non riempire (per visualizzare solo i segmenti durante il disegno).
@@ -476,14 +686,19 @@ class InteractivePolygon:
             else:
                 self.canvas.itemconfigure(self.polygon_id, fill="") # Non riempire se non chiuso
 
-        # Disegna le maniglie per ogni vertice
-        self.handle_ids = []
+        if show_handles:
+            self.draw_handles()
+
+    def draw_handles(self):
+        """Disegna (o ridisegna) solo le maniglie dei vertici."""
+        self.delete_handles()
         for i, (px, py) in enumerate(self.points):
             handle_color = COLOR_HANDLE_ACTIVE if i == self.active_handle_index else COLOR_POLYGON_VERTEX_HANDLE
             handle_id = self.canvas.create_rectangle(
                 px - HANDLE_SIZE // 2, py - HANDLE_SIZE // 2,
                 px + HANDLE_SIZE // 2, py + HANDLE_SIZE // 2,
-                fill=handle_color, outline=handle_color
+                fill=handle_color, outline=handle_color,
+                **label_item_options(self.label_id)
             )
             self.handle_ids.append(handle_id)
 
@@ -494,17 +709,26 @@ class InteractivePolygon:
         if self.polygon_id:
             self.canvas.delete(self.polygon_id)
             self.polygon_id = None
+        self.delete_handles()
+
+    def delete_handles(self):
+        """Rimuove solo le maniglie dal canvas, lasciando il corpo della forma."""
         for handle_id in self.handle_ids:
             self.canvas.delete(handle_id)
         self.handle_ids = []
 
-    def check_hit(self, mouse_x, mouse_y):
+    def get_body_id(self):
+        """Restituisce l'ID dell'elemento del canvas che rappresenta il corpo della forma."""
+        return self.polygon_id
+
+    def check_hit(self, mouse_x, mouse_y, check_handles=True):
         """
         Controlla se le coordinate del mouse colpiscono una maniglia (vertice) o il corpo del poligono.
+        Le maniglie vengono considerate solo se check_handles è True (forma selezionata).
         Restituisce "handle" (con indice), "body" o None.
         """
         # Controlla prima le maniglie (vertici)
-        for i, (px, py) in enumerate(self.points):
+        for i, (px, py) in enumerate(self.points if check_handles else []):
             if px - HANDLE_SIZE // 2 <= mouse_x <= px + HANDLE_SIZE // 2 and \
                py - HANDLE_SIZE // 2 <= mouse_y <= py + HANDLE_SIZE // 2:
                 self.active_handle_index = i
@@ -516,14 +740,53 @@ class InteractivePolygon:
             if self.polygon_id in overlapping_objects:
                 self.active_handle_index = -1 # Nessun vertice attivo se clicco sul corpo
                 return "body" # Colpito il corpo del poligono
+        elif not self.polygon_id and self.is_closed and self.fill_color != "" and self.contains_point(mouse_x, mouse_y):
+            # Poligono non presente sul canvas (es. composto nello sfondo in modalità raster): test geometrico
+            self.active_handle_index = -1
+            return "body"
             
         self.active_handle_index = -1
         return None # Nessun hit
 
+    def get_bbox(self):
+        """Restituisce il riquadro allineato agli assi (x_min, y_min, x_max, y_max) dei vertici (in cache)."""
+        bbox = self._geometry_cache.get("bbox")
+        if bbox is None:
+            xs = [x for x, _ in self.points]
+            ys = [y for _, y in self.points]
+            bbox = self._geometry_cache["bbox"] = (min(xs), min(ys), max(xs), max(ys))
+        return bbox
+
+    def contains_point(self, x, y):
+        """Test geometrico (ray casting): True se il punto cade dentro il poligono."""
+        inside = False
+        n = len(self.points)
+        for i in range(n):
+            x1, y1 = self.points[i]
+            x2, y2 = self.points[(i + 1) % n]
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
     def update_point(self, index, new_x, new_y):
-        """Aggiorna le coordinate di un vertice specifico."""
+        """Aggiorna le coordinate di un vertice specifico (i vertici a piena risoluzione non valgono più)."""
         if 0 <= index < len(self.points):
             self.points[index] = (new_x, new_y)
+            self.original_points = None
+            self._invalidate_geometry()
+
+    def insert_point(self, index, x, y):
+        """Inserisce un vertice nella posizione indicata (i vertici a piena risoluzione non valgono più)."""
+        self.points.insert(index, (x, y))
+        self.original_points = None
+        self._invalidate_geometry()
+
+    def remove_point(self, index):
+        """Rimuove il vertice nella posizione indicata e ne restituisce le coordinate."""
+        point = self.points.pop(index)
+        self.original_points = None
+        self._invalidate_geometry()
+        return point
 
     def move_polygon(self, dx, dy):
         """Sposta l'intero poligono di dx, dy."""
@@ -531,13 +794,42 @@ class InteractivePolygon:
         for px, py in self.points:
             new_points.append((px + dx, py + dy))
         self.points = new_points
+        if self.original_points is not None: # I vertici a piena risoluzione seguono lo spostamento
+            self.original_points = [(px + dx, py + dy) for px, py in self.original_points]
+        self._invalidate_geometry()
 
-    def close_polygon(self):
-        """Marca il poligono come chiuso."""
+    def close_polygon(self, simplify_tolerance=None):
+        """
+        Marca il poligono come chiuso.
+        Se simplify_tolerance è indicato, semplifica i vertici con Douglas-Peucker alla chiusura.
+        """
         if len(self.points) > 2:
             self.is_closed = True
+            self._invalidate_geometry() # Il poligono chiuso viene riempito
             # Non aggiungiamo il primo punto alla fine qui, Tkinter lo chiude automaticamente
             # quando fill è specificato e i punti sono forniti.
+            if simplify_tolerance:
+                self.simplify(simplify_tolerance)
+
+    def simplify(self, tolerance=SIMPLIFY_TOLERANCE, keep_original=True):
+        """
+        Riduce i vertici quasi allineati con Douglas-Peucker (tolleranza in pixel).
+        Se keep_original è True, i vertici a piena risoluzione restano in self.original_points.
+        Restituisce il numero di vertici rimossi.
+        """
+        simplified = simplify_douglas_peucker(self.points, tolerance, closed=self.is_closed)
+        removed = len(self.points) - len(simplified)
+        if removed:
+            if keep_original and self.original_points is None:
+                self.original_points = list(self.points)
+            self.points = simplified
+            self._invalidate_geometry()
+            self.active_handle_index = -1 # Gli indici dei vertici non sono più validi
+        return removed
+
+    def move(self, dx, dy):
+        """Sposta l'intero poligono di dx, dy (interfaccia comune a tutte le forme)."""
+        self.move_polygon(dx, dy)
 
 # --- Classe per la Polilinea Interattiva (Linea Aperta) ---
 class InteractivePolyline:
@@ -545,11 +837,13 @@ class InteractivePolyline:
     Rappresenta una polilinea disegnabile e modificabile su un canvas Tkinter.
     Non è una forma chiusa e non ha riempimento.
     """
-    def __init__(self, canvas, points=None, color=COLOR_POLYLINE_BORDER, border_width=2):
+    def __init__(self, canvas, points=None, color=COLOR_POLYLINE_BORDER, border_width=2, label_id=DEFAULT_LABEL_ID):
         self.canvas = canvas
         self.points = points if points is not None else []
         self.color = color
         self.border_width = border_width
+        self.label_id = label_id # Id dell'etichetta di classe nella tabella LABELS
+        self.sync_uid = None # Id della forma nel servizio di annotazione (assegnato alla prima sincronizzazione)
         
         self.line_id = None # ID della linea disegnata sul canvas
         self.handle_ids = [] # Lista di ID delle maniglie per i vertici
@@ -557,35 +851,66 @@ class InteractivePolyline:
 
         self.start_drag_x = 0
         self.start_drag_y = 0
+        self.original_points = None # Vertici a piena risoluzione, conservati dopo una semplificazione (opzionale)
+
+        # Geometria derivata (angoli, maniglie, coordinate piatte, riquadro) calcolata una volta e riusata
+        # finché la forma non viene modificata tramite i suoi metodi
+        self._geometry_cache = {}
+        self.geometry_version = 0 # Incrementato a ogni modifica della geometria
 
     def add_point(self, x, y):
         """Aggiunge un punto alla polilinea."""
         self.points.append((x, y))
-
-    def draw(self):
+        self._invalidate_geometry()
+
+    def _invalidate_geometry(self):
+        """Scarta la geometria derivata in cache: va chiamato da ogni metodo che modifica i vertici."""
+        self._geometry_cache = {}
+        self.geometry_version += 1
+
+    def _get_flat_points(self):
+        """Lista piatta [x1, y1, x2, y2, ...] dei vertici, pronta per il canvas (in cache)."""
+        flat_points = self._geometry_cache.get("flat_points")
+        if flat_points is None:
+            flat_points = self._geometry_cache["flat_points"] = [coord for point in self.points for coord in point]
+        return flat_points
+
+    def set_points(self, points, original_points=None):
+        """Sostituisce tutti i vertici (e quelli a piena risoluzione)."""
+        self.points = list(points)
+        self.original_points = original_points
+        self._invalidate_geometry()
+
+    def draw(self, show_handles=True):
         """
-        Disegna la polilinea e le maniglie dei suoi vertici sul canvas Tkinter.
+        Disegna la polilinea e, se show_handles è True, le maniglie dei suoi vertici sul canvas Tkinter.
         Rimuove le forme precedenti prima di ridisegnare.
         """
         self.delete_shapes()
 
         if len(self.points) > 1:
-            flat_points = [coord for point in self.points for coord in point]
+            flat_points = self._get_flat_points()
             self.line_id = self.canvas.create_line(
                 *flat_points,
                 fill=self.color, # Corretto da 'outline' a 'fill'
                 width=self.border_width,
-                smooth=False # smooth=False per segmenti dritti
+                smooth=False, # smooth=False per segmenti dritti
+                **label_item_options(self.label_id)
             )
 
-        # Disegna le maniglie per ogni vertice
-        self.handle_ids = []
+        if show_handles:
+            self.draw_handles()
+
+    def draw_handles(self):
+        """Disegna (o ridisegna) solo le maniglie dei vertici."""
+        self.delete_handles()
         for i, (px, py) in enumerate(self.points):
             handle_color = COLOR_HANDLE_ACTIVE if i == self.active_handle_index else COLOR_POLYLINE_VERTEX_HANDLE
             handle_id = self.canvas.create_rectangle(
                 px - HANDLE_SIZE // 2, py - HANDLE_SIZE // 2,
                 px + HANDLE_SIZE // 2, py + HANDLE_SIZE // 2,
-                fill=handle_color, outline=handle_color
+                fill=handle_color, outline=handle_color,
+                **label_item_options(self.label_id)
             )
             self.handle_ids.append(handle_id)
 
@@ -596,17 +921,26 @@ class InteractivePolyline:
         if self.line_id:
             self.canvas.delete(self.line_id)
             self.line_id = None
+        self.delete_handles()
+
+    def delete_handles(self):
+        """Rimuove solo le maniglie dal canvas, lasciando il corpo della forma."""
         for handle_id in self.handle_ids:
             self.canvas.delete(handle_id)
         self.handle_ids = []
 
-    def check_hit(self, mouse_x, mouse_y):
+    def get_body_id(self):
+        """Restituisce l'ID dell'elemento del canvas che rappresenta il corpo della forma."""
+        return self.line_id
+
+    def check_hit(self, mouse_x, mouse_y, check_handles=True):
         """
         Controlla se le coordinate del mouse colpiscono una maniglia (vertice) o la linea della polilinea.
+        Le maniglie vengono considerate solo se check_handles è True (forma selezionata).
         Restituisce "handle" (con indice), "body" (se cliccato sulla linea) o None.
         """
         # Controlla prima le maniglie (vertici)
-        for i, (px, py) in enumerate(self.points):
+        for i, (px, py) in enumerate(self.points if check_handles else []):
             if px - HANDLE_SIZE // 2 <= mouse_x <= px + HANDLE_SIZE // 2 and \
                py - HANDLE_SIZE // 2 <= mouse_y <= py + HANDLE_SIZE // 2:
                 self.active_handle_index = i
@@ -619,14 +953,53 @@ class InteractivePolyline:
             if self.line_id in overlapping_objects:
                 self.active_handle_index = -1
                 return "body" # Colpito il corpo della linea
+        elif self.contains_point(mouse_x, mouse_y):
+            # Forma non presente sul canvas (es. composta nello sfondo in modalità raster): test geometrico
+            self.active_handle_index = -1
+            return "body"
             
         self.active_handle_index = -1
         return None
 
+    def get_bbox(self):
+        """Restituisce il riquadro allineato agli assi (x_min, y_min, x_max, y_max) dei vertici (in cache)."""
+        bbox = self._geometry_cache.get("bbox")
+        if bbox is None:
+            xs = [x for x, _ in self.points]
+            ys = [y for _, y in self.points]
+            bbox = self._geometry_cache["bbox"] = (min(xs), min(ys), max(xs), max(ys))
+        return bbox
+
+    def contains_point(self, x, y):
+        """Test geometrico: True se il punto è vicino (entro lo spessore della linea) a un segmento."""
+        tolerance = self.border_width / 2 + 1
+        for (x1, y1), (x2, y2) in zip(self.points, self.points[1:]):
+            seg_x, seg_y = x2 - x1, y2 - y1
+            length_sq = seg_x * seg_x + seg_y * seg_y
+            t = 0 if length_sq == 0 else max(0, min(1, ((x - x1) * seg_x + (y - y1) * seg_y) / length_sq))
+            if math.hypot(x - (x1 + t * seg_x), y - (y1 + t * seg_y)) <= tolerance:
+                return True
+        return False
+
     def update_point(self, index, new_x, new_y):
-        """Aggiorna le coordinate di un vertice specifico."""
+        """Aggiorna le coordinate di un vertice specifico (i vertici a piena risoluzione non valgono più)."""
         if 0 <= index < len(self.points):
             self.points[index] = (new_x, new_y)
+            self.original_points = None
+            self._invalidate_geometry()
+
+    def insert_point(self, index, x, y):
+        """Inserisce un vertice nella posizione indicata (i vertici a piena risoluzione non valgono più)."""
+        self.points.insert(index, (x, y))
+        self.original_points = None
+        self._invalidate_geometry()
+
+    def remove_point(self, index):
+        """Rimuove il vertice nella posizione indicata e ne restituisce le coordinate."""
+        point = self.points.pop(index)
+        self.original_points = None
+        self._invalidate_geometry()
+        return point
 
     def move_polyline(self, dx, dy):
         """Sposta l'intera polilinea di dx, dy."""
@@ -634,12 +1007,38 @@ class InteractivePolyline:
         for px, py in self.points:
             new_points.append((px + dx, py + dy))
         self.points = new_points
+        if self.original_points is not None: # I vertici a piena risoluzione seguono lo spostamento
+            self.original_points = [(px + dx, py + dy) for px, py in self.original_points]
+        self._invalidate_geometry()
+
+    def move(self, dx, dy):
+        """Sposta l'intera polilinea di dx, dy (interfaccia comune a tutte le forme)."""
+        self.move_polyline(dx, dy)
+
+    def simplify(self, tolerance=SIMPLIFY_TOLERANCE, keep_original=True):
+        """
+        Riduce i vertici quasi allineati con Douglas-Peucker (tolleranza in pixel).
+        Se keep_original è True, i vertici a piena risoluzione restano in self.original_points.
+        Restituisce il numero di vertici rimossi.
+        """
+        simplified = simplify_douglas_peucker(self.points, tolerance)
+        removed = len(self.points) - len(simplified)
+        if removed:
+            if keep_original and self.original_points is None:
+                self.original_points = list(self.points)
+            self.points = simplified
+            self._invalidate_geometry()
+            self.active_handle_index = -1
+        return removed
 
 # --- Funzione Utility per convertire immagini OpenCV in PhotoImage per Tkinter ---
 def cv2_to_tk_image(cv_image):
     """
     Converte un'immagine OpenCV (NumPy array BGR) in un oggetto PhotoImage di Tkinter.
+    OpenCV e Pillow sono importati qui, al primo uso: le forme non ne hanno bisogno.
     """
+    import cv2
+    from PIL import Image, ImageTk
     # Converti da BGR a RGB (Pillow lavora con RGB)
     rgb_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
     # Converti in immagine PIL (Pillow Image)
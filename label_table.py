@@ -0,0 +1,71 @@
+# --- Configurazioni Globali delle Etichette ---
+DEFAULT_LABEL = "object" # Etichetta delle forme a cui non ne è stata assegnata una
+DEFAULT_LABEL_ID = 0 # Id di DEFAULT_LABEL (sempre il primo della tabella)
+LABEL_TAG_PREFIX = "label_" # Prefisso dei tag del canvas di ogni etichetta (es. "label_3")
+
+class LabelTable:
+    """
+    Tabella delle etichette di classe. Ogni nome viene registrato una sola volta e identificato da un intero
+    (l'ordine di registrazione), quindi le forme memorizzano solo l'id e i confronti sono tra interi.
+    Ogni etichetta corrisponde a un tag del canvas: nascondere o mostrare una classe è un'unica
+    itemconfigure sul tag, senza ridisegnare le forme.
+    """
+    def __init__(self, names=(DEFAULT_LABEL,)):
+        self._names = [] # id -> nome
+        self._ids = {} # nome -> id
+        self._hidden = set() # Id delle etichette nascoste
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        """Restituisce l'id del nome (spazi iniziali e finali esclusi), registrandolo se è nuovo."""
+        name = name.strip() if name else ""
+        if not name:
+            return DEFAULT_LABEL_ID
+        label_id = self._ids.get(name)
+        if label_id is None:
+            label_id = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return label_id
+
+    def name(self, label_id):
+        return self._names[label_id]
+
+    def names(self):
+        """Tutti i nomi registrati, nell'ordine degli id."""
+        return tuple(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    # --- Visibilità ---
+    @staticmethod
+    def tag(label_id):
+        """Tag del canvas condiviso da tutti gli elementi delle forme con questa etichetta."""
+        return f"{LABEL_TAG_PREFIX}{label_id}"
+
+    def is_visible(self, label_id):
+        return label_id not in self._hidden
+
+    def set_visible(self, label_id, visible):
+        """Mostra o nasconde un'etichetta. Restituisce True se la visibilità è cambiata."""
+        if visible == self.is_visible(label_id):
+            return False
+        if visible:
+            self._hidden.discard(label_id)
+        else:
+            self._hidden.add(label_id)
+        return True
+
+    def hidden_ids(self):
+        return frozenset(self._hidden)
+
+    def item_state(self, label_id):
+        """Stato ("normal" o "hidden") con cui creare gli elementi del canvas di una forma con questa etichetta."""
+        return "hidden" if label_id in self._hidden else "normal"
+
+# Tabella condivisa da tutte le forme del processo (le copie delle forme usano invece il nome, vedi ShapeSnapshot)
+LABELS = LabelTable()
@@ -1,6 +1,10 @@
 import tkinter as tk
 # Importa le classi e le costanti necessarie dal modulo interactive_shapes
-from interactive_shapes import InteractiveRectangle, InteractiveCircle, InteractiveEllipse, InteractivePolygon, InteractivePolyline, HANDLE_SIZE, ROTATION_HANDLE_OFFSET
+from interactive_shapes import InteractiveRectangle, InteractiveCircle, InteractiveEllipse, InteractivePolygon, InteractivePolyline, HANDLE_SIZE, ROTATION_HANDLE_OFFSET, SELECTION_TAG
+from undo_redo import TranslateCommand, CoordsCommand, VertexCommand, InsertVertexCommand, PointsCommand, RotateCommand, AddShapeCommand, GroupTransformCommand
+from freehand_lasso import LassoRecorder
+from group_transform import apply_group_transform, shapes_in_rect
+from label_table import LABELS
 import math # Necessario per calcoli di distanza/raggio per cerchi/ovali
 
 class MouseEventHandler:
@@ -15,6 +19,16 @@ class MouseEventHandler:
             app_instance: L'istanza di ImageEditorApp a cui questo gestore eventi è collegato.
         """
         self.app = app_instance # Riferimento all'istanza di ImageEditorApp
+        self.lasso = LassoRecorder(app_instance.canvas) # Acquisizione dei tracciati a mano libera
+        self.rubber_band_id = None # Rettangolo di selezione a riquadro
+        self.group_last_x = 0 # Ultima posizione del mouse durante lo spostamento di un gruppo
+        self.group_last_y = 0
+        self.group_dx = 0 # Spostamento totale del gruppo nel trascinamento corrente
+        self.group_dy = 0
+
+    def _record(self, command):
+        """Registra un comando (già applicato) nella cronologia undo/redo dell'applicazione."""
+        self.app.undo_stack.push(command)
 
     def on_mouse_down(self, event):
         """
@@ -22,13 +36,27 @@ class MouseEventHandler:
         Inizia il disegno di una nuova forma, lo spostamento o il ridimensionamento/rotazione di una esistente.
         """
         self.app.start_x, self.app.start_y = event.x, event.y
+        # Tutte le modifiche fino al rilascio del mouse formano un'unica voce di undo
+        self.app.undo_stack.begin_gesture()
+
+        # Clic su un poligono proposto: viene accettato come forma dell'immagine
+        proposal = self.app.proposal_at(event.x, event.y) if self.app.proposals else None
+        if proposal is not None:
+            self.app.active_shape = None
+            self.app.drag_state = None
+            self.app.accept_proposal(proposal)
+            return
         
         found_existing = False
         # Controlla se il clic è avvenuto su una forma esistente o una delle sue maniglie
         # Itera su tutte le forme, dal più recente al più vecchio (per selezionare quello in cima)
         # Questo è importante per la selezione di forme sovrapposte
         for shape in reversed(self.app.shapes): 
-            hit_type = shape.check_hit(event.x, event.y)
+            if not LABELS.is_visible(shape.label_id):
+                continue # Le forme delle etichette nascoste non si possono selezionare né modificare
+            # Le maniglie esistono (e vanno controllate) solo per la forma selezionata o in disegno
+            check_handles = shape is self.app.selected_shape or shape is self.app.active_shape
+            hit_type = shape.check_hit(event.x, event.y, check_handles=check_handles)
             if hit_type == "handle":
                 self.app.active_shape = shape 
                 # La logica di trascinamento dipende dal tipo di forma e dalla maniglia
@@ -41,6 +69,14 @@ class MouseEventHandler:
                     self.app.drag_state = "move_vertex" # Spostamento di un vertice del poligono/polilinea
                 else:
                     self.app.drag_state = "resize_shape" # Stato generico per ridimensionamento
+                self.app.selected_shape = shape
+                found_existing = True
+                break
+            elif hit_type == "body" and len(self.app.selected_shapes) > 1 and shape in self.app.selected_shapes:
+                # Clic su una forma del gruppo: sposta tutto il gruppo
+                self.app.drag_state = "move_group"
+                self.group_last_x, self.group_last_y = event.x, event.y
+                self.group_dx = self.group_dy = 0
                 found_existing = True
                 break
             elif hit_type == "body":
@@ -57,6 +93,8 @@ class MouseEventHandler:
                     # Per poligoni/polilinee, start_drag_x/y sono usati per calcolare lo spostamento relativo
                     self.app.active_shape.start_drag_x = event.x
                     self.app.active_shape.start_drag_y = event.y
+                self.app.selected_shape = shape # Il clic sul corpo seleziona la forma
+                self.app.selected_shapes = [shape]
                 found_existing = True
                 break
         
@@ -64,48 +102,103 @@ class MouseEventHandler:
         if not found_existing:
             # Colore di riempimento per le nuove forme (leggermente visibile per cliccabilità)
             fill_color_for_new_shape = "#F0F0F0" # Un grigio molto chiaro
+            if self.app.current_draw_mode != "select" and not LABELS.is_visible(self.app.current_label_id):
+                self.app.set_label_visible(self.app.current_label_id, True) # La nuova forma deve essere visibile
             
             if self.app.current_draw_mode == "rectangle":
-                self.app.active_shape = InteractiveRectangle(self.app.canvas, event.x, event.y, event.x + 1, event.y + 1, fill_color=fill_color_for_new_shape)
+                self.app.active_shape = InteractiveRectangle(self.app.canvas, event.x, event.y, event.x + 1, event.y + 1, fill_color=fill_color_for_new_shape,
+                                                             label_id=self.app.current_label_id)
                 self.app.drag_state = "new_rect"
             elif self.app.current_draw_mode == "circle":
-                self.app.active_shape = InteractiveCircle(self.app.canvas, event.x, event.y, 1, fill_color=fill_color_for_new_shape) # Inizia con raggio 1
+                self.app.active_shape = InteractiveCircle(self.app.canvas, event.x, event.y, 1, fill_color=fill_color_for_new_shape,
+                                                          label_id=self.app.current_label_id) # Inizia con raggio 1
                 self.app.drag_state = "new_circle"
             elif self.app.current_draw_mode == "ellipse":
-                self.app.active_shape = InteractiveEllipse(self.app.canvas, event.x, event.y, event.x + 1, event.y + 1, fill_color=fill_color_for_new_shape)
+                self.app.active_shape = InteractiveEllipse(self.app.canvas, event.x, event.y, event.x + 1, event.y + 1, fill_color=fill_color_for_new_shape,
+                                                           label_id=self.app.current_label_id)
                 self.app.drag_state = "new_ellipse"
             elif self.app.current_draw_mode == "polygon":
+                vertex_x, vertex_y = self.app.snap_point(event.x, event.y) # Agganciato al bordo se l'aggancio è attivo
                 # Se è la prima volta che clicchiamo per un poligono, creane uno nuovo
                 if not isinstance(self.app.active_shape, InteractivePolygon) or self.app.active_shape.is_closed:
-                    self.app.active_shape = InteractivePolygon(self.app.canvas, points=[(event.x, event.y)], fill_color=fill_color_for_new_shape)
+                    self.app.active_shape = InteractivePolygon(self.app.canvas, points=[(vertex_x, vertex_y)], fill_color=fill_color_for_new_shape,
+                                                               label_id=self.app.current_label_id)
                     self.app.shapes.append(self.app.active_shape)
+                    self._record(AddShapeCommand(self.app.shapes, self.app.active_shape, len(self.app.shapes) - 1))
                 # Altrimenti, aggiungi un punto al poligono attivo (se non è chiuso)
                 else:
-                    self.app.active_shape.add_point(event.x, event.y)
+                    self.app.active_shape.add_point(vertex_x, vertex_y)
+                    self._record(InsertVertexCommand(self.app.active_shape, len(self.app.active_shape.points) - 1))
                 self.app.drag_state = "drawing_polygon" # Stato specifico per il disegno del poligono
             elif self.app.current_draw_mode == "polyline":
+                vertex_x, vertex_y = self.app.snap_point(event.x, event.y)
                 # Se è la prima volta che clicchiamo per una polilinea, creane una nuova
                 if not isinstance(self.app.active_shape, InteractivePolyline):
-                    self.app.active_shape = InteractivePolyline(self.app.canvas, points=[(event.x, event.y)])
+                    self.app.active_shape = InteractivePolyline(self.app.canvas, points=[(vertex_x, vertex_y)], label_id=self.app.current_label_id)
                     self.app.shapes.append(self.app.active_shape)
+                    self._record(AddShapeCommand(self.app.shapes, self.app.active_shape, len(self.app.shapes) - 1))
                 # Altrimenti, aggiungi un punto alla polilinea attiva
                 else:
-                    self.app.active_shape.add_point(event.x, event.y)
+                    self.app.active_shape.add_point(vertex_x, vertex_y)
+                    self._record(InsertVertexCommand(self.app.active_shape, len(self.app.active_shape.points) - 1))
                 self.app.drag_state = "drawing_polyline" # Stato specifico per il disegno della polilinea
+            elif self.app.current_draw_mode == "lasso":
+                # Il lazo non crea la forma finché il tasto non viene rilasciato
+                self.app.active_shape = None
+                self.lasso.start(event.x, event.y)
+                self.app.drag_state = "drawing_lasso"
+            elif self.app.current_draw_mode == "select":
+                # Clic nel vuoto in modalità selezione: inizia la selezione a riquadro
+                self.app.active_shape = None
+                self.rubber_band_id = self.app.canvas.create_rectangle(
+                    event.x, event.y, event.x, event.y, outline="white", dash=(4, 2)
+                )
+                self.app.drag_state = "rubber_band"
             
+            # La nuova forma (o nessuna, per il lazo e la selezione a riquadro) diventa la forma selezionata
+            self.app.selected_shape = self.app.active_shape
+            self.app.selected_shapes = [self.app.active_shape] if self.app.active_shape is not None else []
+
             # Solo aggiungi la forma alla lista se non è una forma multi-punto in fase di disegno continuo
             if self.app.active_shape and self.app.drag_state not in ["drawing_polygon", "drawing_polyline"]: 
                 self.app.shapes.append(self.app.active_shape) 
+                self._record(AddShapeCommand(self.app.shapes, self.app.active_shape, len(self.app.shapes) - 1))
 
         # Disegna immediatamente tutte le forme per mostrare lo stato attivo
         self.app.draw_all_shapes()
 
 
+    def on_mouse_move(self, event):
+        """
+        Gestisce il movimento del mouse senza tasti premuti.
+        Mostra le maniglie della forma sotto il puntatore (solo quella) senza ridisegnare la scena.
+        """
+        if self.app.drag_state is not None:
+            return # Durante il disegno o il trascinamento l'evidenziazione non cambia
+        self.app.set_hovered_shape(self.app.shape_at(event.x, event.y))
+
     def on_mouse_drag(self, event):
         """
         Gestisce l'evento di trascinamento del mouse (mouse mosso con tasto premuto).
         Aggiorna la posizione o le dimensioni della forma attiva.
         """
+        if self.app.drag_state == "drawing_lasso":
+            # Aggiunge solo il nuovo segmento al canvas, senza ridisegnare le altre forme
+            self.lasso.add_point(event.x, event.y)
+            return
+        if self.app.drag_state == "rubber_band":
+            self.app.canvas.coords(self.rubber_band_id, self.app.start_x, self.app.start_y, event.x, event.y)
+            return
+        if self.app.drag_state == "move_group":
+            # Durante il trascinamento sposta solo gli elementi del canvas con un'unica chiamata sul tag;
+            # le coordinate delle forme vengono aggiornate una volta sola al rilascio
+            dx, dy = event.x - self.group_last_x, event.y - self.group_last_y
+            self.app.canvas.move(SELECTION_TAG, dx, dy)
+            self.group_last_x, self.group_last_y = event.x, event.y
+            self.group_dx += dx
+            self.group_dy += dy
+            return
+
         if self.app.active_shape:
             current_x, current_y = event.x, event.y
 
@@ -120,23 +213,27 @@ class MouseEventHandler:
             elif self.app.drag_state == "drawing_polygon":
                 # Aggiorna l'ultimo punto del poligono mentre si trascina
                 if self.app.active_shape.points:
-                    self.app.active_shape.update_point(len(self.app.active_shape.points) - 1, current_x, current_y)
+                    self.app.active_shape.update_point(len(self.app.active_shape.points) - 1, *self.app.snap_point(current_x, current_y))
             elif self.app.drag_state == "drawing_polyline":
                 # Aggiorna l'ultimo punto della polilinea mentre si trascina
                 if self.app.active_shape.points:
-                    self.app.active_shape.update_point(len(self.app.active_shape.points) - 1, current_x, current_y)
+                    self.app.active_shape.update_point(len(self.app.active_shape.points) - 1, *self.app.snap_point(current_x, current_y))
             
             elif self.app.drag_state == "move_shape":
                 # Sposta la forma in base alla nuova posizione del mouse
                 if isinstance(self.app.active_shape, (InteractiveRectangle, InteractiveEllipse)):
                     new_x1 = current_x - self.app.active_shape.start_drag_x
                     new_y1 = current_y - self.app.active_shape.start_drag_y
+                    dx = new_x1 - self.app.active_shape.x1
+                    dy = new_y1 - self.app.active_shape.y1
                     new_x2 = new_x1 + (self.app.active_shape.x2 - self.app.active_shape.x1)
                     new_y2 = new_y1 + (self.app.active_shape.y2 - self.app.active_shape.y1)
                     self.app.active_shape.update_coords(new_x1, new_y1, new_x2, new_y2)
                 elif isinstance(self.app.active_shape, InteractiveCircle):
                     new_cx = current_x - self.app.active_shape.start_drag_x
                     new_cy = current_y - self.app.active_shape.start_drag_y
+                    dx = new_cx - self.app.active_shape.cx
+                    dy = new_cy - self.app.active_shape.cy
                     self.app.active_shape.update_coords(new_cx, new_cy, self.app.active_shape.radius)
                 elif isinstance(self.app.active_shape, (InteractivePolygon, InteractivePolyline)):
                     dx = current_x - self.app.active_shape.start_drag_x
@@ -144,9 +241,12 @@ class MouseEventHandler:
                     self.app.active_shape.move_polygon(dx, dy) if isinstance(self.app.active_shape, InteractivePolygon) else self.app.active_shape.move_polyline(dx, dy)
                     self.app.active_shape.start_drag_x = current_x # Aggiorna il punto di partenza per il prossimo drag
                     self.app.active_shape.start_drag_y = current_y
+                if dx or dy:
+                    self._record(TranslateCommand(self.app.active_shape, dx, dy)) # Unito agli spostamenti precedenti dello stesso gesto
             
             elif self.app.drag_state == "resize_shape":
                 h_idx = self.app.active_shape.active_handle_index
+                old_coords = self.app.active_shape.get_coords()
                 
                 if isinstance(self.app.active_shape, (InteractiveRectangle, InteractiveEllipse)):
                     x1, y1, x2, y2 = self.app.active_shape.x1, self.app.active_shape.y1, \
@@ -162,20 +262,25 @@ class MouseEventHandler:
                     elif h_idx == 6: y2 = current_y
                     elif h_idx == 7: x2, y2 = current_x, current_y
                     
-                    self.app.active_shape.update_coords(x1, y1, x2, y2)
+                    # Normalizza (x1 <= x2, y1 <= y2) come fa update_coords
+                    x1, x2 = min(x1, x2), max(x1, x2)
+                    y1, y2 = min(y1, y2), max(y1, y2)
                     
                     # Assicurati che le dimensioni minime siano rispettate
-                    if self.app.active_shape.x2 - self.app.active_shape.x1 < HANDLE_SIZE:
+                    if x2 - x1 < HANDLE_SIZE:
                         if h_idx in [0, 3, 5]: 
-                            self.app.active_shape.x1 = self.app.active_shape.x2 - HANDLE_SIZE
+                            x1 = x2 - HANDLE_SIZE
                         else: 
-                            self.app.active_shape.x2 = self.app.active_shape.x1 + HANDLE_SIZE
+                            x2 = x1 + HANDLE_SIZE
                     
-                    if self.app.active_shape.y2 - self.app.active_shape.y1 < HANDLE_SIZE:
+                    if y2 - y1 < HANDLE_SIZE:
                         if h_idx in [0, 1, 2]: 
-                            self.app.active_shape.y1 = self.app.active_shape.y2 - HANDLE_SIZE
+                            y1 = y2 - HANDLE_SIZE
                         else: 
-                            self.app.active_shape.y2 = self.app.active_shape.y1 + HANDLE_SIZE
+                            y2 = y1 + HANDLE_SIZE
+
+                    # Un'unica chiamata a update_coords (invalida la geometria in cache una sola volta)
+                    self.app.active_shape.update_coords(x1, y1, x2, y2)
                 
                 elif isinstance(self.app.active_shape, InteractiveCircle):
                     # Per il cerchio, ridimensiona il raggio in base alla maniglia
@@ -184,16 +289,26 @@ class MouseEventHandler:
                     new_radius = int(math.sqrt((current_x - cx)**2 + (current_y - cy)**2))
                     self.app.active_shape.update_coords(cx, cy, new_radius)
 
+                new_coords = self.app.active_shape.get_coords()
+                if new_coords != old_coords:
+                    self._record(CoordsCommand(self.app.active_shape, old_coords, new_coords))
+
             elif self.app.drag_state == "move_vertex":
                 # Sposta il vertice attivo del poligono/polilinea
                 if isinstance(self.app.active_shape, (InteractivePolygon, InteractivePolyline)):
                     h_idx = self.app.active_shape.active_handle_index
-                    self.app.active_shape.update_point(h_idx, current_x, current_y)
+                    old_point = self.app.active_shape.points[h_idx]
+                    old_original = self.app.active_shape.original_points
+                    new_point = self.app.snap_point(current_x, current_y)
+                    self.app.active_shape.update_point(h_idx, *new_point)
+                    self._record(VertexCommand(self.app.active_shape, h_idx, old_point, new_point, old_original))
 
             elif self.app.drag_state == "rotate_rect":
                 # Solo i rettangoli interattivi hanno il metodo rotate
                 if isinstance(self.app.active_shape, InteractiveRectangle):
+                    old_angle = self.app.active_shape.angle
                     self.app.active_shape.rotate(current_x, current_y)
+                    self._record(RotateCommand(self.app.active_shape, self.app.active_shape.angle - old_angle))
 
             self.app.draw_all_shapes() # Ridisegna per mostrare l'anteprima dinamica
 
@@ -202,26 +317,44 @@ class MouseEventHandler:
         Gestisce l'evento di rilascio del tasto del mouse.
         Finalizza l'operazione di disegno, spostamento o ridimensionamento.
         """
+        if self.app.drag_state == "drawing_lasso":
+            self._finish_lasso()
+        elif self.app.drag_state == "rubber_band":
+            self._finish_rubber_band(event)
+        elif self.app.drag_state == "move_group":
+            self._finish_group_move()
+
         if self.app.active_shape:
+            old_coords = self.app.active_shape.get_coords() if hasattr(self.app.active_shape, "get_coords") else None
+
             # Logica di finalizzazione per rettangolo/ovale (bounding box)
             if isinstance(self.app.active_shape, (InteractiveRectangle, InteractiveEllipse)):
+                x1, y1, x2, y2 = self.app.active_shape.get_coords()
                 
-                if self.app.active_shape.x2 - self.app.active_shape.x1 < HANDLE_SIZE:
-                    if self.app.active_shape.x1 == self.app.start_x: 
-                        self.app.active_shape.x2 = self.app.active_shape.x1 + HANDLE_SIZE
+                if x2 - x1 < HANDLE_SIZE:
+                    if x1 == self.app.start_x: 
+                        x2 = x1 + HANDLE_SIZE
                     else: 
-                        self.app.active_shape.x1 = self.app.active_shape.x2 - HANDLE_SIZE
+                        x1 = x2 - HANDLE_SIZE
 
-                if self.app.active_shape.y2 - self.app.active_shape.y1 < HANDLE_SIZE:
-                    if self.app.active_shape.y1 == self.app.start_y: 
-                        self.app.active_shape.y2 = self.app.active_shape.y1 + HANDLE_SIZE
+                if y2 - y1 < HANDLE_SIZE:
+                    if y1 == self.app.start_y: 
+                        y2 = y1 + HANDLE_SIZE
                     else: 
-                        self.app.active_shape.y1 = self.app.active_shape.y2 - HANDLE_SIZE
+                        y1 = y2 - HANDLE_SIZE
+
+                if (x1, y1, x2, y2) != old_coords:
+                    self.app.active_shape.update_coords(x1, y1, x2, y2)
             
             # Logica di finalizzazione per il cerchio
             elif isinstance(self.app.active_shape, InteractiveCircle):
                 if self.app.active_shape.radius < HANDLE_SIZE // 2:
-                    self.app.active_shape.radius = HANDLE_SIZE // 2 # Raggio minimo
+                    # update_coords applica il raggio minimo
+                    self.app.active_shape.update_coords(self.app.active_shape.cx, self.app.active_shape.cy, HANDLE_SIZE // 2)
+
+            # Registra le correzioni di dimensione minima nello stesso gesto della modifica
+            if old_coords is not None and self.app.active_shape.get_coords() != old_coords:
+                self._record(CoordsCommand(self.app.active_shape, old_coords, self.app.active_shape.get_coords()))
 
             # Per i poligoni e polilinee, non resettiamo active_shape o drag_state su mouse_up
             # se siamo in modalità di disegno continuo.
@@ -234,6 +367,57 @@ class MouseEventHandler:
                 self.app.active_shape = None # Nessuna forma è più attiva
                 self.app.drag_state = None       # Resetta lo stato di trascinamento
 
+        self.app.undo_stack.end_gesture() # Il gesto diventa una singola voce della cronologia
+
+    def _finish_lasso(self):
+        """Chiude il tracciato a mano libera e lo trasforma in un poligono chiuso."""
+        points = self.lasso.finish()
+        self.app.drag_state = None
+        if len(points) < 3:
+            return # Tracciato troppo corto per formare un poligono
+        polygon = InteractivePolygon(self.app.canvas, points=points, fill_color="#F0F0F0", label_id=self.app.current_label_id)
+        polygon.close_polygon()
+        self.app.shapes.append(polygon)
+        self._record(AddShapeCommand(self.app.shapes, polygon, len(self.app.shapes) - 1))
+        self.app.selected_shape = polygon
+        self.app.draw_all_shapes()
+
+    def _finish_rubber_band(self, event):
+        """Seleziona tutte le forme interamente contenute nel riquadro tracciato."""
+        self.app.canvas.delete(self.rubber_band_id)
+        self.rubber_band_id = None
+        self.app.drag_state = None
+        visible = [shape for shape in self.app.shapes if LABELS.is_visible(shape.label_id)]
+        self.app.set_selection(shapes_in_rect(visible, self.app.start_x, self.app.start_y, event.x, event.y))
+
+    def _finish_group_move(self):
+        """Applica lo spostamento del gruppo alle coordinate di tutte le forme in un'unica passata vettoriale."""
+        self.app.drag_state = None
+        if self.group_dx or self.group_dy:
+            shapes = self.app.selected_shapes
+            apply_group_transform(shapes, self.group_dx, self.group_dy)
+            self._record(GroupTransformCommand(shapes, self.group_dx, self.group_dy))
+        self.app.draw_all_shapes()
+
+    def on_shift_click(self, event):
+        """Maiusc+clic: aggiunge o toglie dalla selezione multipla la forma sotto il mouse."""
+        for shape in reversed(self.app.shapes):
+            if LABELS.is_visible(shape.label_id) and shape.check_hit(event.x, event.y, check_handles=False) == "body":
+                selection = list(self.app.selected_shapes)
+                if shape in selection:
+                    selection.remove(shape)
+                else:
+                    selection.append(shape)
+                self.app.set_selection(selection)
+                return
+
+    def on_right_click(self, event):
+        """Tasto destro: rifiuta il poligono proposto sotto il mouse."""
+        proposal = self.app.proposal_at(event.x, event.y)
+        if proposal is not None:
+            self.app.reject_proposal(proposal)
+            self.app.status_var.set(f"Proposte: {len(self.app.proposals)}")
+
     def on_mouse_double_click(self, event):
         """
         Gestisce il doppio clic del mouse, usato per chiudere il poligono o finalizzare la polilinea.
@@ -242,7 +426,10 @@ class MouseEventHandler:
            isinstance(self.app.active_shape, InteractivePolygon) and \
            not self.app.active_shape.is_closed:
             
-            self.app.active_shape.close_polygon()
+            old_points, old_original = self.app.active_shape.points, self.app.active_shape.original_points
+            self.app.active_shape.close_polygon(simplify_tolerance=self.app.simplify_tolerance) # Semplifica alla chiusura
+            if self.app.active_shape.points is not old_points:
+                self._record(PointsCommand(self.app.active_shape, old_points, self.app.active_shape.points, old_original))
             self.app.draw_all_shapes()
             self.app.active_shape = None # Il poligono è chiuso, non più attivo per il disegno
             self.app.drag_state = None
@@ -250,6 +437,10 @@ class MouseEventHandler:
              isinstance(self.app.active_shape, InteractivePolyline):
             # Finalizza la polilinea (non c'è un metodo 'close' formale, ma la si "termina")
             self.app.active_shape.active_handle_index = -1
+            if self.app.simplify_tolerance:
+                old_points, old_original = self.app.active_shape.points, self.app.active_shape.original_points
+                if self.app.active_shape.simplify(self.app.simplify_tolerance):
+                    self._record(PointsCommand(self.app.active_shape, old_points, self.app.active_shape.points, old_original))
             self.app.draw_all_shapes()
             self.app.active_shape = None # La polilinea è terminata
             self.app.drag_state = None
@@ -0,0 +1,189 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from annotation_exporter import annotation_to_snapshot, shapes_from_snapshot, ShapeSnapshot
+from annotation_index import find_image_path, ANNOTATION_FILE_SUFFIX
+from raster_overlay import RasterOverlay
+
+# --- Configurazioni Globali delle Anteprime ---
+PREVIEW_SUFFIX = "_preview.jpg" # Nome dell'anteprima: nome base dell'immagine + suffisso
+PREVIEW_JPEG_QUALITY = 85 # Qualità JPEG delle anteprime (0-100)
+PREVIEW_DIRNAME = "previews" # Cartella predefinita delle anteprime, dentro la cartella delle annotazioni
+PREVIEW_READ_THREADS = 2 # Thread che decodificano le immagini nel processo principale (OpenCV rilascia il GIL)
+PREVIEW_SLOTS_PER_WORKER = 2 # Blocchi di memoria condivisa per processo: uno in disegno, uno già pronto
+
+# --- Disegno (senza Tk) ---
+def _scale_snapshot(snapshot, factor):
+    """Copia di uno ShapeSnapshot con tutte le coordinate moltiplicate per factor (l'angolo non cambia)."""
+    scale_points = lambda points: tuple((x * factor, y * factor) for x, y in points) if points is not None else None
+    coords = tuple(value * factor for value in snapshot.coords) if snapshot.coords is not None else None
+    return ShapeSnapshot(snapshot.kind, coords, snapshot.angle, scale_points(snapshot.points),
+                         scale_points(snapshot.original_points), snapshot.is_closed, snapshot.label)
+
+def render_preview(image, annotations, max_size=None):
+    """
+    Disegna le annotazioni nell'immagine con lo stesso codice della modalità raster dell'editor
+    (contorni, riempimenti, angoli dei rettangoli ruotati). L'immagine di partenza non viene modificata.
+    Args:
+        image (numpy.ndarray): Immagine OpenCV BGR.
+        annotations (list): Annotazioni nel layout JSON esportato.
+        max_size (int): Se indicato, l'immagine viene prima ridotta in modo che il lato maggiore
+                        non superi max_size pixel, e le forme vengono scalate di conseguenza.
+    Returns:
+        numpy.ndarray: Immagine con le forme disegnate.
+    """
+    snapshot = [annotation_to_snapshot(annotation) for annotation in annotations]
+    height, width = image.shape[:2]
+    if max_size and max(width, height) > max_size:
+        factor = max_size / max(width, height)
+        image = cv2.resize(image, (max(int(round(width * factor)), 1), max(int(round(height * factor)), 1)),
+                           interpolation=cv2.INTER_AREA)
+        snapshot = [_scale_snapshot(shape_snapshot, factor) for shape_snapshot in snapshot]
+    # Le forme non vengono mai disegnate sul canvas, quindi non serve un canvas Tk
+    shapes = shapes_from_snapshot(None, snapshot)
+    composite, _ = RasterOverlay().render(image, shapes)
+    return composite
+
+def _render_shared(shm_name, image_shape, annotation_path, output_path, max_size, quality):
+    """
+    Eseguita nei processi del pool: legge l'immagine dalla memoria condivisa (nessuna copia né serializzazione
+    dei pixel), disegna le annotazioni e salva l'anteprima JPEG.
+    Returns:
+        tuple: (percorso dell'anteprima, None o messaggio di errore).
+    """
+    try:
+        with open(annotation_path, 'r') as f:
+            annotations = json.load(f)
+    except (IOError, ValueError) as e:
+        return output_path, f"Errore di lettura di {annotation_path}: {e}"
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(image_shape, dtype=np.uint8, buffer=shm.buf)
+        preview = render_preview(image, annotations, max_size)
+        del image # La vista sul blocco va rilasciata prima di chiuderlo
+    finally:
+        shm.close()
+    if not cv2.imwrite(output_path, preview, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        return output_path, f"Impossibile scrivere {output_path}"
+    return output_path, None
+
+# --- Elaborazione di un intero dataset ---
+def find_preview_jobs(annotation_dir, image_dir=None, output_dir=None):
+    """
+    Associa ogni file *_annotations.json della cartella alla sua immagine.
+    Returns:
+        list: Tuple (percorso immagine, percorso annotazioni, percorso anteprima); i file senza immagine vengono segnalati e saltati.
+    """
+    output_dir = output_dir or os.path.join(annotation_dir, PREVIEW_DIRNAME)
+    jobs = []
+    for annotation_path in sorted(glob.glob(os.path.join(annotation_dir, "*" + ANNOTATION_FILE_SUFFIX))):
+        image_path = find_image_path(annotation_path, image_dir)
+        if image_path is None:
+            print(f"Immagine non trovata per {annotation_path}")
+            continue
+        base_name = os.path.basename(annotation_path)[:-len(ANNOTATION_FILE_SUFFIX)]
+        jobs.append((image_path, annotation_path, os.path.join(output_dir, base_name + PREVIEW_SUFFIX)))
+    return jobs
+
+def render_previews(jobs, max_size=None, quality=PREVIEW_JPEG_QUALITY, workers=None, on_result=None):
+    """
+    Genera le anteprime in parallelo. Il processo principale decodifica le immagini (con alcuni thread)
+    direttamente in blocchi di memoria condivisa riutilizzati; ai processi passano solo il nome del blocco,
+    la forma dell'array e i percorsi. Le immagini in memoria sono al più due per processo.
+    Args:
+        jobs (list): Tuple (percorso immagine, percorso annotazioni, percorso anteprima), es. da find_preview_jobs.
+        on_result (callable): Chiamata con (percorso anteprima, None o messaggio di errore) per ogni immagine.
+    Returns:
+        int: Numero di anteprime generate.
+    """
+    workers = workers or os.cpu_count() or 1
+    slots = [None] * (workers * PREVIEW_SLOTS_PER_WORKER) # Blocchi di memoria condivisa, ingranditi se serve
+    free_slots = list(range(len(slots)))
+    remaining = iter(jobs)
+    reads = deque() # (decodifica in corso, job) nell'ordine dei job
+    running = {} # future del pool -> indice del blocco in uso
+    rendered = 0
+
+    def report(output_path, error):
+        if on_result is not None:
+            on_result(output_path, error)
+
+    for output_dir in {os.path.dirname(job[2]) for job in jobs}:
+        os.makedirs(output_dir or ".", exist_ok=True)
+
+    # "spawn": come per le proposte automatiche, i processi non ereditano lo stato del processo principale
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool, \
+            ThreadPoolExecutor(PREVIEW_READ_THREADS) as readers:
+        def read_next():
+            job = next(remaining, None)
+            if job is not None:
+                reads.append((readers.submit(cv2.imread, job[0]), job))
+
+        try:
+            for _ in range(len(slots)): # Decodifica in anticipo tante immagini quanti sono i blocchi
+                read_next()
+            while reads or running:
+                while reads and free_slots:
+                    read_future, (image_path, annotation_path, output_path) = reads.popleft()
+                    image = read_future.result()
+                    read_next()
+                    if image is None:
+                        report(output_path, f"Impossibile caricare l'immagine {image_path}")
+                        continue
+                    index = free_slots.pop()
+                    shm = slots[index]
+                    if shm is None or shm.size < image.nbytes:
+                        if shm is not None:
+                            shm.close()
+                            shm.unlink()
+                        shm = slots[index] = shared_memory.SharedMemory(create=True, size=image.nbytes)
+                    np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf)[:] = image
+                    future = pool.submit(_render_shared, shm.name, image.shape, annotation_path, output_path, max_size, quality)
+                    running[future] = index
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        free_slots.append(running.pop(future))
+                        try:
+                            output_path, error = future.result()
+                        except Exception as e:
+                            output_path, error = None, f"Errore durante il disegno dell'anteprima: {e}"
+                        rendered += error is None
+                        report(output_path, error)
+        finally:
+            for future in running:
+                future.cancel()
+            wait(running) # I blocchi possono essere rimossi solo quando nessun processo li usa più
+            for shm in slots:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+    return rendered
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera anteprime JPEG con le annotazioni disegnate.")
+    parser.add_argument("directory", help="Cartella con i file *_annotations.json")
+    parser.add_argument("--images", default=None, help="Cartella delle immagini (default: la cartella delle annotazioni)")
+    parser.add_argument("--output", default=None, help=f"Cartella delle anteprime (default: <directory>/{PREVIEW_DIRNAME})")
+    parser.add_argument("--max-size", type=int, default=None, help="Lato maggiore massimo (pixel) delle anteprime")
+    parser.add_argument("--quality", type=int, default=PREVIEW_JPEG_QUALITY, help="Qualità JPEG (0-100)")
+    parser.add_argument("--workers", type=int, default=None, help="Numero di processi")
+    args = parser.parse_args()
+
+    jobs = find_preview_jobs(args.directory, args.images, args.output)
+
+    def print_result(output_path, error):
+        if error is not None:
+            print(error)
+
+    count = render_previews(jobs, args.max_size, args.quality, args.workers, print_result)
+    print(f"Anteprime generate: {count}/{len(jobs)}")
@@ -0,0 +1,178 @@
+import cv2
+import numpy as np
+from interactive_shapes import InteractiveRectangle, InteractiveCircle, InteractiveEllipse, InteractivePolygon
+
+# --- Configurazioni Globali per il Rendering Raster ---
+RASTER_FILL_ALPHA = 0.35 # Opacità dei riempimenti composti nell'immagine
+RASTER_ELLIPSE_DELTA = 5 # Passo angolare (gradi) dell'approssimazione poligonale di cerchi e ovali
+RASTER_MAX_DIRTY_REGIONS = 16 # Oltre questo numero di regioni modificate si ricompone la loro unione
+RASTER_REGION_MARGIN = 16 # Margine (pixel) disegnato attorno a ogni regione ricomposta
+
+# Colori Tk usati dalle forme, convertiti in BGR per OpenCV (Tk 8.6 usa i colori web per "green" e "purple")
+TK_COLORS_BGR = {
+    "white": (255, 255, 255),
+    "black": (0, 0, 0),
+    "red": (0, 0, 255),
+    "blue": (255, 0, 0),
+    "green": (0, 128, 0),
+    "yellow": (0, 255, 255),
+    "purple": (128, 0, 128),
+    "cyan": (255, 255, 0),
+    "magenta": (255, 0, 255),
+    "orange": (0, 165, 255),
+    "lime": (0, 255, 0),
+    "gray": (128, 128, 128),
+}
+
+def tk_color_to_bgr(color):
+    """
+    Converte un colore Tk (nome o "#RRGGBB"/"#RGB") in una tupla BGR.
+    Restituisce None per il colore vuoto (nessun riempimento).
+    """
+    if not color:
+        return None
+    if color.startswith("#"):
+        digits = color[1:]
+        if len(digits) == 3:
+            digits = "".join(d * 2 for d in digits)
+        r, g, b = int(digits[0:2], 16), int(digits[2:4], 16), int(digits[4:6], 16)
+        return (b, g, r)
+    return TK_COLORS_BGR.get(color.lower(), (255, 255, 255))
+
+def _ellipse_points(cx, cy, rx, ry):
+    """Approssima un ovale allineato agli assi con un poligono (interi, per OpenCV)."""
+    return cv2.ellipse2Poly((int(round(cx)), int(round(cy))), (max(int(round(rx)), 0), max(int(round(ry)), 0)),
+                            0, 0, 360, RASTER_ELLIPSE_DELTA)
+
+class _RasterEntry:
+    """Primitiva di disegno già pronta per OpenCV, con la versione della forma da cui è stata ricavata."""
+    def __init__(self, shape):
+        self.shape = shape
+        self.geometry_version = shape.geometry_version
+        self.outline = tk_color_to_bgr(shape.color)
+        self.width = max(int(shape.border_width), 1)
+        self.fill = None
+        self.closed = True
+
+        if isinstance(shape, InteractiveRectangle):
+            points = shape._get_rotated_corners()
+            self.fill = tk_color_to_bgr(shape.fill_color)
+        elif isinstance(shape, InteractiveCircle):
+            points = _ellipse_points(shape.cx, shape.cy, shape.radius, shape.radius)
+            self.fill = tk_color_to_bgr(shape.fill_color)
+        elif isinstance(shape, InteractiveEllipse):
+            points = _ellipse_points((shape.x1 + shape.x2) / 2, (shape.y1 + shape.y2) / 2,
+                                     (shape.x2 - shape.x1) / 2, (shape.y2 - shape.y1) / 2)
+            self.fill = tk_color_to_bgr(shape.fill_color)
+        elif isinstance(shape, InteractivePolygon):
+            points = shape.points
+            self.closed = shape.is_closed
+            if shape.is_closed and len(shape.points) > 2: # Come sul canvas: riempito solo se chiuso
+                self.fill = tk_color_to_bgr(shape.fill_color)
+        else: # InteractivePolyline
+            points = shape.points
+            self.closed = False
+
+        self.points = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2)).astype(np.int32)
+        if len(self.points):
+            pad = self.width + 1
+            x_min, y_min = self.points.min(axis=0)
+            x_max, y_max = self.points.max(axis=0)
+            self.bbox = (int(x_min) - pad, int(y_min) - pad, int(x_max) + pad + 1, int(y_max) + pad + 1)
+        else:
+            self.bbox = None
+
+class RasterOverlay:
+    """
+    Compone molte forme direttamente nell'immagine visualizzata con OpenCV, invece di creare
+    un elemento del canvas per ciascuna. I riempimenti sono disegnati in blocco (una chiamata
+    per colore) e fusi con trasparenza; i contorni sono disegnati in blocco sopra.
+    Tra una chiamata e l'altra vengono ricomposte solo le regioni delle forme cambiate, riconosciute dal
+    contatore geometry_version (confronto O(1) anche per poligoni grandi): ogni modifica dell'aspetto
+    di una forma composta deve quindi passare da _invalidate_geometry.
+    """
+    def __init__(self, alpha=RASTER_FILL_ALPHA):
+        self.alpha = alpha
+        self.base_image = None # Immagine di partenza dell'ultima composizione
+        self.composite = None  # Immagine composta (sfondo + forme)
+        self.entries = {}      # id(forma) -> _RasterEntry, nell'ordine di disegno
+
+    def invalidate(self):
+        """Forza una ricomposizione completa alla prossima chiamata di render."""
+        self.base_image = None
+        self.composite = None
+        self.entries = {}
+
+    def render(self, base_image, shapes):
+        """
+        Compone le forme indicate sopra base_image.
+        Returns:
+            tuple: (immagine composta, True se è cambiata rispetto alla chiamata precedente).
+        """
+        new_entries = {}
+        dirty = []
+        for shape in shapes:
+            key = id(shape)
+            old = self.entries.get(key)
+            if old is not None and old.shape is shape and old.geometry_version == shape.geometry_version:
+                new_entries[key] = old
+                continue
+            entry = _RasterEntry(shape)
+            new_entries[key] = entry
+            dirty.extend(bbox for bbox in (entry.bbox, old.bbox if old is not None else None) if bbox)
+        for key, old in self.entries.items():
+            if key not in new_entries and old.bbox:
+                dirty.append(old.bbox) # Forma rimossa o tornata modificabile sul canvas
+        self.entries = new_entries
+
+        height, width = base_image.shape[:2]
+        if self.composite is None or base_image is not self.base_image:
+            self.base_image = base_image
+            self.composite = base_image.copy()
+            dirty = [(0, 0, width, height)]
+        elif not dirty:
+            return self.composite, False
+        elif len(dirty) > RASTER_MAX_DIRTY_REGIONS:
+            boxes = np.array(dirty)
+            dirty = [(boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max())]
+
+        entries = list(self.entries.values())
+        boxes = np.array([entry.bbox if entry.bbox else (0, 0, 0, 0) for entry in entries], dtype=np.int64).reshape(-1, 4)
+        for x0, y0, x1, y1 in dirty:
+            x0, y0 = max(int(x0), 0), max(int(y0), 0)
+            x1, y1 = min(int(x1), width), min(int(y1), height)
+            if x0 < x1 and y0 < y1:
+                self._render_region(entries, boxes, x0, y0, x1, y1)
+        return self.composite, True
+
+    def _render_region(self, entries, boxes, x0, y0, x1, y1):
+        """Ricompone la regione [x0, x1) x [y0, y1) partendo dallo sfondo originale."""
+        # Disegna su un'area leggermente più ampia e copia solo la regione richiesta: il ritaglio
+        # delle linee sul bordo dell'area può spostarne qualche pixel, che così resta fuori dalla regione
+        height, width = self.base_image.shape[:2]
+        mx0, my0 = max(x0 - RASTER_REGION_MARGIN, 0), max(y0 - RASTER_REGION_MARGIN, 0)
+        mx1, my1 = min(x1 + RASTER_REGION_MARGIN, width), min(y1 + RASTER_REGION_MARGIN, height)
+        area = self.base_image[my0:my1, mx0:mx1].copy()
+
+        # Forme il cui riquadro interseca la regione (test vettoriale su tutti i riquadri)
+        hits = np.flatnonzero((boxes[:, 0] < mx1) & (boxes[:, 2] > mx0) & (boxes[:, 1] < my1) & (boxes[:, 3] > my0))
+        if len(hits):
+            offset = np.array([mx0, my0], dtype=np.int32)
+            fills = {}
+            outlines = {}
+            for index in hits:
+                entry = entries[index]
+                points = entry.points - offset
+                if entry.fill is not None:
+                    fills.setdefault(entry.fill, []).append(points)
+                outlines.setdefault((entry.outline, entry.width, entry.closed), []).append(points)
+
+            if fills:
+                layer = area.copy()
+                for color, polygons in sorted(fills.items()): # Ordine fisso: stesso risultato per composizione completa e parziale
+                    cv2.fillPoly(layer, polygons, color)
+                area = cv2.addWeighted(layer, self.alpha, area, 1 - self.alpha, 0)
+            for (color, line_width, closed), polylines in sorted(outlines.items()):
+                cv2.polylines(area, polylines, closed, color, line_width)
+
+        self.composite[y0:y1, x0:x1] = area[y0 - my0:y1 - my0, x0 - mx0:x1 - mx0]
@@ -0,0 +1,296 @@
+import itertools
+import json
+import mmap
+import os
+import tempfile
+import zlib
+import numpy as np
+from annotation_exporter import ShapeSnapshot, snapshot_to_annotation, annotation_to_snapshot, write_json_atomic
+from label_table import DEFAULT_LABEL
+
+# --- Configurazioni Globali del Formato di Sessione ---
+SESSION_MAGIC = b"ANNS" # Identifica i file di sessione binari
+SESSION_VERSION = 2 # Versione del formato (incrementata a ogni modifica incompatibile del layout)
+SUPPORTED_SESSION_VERSIONS = (1, 2) # La versione 1 non ha etichette (il campo label_names_size era riservato e vale 0)
+SESSION_EXTENSION = ".anns" # Estensione dei file di sessione
+SESSION_ALIGNMENT = 8 # Ogni sezione inizia a un offset multiplo di questo valore
+
+# Layout del file (tutti i valori little-endian):
+#   intestazione (HEADER_DTYPE) | rettangoli | cerchi | ovali | poligoni/polilinee | vertici float32 (N, 2)
+#   | etichette (uint32, una per forma nell'ordine originale) | nomi delle etichette (lista JSON in UTF-8)
+# Ogni sezione è un array NumPy di record a larghezza fissa, allineato a SESSION_ALIGNMENT byte.
+# Il campo "order" di ogni record è la posizione della forma nella lista originale.
+# I vertici di poligoni e polilinee sono contigui: quelli a piena risoluzione (se presenti)
+# seguono subito quelli della forma, a partire da vertex_offset + vertex_count.
+# Le etichette sono indici nella lista dei nomi; le due sezioni sono vuote se label_names_size è 0.
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("header_size", "<u2"),
+    ("image_width", "<u4"),
+    ("image_height", "<u4"),
+    ("rect_count", "<u4"),
+    ("circle_count", "<u4"),
+    ("ellipse_count", "<u4"),
+    ("poly_count", "<u4"),
+    ("vertex_count", "<u8"),
+    ("payload_crc32", "<u4"), # CRC32 di tutto ciò che segue l'intestazione
+    ("label_names_size", "<u4"), # Byte della sezione dei nomi delle etichette (0: nessuna etichetta)
+])
+RECT_DTYPE = np.dtype([("order", "<u4"), ("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"), ("y2", "<f4"),
+                       ("reserved", "<u4"), ("angle", "<f8")])
+CIRCLE_DTYPE = np.dtype([("order", "<u4"), ("cx", "<f4"), ("cy", "<f4"), ("radius", "<f4")])
+ELLIPSE_DTYPE = np.dtype([("order", "<u4"), ("x1", "<f4"), ("y1", "<f4"), ("x2", "<f4"), ("y2", "<f4")])
+POLY_DTYPE = np.dtype([("order", "<u4"), ("kind", "u1"), ("is_closed", "u1"), ("has_original", "u1"), ("reserved", "u1"),
+                       ("vertex_offset", "<u8"), ("vertex_count", "<u4"), ("original_count", "<u4")])
+VERTEX_DTYPE = np.dtype("<f4")
+LABEL_DTYPE = np.dtype("<u4")
+LABEL_NAMES_DTYPE = np.dtype("u1")
+
+POLY_KINDS = ("polygon", "polyline") # Valori del campo "kind" dei record POLY_DTYPE
+
+class SessionFormatError(ValueError):
+    """File di sessione non valido: firma, versione, dimensione o checksum non corrispondono."""
+    pass
+
+def _aligned(offset):
+    return (offset + SESSION_ALIGNMENT - 1) // SESSION_ALIGNMENT * SESSION_ALIGNMENT
+
+def _section_layout(header):
+    """Offset (dall'inizio del file) e lunghezza in elementi di ogni sezione, in ordine."""
+    sections = []
+    offset = int(header["header_size"])
+    shape_count = int(header["rect_count"]) + int(header["circle_count"]) + int(header["ellipse_count"]) + int(header["poly_count"])
+    for name, dtype, count in (("rectangles", RECT_DTYPE, header["rect_count"]),
+                               ("circles", CIRCLE_DTYPE, header["circle_count"]),
+                               ("ellipses", ELLIPSE_DTYPE, header["ellipse_count"]),
+                               ("polys", POLY_DTYPE, header["poly_count"]),
+                               ("vertices", VERTEX_DTYPE, header["vertex_count"] * 2),
+                               ("labels", LABEL_DTYPE, shape_count if header["label_names_size"] else 0),
+                               ("label_names", LABEL_NAMES_DTYPE, header["label_names_size"])):
+        offset = _aligned(offset)
+        sections.append((name, dtype, offset, int(count)))
+        offset += dtype.itemsize * int(count)
+    return sections, offset
+
+# --- Scrittura ---
+def _build_sections(snapshot):
+    """Converte una tupla di ShapeSnapshot negli array delle sezioni (un solo passaggio sulle forme)."""
+    rects, circles, ellipses, polys = [], [], [], []
+    vertex_chunks = []
+    vertex_offset = 0
+    label_indices = {} # Nome dell'etichetta -> indice nella sezione dei nomi
+    labels = []
+    for order, shape in enumerate(snapshot):
+        labels.append(label_indices.setdefault(shape.label or DEFAULT_LABEL, len(label_indices)))
+        kind = shape.kind
+        if kind == "rectangle":
+            rects.append((order, *shape.coords, 0, shape.angle))
+        elif kind == "circle":
+            circles.append((order, *shape.coords))
+        elif kind == "ellipse":
+            ellipses.append((order, *shape.coords))
+        else:
+            original = shape.original_points
+            original_count = len(original) if original is not None else 0
+            polys.append((order, POLY_KINDS.index(kind), bool(shape.is_closed), original is not None, 0,
+                          vertex_offset, len(shape.points), original_count))
+            vertex_chunks.append(shape.points)
+            if original_count:
+                vertex_chunks.append(original)
+            vertex_offset += len(shape.points) + original_count
+
+    flat = itertools.chain.from_iterable(itertools.chain.from_iterable(vertex_chunks))
+    return {
+        "rectangles": np.array(rects, dtype=RECT_DTYPE),
+        "circles": np.array(circles, dtype=CIRCLE_DTYPE),
+        "ellipses": np.array(ellipses, dtype=ELLIPSE_DTYPE),
+        "polys": np.array(polys, dtype=POLY_DTYPE),
+        "vertices": np.fromiter(flat, dtype=VERTEX_DTYPE, count=vertex_offset * 2),
+        "labels": np.array(labels, dtype=LABEL_DTYPE),
+        "label_names": np.frombuffer(json.dumps(list(label_indices)).encode("utf-8"), dtype=LABEL_NAMES_DTYPE),
+    }
+
+def save_session(filename, snapshot, image_width=0, image_height=0):
+    """
+    Salva una tupla di ShapeSnapshot (vedi snapshot_shapes) nel formato di sessione binario.
+    Il file viene scritto su un file temporaneo e poi rinominato, come per le esportazioni JSON.
+    Args:
+        filename (str): Percorso del file di sessione.
+        snapshot (tuple): Copia immutabile delle forme.
+        image_width (int): Larghezza dell'immagine annotata.
+        image_height (int): Altezza dell'immagine annotata.
+    """
+    arrays = _build_sections(snapshot)
+    header = np.zeros((), dtype=HEADER_DTYPE)
+    header["magic"] = SESSION_MAGIC
+    header["version"] = SESSION_VERSION
+    header["header_size"] = HEADER_DTYPE.itemsize
+    header["image_width"] = image_width
+    header["image_height"] = image_height
+    header["rect_count"] = len(arrays["rectangles"])
+    header["circle_count"] = len(arrays["circles"])
+    header["ellipse_count"] = len(arrays["ellipses"])
+    header["poly_count"] = len(arrays["polys"])
+    header["vertex_count"] = len(arrays["vertices"]) // 2
+    header["label_names_size"] = len(arrays["label_names"])
+
+    # Sezioni con il padding di allineamento, in un unico buffer su cui calcolare il checksum
+    sections, total_size = _section_layout(header)
+    payload = bytearray(total_size - HEADER_DTYPE.itemsize)
+    for name, _, offset, _ in sections:
+        data = arrays[name].tobytes()
+        start = offset - HEADER_DTYPE.itemsize
+        payload[start:start + len(data)] = data
+    header["payload_crc32"] = zlib.crc32(payload)
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp_", suffix=SESSION_EXTENSION, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(payload)
+        os.replace(temp_path, filename)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+# --- Lettura ---
+class SessionData:
+    """
+    Contenuto di un file di sessione: intestazione e un array NumPy (senza copia) per ogni sezione.
+    Se il file è stato aperto con la mappatura in memoria, gli array restano validi fino a close().
+    """
+    def __init__(self, buffer, header, arrays, mapped=None):
+        self._buffer = buffer
+        self._mapped = mapped
+        self.header = header
+        self.image_width = int(header["image_width"])
+        self.image_height = int(header["image_height"])
+        self.rectangles = arrays["rectangles"]
+        self.circles = arrays["circles"]
+        self.ellipses = arrays["ellipses"]
+        self.polys = arrays["polys"]
+        self.vertices = arrays["vertices"].reshape(-1, 2) # Vista (N, 2) dell'array contiguo dei vertici
+        self.labels = arrays["labels"] # Indice in label_names per ogni forma (vuoto per i file della versione 1)
+        self.label_names = json.loads(arrays["label_names"].tobytes().decode("utf-8")) if len(arrays["label_names"]) else []
+
+    def __len__(self):
+        return len(self.rectangles) + len(self.circles) + len(self.ellipses) + len(self.polys)
+
+    def poly_points(self, index):
+        """Vista (count, 2) dei vertici del poligono/polilinea index (nell'ordine della sezione polys)."""
+        record = self.polys[index]
+        start = int(record["vertex_offset"])
+        return self.vertices[start:start + int(record["vertex_count"])]
+
+    def to_snapshots(self):
+        """Ricostruisce la tupla di ShapeSnapshot nell'ordine originale delle forme."""
+        # Conversione per colonne (tolist di un array semplice è molto più veloce che per record strutturati)
+        def columns(records, *names):
+            return zip(*(records[name].tolist() for name in names)) if len(records) else ()
+
+        result = [None] * len(self)
+        labels = [self.label_names[index] for index in self.labels.tolist()] if len(self.labels) else [None] * len(self)
+        for order, x1, y1, x2, y2, angle in columns(self.rectangles, "order", "x1", "y1", "x2", "y2", "angle"):
+            result[order] = ShapeSnapshot("rectangle", (x1, y1, x2, y2), angle, None, None, True, labels[order])
+        for order, cx, cy, radius in columns(self.circles, "order", "cx", "cy", "radius"):
+            result[order] = ShapeSnapshot("circle", (cx, cy, radius), 0.0, None, None, True, labels[order])
+        for order, x1, y1, x2, y2 in columns(self.ellipses, "order", "x1", "y1", "x2", "y2"):
+            result[order] = ShapeSnapshot("ellipse", (x1, y1, x2, y2), 0.0, None, None, True, labels[order])
+
+        vertices = list(zip(self.vertices[:, 0].tolist(), self.vertices[:, 1].tolist())) # Tutti i vertici in una volta
+        for order, kind, is_closed, has_original, start, count, original_count in columns(
+                self.polys, "order", "kind", "is_closed", "has_original", "vertex_offset", "vertex_count", "original_count"):
+            end = start + count
+            points = tuple(vertices[start:end])
+            original = tuple(vertices[end:end + original_count]) if has_original else None
+            result[order] = ShapeSnapshot(POLY_KINDS[kind], None, 0.0, points, original, bool(is_closed), labels[order])
+        return tuple(result)
+
+    def close(self):
+        """Rilascia la mappatura del file (gli array non vanno più usati)."""
+        self.rectangles = self.circles = self.ellipses = self.polys = self.vertices = self.labels = None
+        self._buffer = None
+        if self._mapped is not None:
+            try:
+                self._mapped.close()
+            except BufferError:
+                pass # Esistono ancora viste sulle sezioni: la mappatura si chiude quando vengono rilasciate
+            self._mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_session_buffer(buffer, verify=True):
+    """
+    Interpreta un buffer (bytes, memoryview o mmap) nel formato di sessione, senza copiarlo.
+    Args:
+        buffer: Contenuto completo del file di sessione.
+        verify (bool): Se True controlla il CRC32 del contenuto.
+    Returns:
+        tuple: (intestazione, dizionario nome sezione -> array NumPy).
+    """
+    if len(buffer) < HEADER_DTYPE.itemsize:
+        raise SessionFormatError("File di sessione troppo corto")
+    header = np.frombuffer(buffer, dtype=HEADER_DTYPE, count=1)[0].copy() # Copia: non trattiene il buffer
+    if header["magic"] != SESSION_MAGIC:
+        raise SessionFormatError("Firma del file di sessione non valida")
+    if header["version"] not in SUPPORTED_SESSION_VERSIONS:
+        raise SessionFormatError(f"Versione del file di sessione non supportata: {header['version']}")
+
+    sections, total_size = _section_layout(header)
+    if len(buffer) < total_size:
+        raise SessionFormatError("File di sessione troncato")
+    if verify and zlib.crc32(memoryview(buffer)[int(header["header_size"]):total_size]) != header["payload_crc32"]:
+        raise SessionFormatError("Checksum del file di sessione non valido")
+
+    arrays = {name: np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+              for name, dtype, offset, count in sections}
+    return header, arrays
+
+def load_session(filename, use_mmap=True, verify=True):
+    """
+    Carica un file di sessione. Con use_mmap il file viene mappato in memoria e le sezioni
+    sono viste dirette sul file (nessuna copia); altrimenti viene letto in un unico blocco.
+    Returns:
+        SessionData: Contenuto del file (da chiudere con close() o con un blocco with).
+    """
+    with open(filename, 'rb') as f:
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                header, arrays = read_session_buffer(mapped, verify)
+            except BaseException:
+                mapped.close()
+                raise
+            return SessionData(mapped, header, arrays, mapped)
+        buffer = f.read()
+    header, arrays = read_session_buffer(buffer, verify)
+    return SessionData(buffer, header, arrays)
+
+def load_session_snapshot(filename, verify=True):
+    """Carica un file di sessione e restituisce (tupla di ShapeSnapshot, larghezza, altezza dell'immagine)."""
+    with load_session(filename, verify=verify) as session:
+        return session.to_snapshots(), session.image_width, session.image_height
+
+# --- Conversione da/verso il formato JSON ---
+def json_to_session(json_filename, session_filename, image_width=0, image_height=0):
+    """Converte un file prodotto da export_annotations_to_json nel formato di sessione binario."""
+    with open(json_filename, 'r') as f:
+        annotations = json.load(f)
+    snapshot = tuple(annotation_to_snapshot(annotation) for annotation in annotations)
+    save_session(session_filename, snapshot, image_width, image_height)
+
+def session_to_annotations(filename, simplify_tolerance=None, include_original=False):
+    """Legge un file di sessione e restituisce le annotazioni nel layout JSON esportato."""
+    snapshot, _, _ = load_session_snapshot(filename)
+    return [snapshot_to_annotation(i, shape, simplify_tolerance, include_original) for i, shape in enumerate(snapshot)]
+
+def session_to_json(session_filename, json_filename, simplify_tolerance=None, include_original=False):
+    """Converte un file di sessione binario nel file JSON di export_annotations_to_json."""
+    write_json_atomic(session_to_annotations(session_filename, simplify_tolerance, include_original), json_filename)
@@ -0,0 +1,314 @@
+import argparse
+import bisect
+import glob
+import json
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from annotation_exporter import annotation_to_snapshot, snapshot_to_annotation, ShapeSnapshot
+from annotation_index import find_image_path, ANNOTATION_FILE_SUFFIX
+from export_pipeline import build_record, run_export, create_writers, clip_polygon, polygon_area, EXPORT_WRITERS
+from label_table import DEFAULT_LABEL
+
+# --- Configurazioni Globali dell'Esportazione a Tasselli ---
+TILE_SIZE = 640 # Lato (pixel) dei tasselli, come gli ingressi dei rilevatori
+TILE_STRIDE = 512 # Passo tra due tasselli: con TILE_SIZE dà 128 pixel di sovrapposizione
+TILE_MIN_AREA = 50 # Area minima (pixel quadrati) della parte di una forma chiusa dentro il tassello
+TILE_MIN_VISIBILITY = 0.2 # Frazione minima dell'area di una forma chiusa che deve cadere nel tassello
+TILE_FORMATS = ("json", "yolo") # Formati delle etichette di ogni tassello (vedi export_pipeline.EXPORT_WRITERS)
+TILE_IMAGE_EXTENSION = ".jpg" # Formato delle immagini dei tasselli (8 bit senza trasparenza)
+TILE_LOSSLESS_EXTENSION = ".png" # Tasselli a 16 bit o con canale alfa, che il JPEG saturerebbe o scarterebbe
+TILE_FLOAT_EXTENSION = ".tiff" # Tasselli con valori non interi (o interi oltre i 16 bit), non supportati dal PNG
+TILE_JPEG_QUALITY = 95 # Qualità JPEG dei tasselli (0-100)
+TILE_DIRNAME = "tiles" # Cartella predefinita dei tasselli, dentro la cartella delle annotazioni
+TILE_JOBS_PER_WORKER = 2 # Immagini affidate a ogni processo alla volta: le altre vengono lette solo quando serve
+
+# Parametri dell'esportazione, passati così come sono ai processi del pool
+TileOptions = namedtuple("TileOptions", ["size", "stride", "min_area", "min_visibility", "formats", "labels",
+                                         "keep_empty", "quality"])
+DEFAULT_TILE_OPTIONS = TileOptions(TILE_SIZE, TILE_STRIDE, TILE_MIN_AREA, TILE_MIN_VISIBILITY, TILE_FORMATS, None,
+                                   True, TILE_JPEG_QUALITY)
+
+# Un tassello: origine e dimensioni in pixel dell'immagine sorgente, e le forme ritagliate (coordinate del tassello)
+Tile = namedtuple("Tile", ["x", "y", "width", "height", "snapshot"])
+
+# --- Ritaglio delle forme ---
+def tile_origins(length, size, stride):
+    """
+    Origini dei tasselli lungo un lato: ogni stride pixel, più un ultimo tassello allineato alla fine
+    così che l'intera immagine sia coperta. Un lato più corto di size dà un solo tassello (più piccolo).
+    """
+    if length <= size:
+        return [0]
+    origins = list(range(0, length - size + 1, stride))
+    if origins[-1] != length - size:
+        origins.append(length - size)
+    return origins
+
+def clip_polyline(points, x0, y0, x1, y1):
+    """
+    Ritaglia una linea spezzata aperta sul rettangolo (Liang-Barsky su ogni segmento).
+    Returns:
+        list: Tratti (liste di vertici, almeno due ciascuno) rimasti dentro il rettangolo.
+    """
+    pieces = []
+    current = None
+    for (ax, ay), (bx, by) in zip(points, points[1:]):
+        dx, dy = bx - ax, by - ay
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dx, ax - x0), (dx, x1 - ax), (-dy, ay - y0), (dy, y1 - ay)):
+            if p == 0:
+                if q < 0:
+                    t0, t1 = 1.0, 0.0 # Parallelo al bordo e fuori
+                    break
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+        if t0 > t1:
+            current = None
+            continue
+        start = (ax + t0 * dx, ay + t0 * dy)
+        end = (ax + t1 * dx, ay + t1 * dy)
+        if current is None or current[-1] != start:
+            current = [start]
+            pieces.append(current)
+        current.append(end)
+    return pieces
+
+def _translated(snapshot, dx, dy):
+    """Copia di uno ShapeSnapshot spostata di (dx, dy); i vertici a piena risoluzione non vengono riportati."""
+    if snapshot.kind == "circle":
+        cx, cy, radius = snapshot.coords
+        return snapshot._replace(coords=(cx + dx, cy + dy, radius))
+    if snapshot.coords is not None:
+        x1, y1, x2, y2 = snapshot.coords
+        return snapshot._replace(coords=(x1 + dx, y1 + dy, x2 + dx, y2 + dy))
+    return snapshot._replace(points=tuple((x + dx, y + dy) for x, y in snapshot.points), original_points=None)
+
+def tile_annotations(annotations, image_width, image_height, options=DEFAULT_TILE_OPTIONS):
+    """
+    Divide le annotazioni di un'immagine (layout JSON nativo) nei tasselli della griglia.
+    I dati derivati di ogni forma (contorno, riquadro, area) sono calcolati una sola volta con build_record;
+    ogni forma viene confrontata solo con i tasselli che il suo riquadro tocca.
+    - Le forme interamente dentro un tassello restano del proprio tipo (solo traslate).
+    - Le forme chiuse a cavallo del bordo diventano poligoni ritagliati (rettangoli ruotati dai loro angoli,
+      cerchi e ovali dal poligono che li approssima); i ritagli con area minore di options.min_area
+      o di options.min_visibility volte l'area della forma vengono scartati.
+    - Le forme aperte vengono ritagliate in uno o più tratti.
+    Returns:
+        list: Tile nell'ordine della griglia (per righe); senza i tasselli vuoti se options.keep_empty è False.
+    """
+    xs = tile_origins(image_width, options.size, options.stride)
+    ys = tile_origins(image_height, options.size, options.stride)
+    tile_width, tile_height = min(options.size, image_width), min(options.size, image_height)
+    contents = {} # (indice colonna, indice riga) -> ShapeSnapshot ritagliati
+
+    for index, annotation in enumerate(annotations):
+        # Passando per lo snapshot anche i file senza etichetta (versioni precedenti) hanno tutti i campi
+        snapshot = annotation_to_snapshot(annotation)
+        record = build_record(index, snapshot_to_annotation(index, snapshot), image_width, image_height)
+        min_x, min_y, max_x, max_y = record.bbox
+        # Tasselli il cui intervallo [origine, origine + lato] interseca il riquadro della forma
+        columns = range(bisect.bisect_right(xs, min_x - tile_width), bisect.bisect_left(xs, max_x))
+        rows = range(bisect.bisect_right(ys, min_y - tile_height), bisect.bisect_left(ys, max_y))
+        for row in rows:
+            y0 = ys[row]
+            for column in columns:
+                x0 = xs[column]
+                x1, y1 = x0 + tile_width, y0 + tile_height
+                if x0 <= min_x and y0 <= min_y and max_x <= x1 and max_y <= y1:
+                    clipped = [_translated(snapshot, -x0, -y0)]
+                elif record.closed:
+                    polygon = clip_polygon(record.outline, x0, y0, x1, y1)
+                    if len(polygon) < 3:
+                        continue
+                    area = polygon_area(polygon)
+                    if area < options.min_area or (record.area and area < options.min_visibility * record.area):
+                        continue # Scheggia: troppo poco della forma cade nel tassello
+                    points = tuple((x - x0, y - y0) for x, y in polygon)
+                    clipped = [ShapeSnapshot("polygon", None, 0.0, points, None, True, snapshot.label)]
+                else:
+                    clipped = [snapshot._replace(points=tuple((x - x0, y - y0) for x, y in piece), original_points=None)
+                               for piece in clip_polyline(record.outline, x0, y0, x1, y1)]
+                if clipped:
+                    contents.setdefault((column, row), []).extend(clipped)
+
+    tiles = []
+    for row, y0 in enumerate(ys):
+        for column, x0 in enumerate(xs):
+            snapshot = contents.get((column, row), [])
+            if snapshot or options.keep_empty:
+                tiles.append(Tile(x0, y0, tile_width, tile_height, tuple(snapshot)))
+    return tiles
+
+# --- Elaborazione di un'immagine (nei processi del pool) ---
+def _tile_image_format(image, quality):
+    """
+    Formato dei tasselli di un'immagine letta con IMREAD_UNCHANGED: JPEG solo se è a 8 bit senza canale alfa,
+    altrimenti un formato senza perdite che conserva profondità e trasparenza.
+    Returns:
+        tuple: (estensione, parametri di cv2.imwrite).
+    """
+    import cv2
+    import numpy as np
+    has_alpha = image.ndim == 3 and image.shape[2] == 4
+    if image.dtype == np.uint8 and not has_alpha:
+        return TILE_IMAGE_EXTENSION, [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if image.dtype in (np.uint8, np.uint16):
+        return TILE_LOSSLESS_EXTENSION, []
+    return TILE_FLOAT_EXTENSION, []
+
+def _tile_image(image_path, annotation_path, output_dir, options):
+    """
+    Legge un'immagine e le sue annotazioni, scrive i ritagli dei tasselli e le loro etichette
+    (nomi: <immagine>_<x>_<y> più l'estensione o il suffisso di ogni formato).
+    Returns:
+        tuple: (percorso delle annotazioni, tasselli scritti, forme scritte, None o messaggio di errore).
+    """
+    import cv2
+    try:
+        with open(annotation_path, 'r') as f:
+            annotations = json.load(f)
+    except (IOError, ValueError) as e:
+        return annotation_path, 0, 0, f"Errore di lettura di {annotation_path}: {e}"
+    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return annotation_path, 0, 0, f"Impossibile caricare l'immagine {image_path}"
+
+    height, width = image.shape[:2]
+    extension, write_params = _tile_image_format(image, options.quality)
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    tiles_written = shapes_written = 0
+    for tile in tile_annotations(annotations, width, height, options):
+        tile_base = os.path.join(output_dir, f"{base_name}_{tile.x}_{tile.y}")
+        tile_image_path = tile_base + extension
+        crop = image[tile.y:tile.y + tile.height, tile.x:tile.x + tile.width]
+        if not cv2.imwrite(tile_image_path, crop, write_params):
+            return annotation_path, tiles_written, shapes_written, f"Impossibile scrivere {tile_image_path}"
+        run_export(tile.snapshot, tile.width, tile.height, tile_base, create_writers(options.formats),
+                   image_name=os.path.basename(tile_image_path), labels=options.labels)
+        tiles_written += 1
+        shapes_written += len(tile.snapshot)
+    return annotation_path, tiles_written, shapes_written, None
+
+# --- Elaborazione di un intero dataset ---
+def find_tile_jobs(annotation_dir, image_dir=None):
+    """
+    Associa ogni file *_annotations.json della cartella alla sua immagine.
+    Returns:
+        list: Tuple (percorso immagine, percorso annotazioni); i file senza immagine vengono segnalati e saltati.
+    """
+    jobs = []
+    for annotation_path in sorted(glob.glob(os.path.join(annotation_dir, "*" + ANNOTATION_FILE_SUFFIX))):
+        image_path = find_image_path(annotation_path, image_dir)
+        if image_path is None:
+            print(f"Immagine non trovata per {annotation_path}")
+            continue
+        jobs.append((image_path, annotation_path))
+    return jobs
+
+def collect_labels(annotation_paths):
+    """Etichette di tutti i file, nell'ordine in cui compaiono: gli id di classe saranno gli stessi in ogni tassello."""
+    labels = {}
+    for path in annotation_paths:
+        try:
+            with open(path, 'r') as f:
+                annotations = json.load(f)
+        except (IOError, ValueError):
+            continue # Segnalato dal processo che elabora il file
+        for annotation in annotations:
+            labels.setdefault(annotation.get("label") or DEFAULT_LABEL, None)
+    return tuple(labels)
+
+def tile_dataset(jobs, output_dir, options=DEFAULT_TILE_OPTIONS, workers=None, on_result=None):
+    """
+    Divide in tasselli tutte le immagini di un dataset in un pool di processi. Le immagini vengono lette
+    dai processi stessi, una alla volta, e ogni processo ne riceve al più TILE_JOBS_PER_WORKER per volta:
+    la memoria occupata non dipende dalla dimensione del dataset.
+    Args:
+        jobs (list): Tuple (percorso immagine, percorso annotazioni), es. da find_tile_jobs.
+        options (TileOptions): Se options.labels è None, le etichette vengono raccolte da tutti i file.
+        on_result (callable): Chiamata con (percorso annotazioni, tasselli, forme, None o messaggio di errore).
+    Returns:
+        tuple: (tasselli scritti, forme scritte) in totale.
+    """
+    workers = workers or os.cpu_count() or 1
+    if options.labels is None:
+        options = options._replace(labels=collect_labels([annotation_path for _, annotation_path in jobs]))
+    os.makedirs(output_dir, exist_ok=True)
+    remaining = iter(jobs)
+    running = set()
+    total_tiles = total_shapes = 0
+
+    # "spawn": come per le anteprime, i processi non ereditano lo stato del processo principale
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        def submit_next():
+            job = next(remaining, None)
+            if job is not None:
+                running.add(pool.submit(_tile_image, job[0], job[1], output_dir, options))
+
+        try:
+            for _ in range(workers * TILE_JOBS_PER_WORKER):
+                submit_next()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.discard(future)
+                    submit_next()
+                    try:
+                        annotation_path, tiles, shapes, error = future.result()
+                    except Exception as e:
+                        annotation_path, tiles, shapes, error = None, 0, 0, f"Errore durante la divisione in tasselli: {e}"
+                    total_tiles += tiles
+                    total_shapes += shapes
+                    if on_result is not None:
+                        on_result(annotation_path, tiles, shapes, error)
+        finally:
+            for future in running:
+                future.cancel()
+    return total_tiles, total_shapes
+
+# --- Interfaccia a riga di comando ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Divide le immagini annotate in tasselli sovrapposti con le relative etichette.")
+    parser.add_argument("directory", help="Cartella con i file *_annotations.json")
+    parser.add_argument("--images", default=None, help="Cartella delle immagini (default: la cartella delle annotazioni)")
+    parser.add_argument("--output", default=None, help=f"Cartella dei tasselli (default: <directory>/{TILE_DIRNAME})")
+    parser.add_argument("--size", type=int, default=TILE_SIZE, help="Lato dei tasselli in pixel")
+    parser.add_argument("--stride", type=int, default=TILE_STRIDE, help="Passo tra i tasselli in pixel")
+    parser.add_argument("--min-area", type=float, default=TILE_MIN_AREA, help="Area minima (pixel quadrati) di una forma ritagliata")
+    parser.add_argument("--min-visibility", type=float, default=TILE_MIN_VISIBILITY,
+                        help="Frazione minima dell'area di una forma che deve restare nel tassello")
+    parser.add_argument("--formats", default=",".join(TILE_FORMATS),
+                        help=f"Formati delle etichette separati da virgole (disponibili: {', '.join(EXPORT_WRITERS)})")
+    parser.add_argument("--labels", default=None,
+                        help="Classi separate da virgole, nell'ordine degli id (default: quelle dei file, in ordine di apparizione)")
+    parser.add_argument("--skip-empty", action="store_true", help="Non scrive i tasselli senza forme")
+    parser.add_argument("--quality", type=int, default=TILE_JPEG_QUALITY, help="Qualità JPEG (0-100) dei tasselli a 8 bit")
+    parser.add_argument("--workers", type=int, default=None, help="Numero di processi")
+    args = parser.parse_args()
+
+    if args.size <= 0 or args.stride <= 0:
+        parser.error("--size e --stride devono essere positivi")
+    formats = tuple(name.strip() for name in args.formats.split(",") if name.strip())
+    try:
+        create_writers(formats)
+    except ValueError as e:
+        parser.error(str(e))
+    labels = tuple(name.strip() for name in args.labels.split(",") if name.strip()) if args.labels else None
+    options = TileOptions(args.size, args.stride, args.min_area, args.min_visibility, formats, labels,
+                          not args.skip_empty, args.quality)
+
+    jobs = find_tile_jobs(args.directory, args.images)
+
+    def print_result(annotation_path, tiles, shapes, error):
+        if error is not None:
+            print(error)
+        else:
+            print(f"{os.path.basename(annotation_path)}: {tiles} tasselli, {shapes} forme")
+
+    total_tiles, total_shapes = tile_dataset(jobs, args.output or os.path.join(args.directory, TILE_DIRNAME),
+                                             options, args.workers, print_result)
+    print(f"Tasselli scritti: {total_tiles}, forme: {total_shapes} (immagini: {len(jobs)})")
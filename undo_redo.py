@@ -0,0 +1,362 @@
+from collections import deque
+from group_transform import apply_group_transform
+from interactive_shapes import set_shape_label
+
+# --- Configurazioni Globali per Undo/Redo ---
+DEFAULT_UNDO_BUDGET_BYTES = 4 * 1024 * 1024 # Memoria massima (stimata) occupata dalla cronologia
+COMMAND_BASE_SIZE = 128 # Stima in byte di un comando senza punti (oggetto + campi scalari)
+POINT_SIZE = 64 # Stima in byte di un vertice (tupla + due numeri)
+
+# --- Comandi (ognuno memorizza solo la variazione, non una copia della scena) ---
+class UndoCommand:
+    """
+    Classe base di un comando annullabile. Ogni comando conosce la forma su cui agisce
+    e memorizza solo il delta necessario per annullare/ripetere la modifica.
+    """
+    def __init__(self, shape):
+        self.shape = shape
+
+    def undo(self):
+        """Annulla la modifica sulla forma."""
+        raise NotImplementedError
+
+    def redo(self):
+        """Riapplica la modifica sulla forma."""
+        raise NotImplementedError
+
+    def merge(self, other):
+        """
+        Prova ad assorbire un comando successivo dello stesso tipo (es. eventi di trascinamento consecutivi).
+        Restituisce True se l'unione è avvenuta, False altrimenti.
+        """
+        return False
+
+    def estimated_size(self):
+        """Stima in byte della memoria occupata dal comando."""
+        return COMMAND_BASE_SIZE
+
+    def affected_shapes(self):
+        """Forme modificate dal comando."""
+        return (self.shape,) if self.shape is not None else ()
+
+class TranslateCommand(UndoCommand):
+    """Spostamento di una forma di dx, dy."""
+    def __init__(self, shape, dx, dy):
+        super().__init__(shape)
+        self.dx = dx
+        self.dy = dy
+
+    def undo(self):
+        self.shape.move(-self.dx, -self.dy)
+
+    def redo(self):
+        self.shape.move(self.dx, self.dy)
+
+    def merge(self, other):
+        if isinstance(other, TranslateCommand) and other.shape is self.shape:
+            self.dx += other.dx
+            self.dy += other.dy
+            return True
+        return False
+
+class CoordsCommand(UndoCommand):
+    """Ridimensionamento di rettangoli, ovali e cerchi: vecchie e nuove coordinate (come per update_coords)."""
+    def __init__(self, shape, old_coords, new_coords):
+        super().__init__(shape)
+        self.old_coords = old_coords
+        self.new_coords = new_coords
+
+    def undo(self):
+        self.shape.update_coords(*self.old_coords)
+
+    def redo(self):
+        self.shape.update_coords(*self.new_coords)
+
+    def merge(self, other):
+        if isinstance(other, CoordsCommand) and other.shape is self.shape:
+            self.new_coords = other.new_coords # Conserva le coordinate iniziali, aggiorna quelle finali
+            return True
+        return False
+
+class VertexCommand(UndoCommand):
+    """Spostamento di un vertice di poligono/polilinea: indice, vecchio e nuovo valore."""
+    def __init__(self, shape, index, old_point, new_point, old_original_points=None):
+        super().__init__(shape)
+        self.index = index
+        self.old_point = old_point
+        self.new_point = new_point
+        self.old_original_points = old_original_points # Scartati da update_point, ripristinati dall'undo
+
+    def undo(self):
+        self.shape.update_point(self.index, *self.old_point)
+        self.shape.original_points = self.old_original_points
+
+    def redo(self):
+        self.shape.update_point(self.index, *self.new_point)
+
+    def merge(self, other):
+        if isinstance(other, VertexCommand) and other.shape is self.shape and other.index == self.index:
+            self.new_point = other.new_point
+            return True
+        return False
+
+    def estimated_size(self):
+        return COMMAND_BASE_SIZE + POINT_SIZE * len(self.old_original_points or ())
+
+class InsertVertexCommand(UndoCommand):
+    """Aggiunta di un vertice durante il disegno di un poligono/polilinea."""
+    def __init__(self, shape, index):
+        super().__init__(shape)
+        self.index = index
+        self.point = None # Valorizzato all'annullamento, così il redo ripristina la posizione finale del vertice
+
+    def undo(self):
+        self.point = self.shape.remove_point(self.index)
+
+    def redo(self):
+        self.shape.insert_point(self.index, *self.point)
+
+class PointsCommand(UndoCommand):
+    """Sostituzione dell'intera lista di vertici (es. semplificazione Douglas-Peucker)."""
+    def __init__(self, shape, old_points, new_points, old_original_points=None):
+        super().__init__(shape)
+        self.old_points = old_points
+        self.new_points = new_points
+        self.old_original_points = old_original_points
+        self.new_original_points = shape.original_points
+
+    def undo(self):
+        self.shape.set_points(self.old_points, self.old_original_points)
+
+    def redo(self):
+        self.shape.set_points(self.new_points, self.new_original_points)
+
+    def estimated_size(self):
+        return COMMAND_BASE_SIZE + POINT_SIZE * (len(self.old_points) + len(self.new_points))
+
+class RotateCommand(UndoCommand):
+    """Rotazione di un rettangolo: variazione dell'angolo in radianti."""
+    def __init__(self, shape, delta_angle):
+        super().__init__(shape)
+        self.delta_angle = delta_angle
+
+    def undo(self):
+        self.shape.set_angle(self.shape.angle - self.delta_angle)
+
+    def redo(self):
+        self.shape.set_angle(self.shape.angle + self.delta_angle)
+
+    def merge(self, other):
+        if isinstance(other, RotateCommand) and other.shape is self.shape:
+            self.delta_angle += other.delta_angle
+            return True
+        return False
+
+class GroupTransformCommand(UndoCommand):
+    """
+    Trasformazione di un gruppo di forme: parametri della trasformazione, non le coordinate
+    (tranne quelle precedenti dei cerchi il cui raggio è stato limitato al minimo, restituite da apply_group_transform).
+    """
+    def __init__(self, shapes, dx=0, dy=0, scale=1.0, angle=0.0, origin=(0, 0), clamped=()):
+        super().__init__(None)
+        self.shapes = list(shapes)
+        self.dx = dx
+        self.dy = dy
+        self.scale = scale
+        self.angle = angle
+        self.origin = origin
+        self.clamped = list(clamped) # Coppie (cerchio, coordinate precedenti): l'inverso della scala non le ripristina
+
+    def undo(self):
+        # Inverso di p' = R*s*(p - o) + o + d: prima la traslazione, poi rotazione/scala inverse
+        apply_group_transform(self.shapes, -self.dx, -self.dy)
+        if self.scale != 1 or self.angle != 0:
+            apply_group_transform(self.shapes, scale=1 / self.scale, angle=-self.angle, origin=self.origin)
+        for shape, coords in self.clamped:
+            shape.update_coords(*coords)
+
+    def redo(self):
+        apply_group_transform(self.shapes, self.dx, self.dy, self.scale, self.angle, self.origin)
+
+    def estimated_size(self):
+        return COMMAND_BASE_SIZE + 8 * len(self.shapes) + 32 * len(self.clamped) # Riferimenti alle forme e coordinate salvate
+
+    def affected_shapes(self):
+        return self.shapes
+
+class LabelCommand(UndoCommand):
+    """Cambio di etichetta di una o più forme: gli id precedenti (uno per forma) e il nuovo id."""
+    def __init__(self, shapes, old_label_ids, new_label_id):
+        super().__init__(None)
+        self.shapes = list(shapes)
+        self.old_label_ids = list(old_label_ids)
+        self.new_label_id = new_label_id
+
+    def undo(self):
+        for shape, label_id in zip(self.shapes, self.old_label_ids):
+            set_shape_label(shape, label_id)
+
+    def redo(self):
+        for shape in self.shapes:
+            set_shape_label(shape, self.new_label_id)
+
+    def estimated_size(self):
+        return COMMAND_BASE_SIZE + 16 * len(self.shapes) # Riferimenti alle forme e id precedenti
+
+    def affected_shapes(self):
+        return self.shapes
+
+class AddShapeCommand(UndoCommand):
+    """Aggiunta di una forma alla lista delle forme dell'applicazione."""
+    def __init__(self, shapes, shape, index):
+        super().__init__(shape)
+        self.shapes = shapes # Riferimento (non copia) alla lista delle forme dell'app
+        self.index = index # Posizione nell'ordine di disegno (la lista può cambiare, es. per le modifiche di altri annotatori)
+
+    def undo(self):
+        self.shape.delete_shapes() # Rimuove gli elementi dal canvas
+        self.shapes.remove(self.shape)
+
+    def redo(self):
+        self.shapes.insert(min(self.index, len(self.shapes)), self.shape)
+
+    def estimated_size(self):
+        return COMMAND_BASE_SIZE + POINT_SIZE * len(getattr(self.shape, "points", ()))
+
+class RemoveShapeCommand(AddShapeCommand):
+    """Rimozione di una forma: l'inverso esatto dell'aggiunta."""
+    def undo(self):
+        super().redo()
+
+    def redo(self):
+        super().undo()
+
+class GestureCommand(UndoCommand):
+    """
+    Raggruppa tutti i comandi registrati durante un singolo gesto (da pressione a rilascio del mouse)
+    in un'unica voce della cronologia, unendo gli eventi di trascinamento consecutivi.
+    """
+    def __init__(self):
+        super().__init__(None)
+        self.commands = []
+
+    def add(self, command):
+        if not self.commands or not self.commands[-1].merge(command):
+            self.commands.append(command)
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+    def redo(self):
+        for command in self.commands:
+            command.redo()
+
+    def estimated_size(self):
+        return sum(command.estimated_size() for command in self.commands)
+
+    def affected_shapes(self):
+        return [shape for command in self.commands for shape in command.affected_shapes()]
+
+# --- Pila Undo/Redo con budget di memoria ---
+class UndoRedoStack:
+    """
+    Cronologia delle modifiche con budget di memoria in byte.
+    Quando il budget viene superato, le voci più vecchie vengono scartate.
+    """
+    def __init__(self, budget_bytes=DEFAULT_UNDO_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.undo_entries = deque() # Coppie (comando, dimensione stimata)
+        self.redo_entries = []
+        self.used_bytes = 0
+        self.current_gesture = None # Gesto in corso (None se nessun gesto è aperto)
+        self.on_change = None # Chiamata (senza argomenti) dopo ogni voce registrata, annullata o ripetuta
+
+    def begin_gesture(self):
+        """Apre un nuovo gesto: i comandi successivi confluiscono in un'unica voce."""
+        self.end_gesture()
+        self.current_gesture = GestureCommand()
+
+    def end_gesture(self):
+        """Chiude il gesto corrente e lo aggiunge alla cronologia (se contiene modifiche)."""
+        gesture = self.current_gesture
+        self.current_gesture = None
+        if gesture is not None and gesture.commands:
+            self._push_entry(gesture)
+
+    def push(self, command):
+        """Registra un comando già applicato. Fuori da un gesto diventa una voce a sé."""
+        if self.current_gesture is not None:
+            self.current_gesture.add(command)
+        else:
+            self._push_entry(command)
+
+    def _push_entry(self, command):
+        # Una nuova modifica invalida i redo disponibili
+        for _, size in self.redo_entries:
+            self.used_bytes -= size
+        self.redo_entries = []
+
+        size = command.estimated_size()
+        self.undo_entries.append((command, size))
+        self.used_bytes += size
+        self._enforce_budget()
+        self._notify()
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _enforce_budget(self):
+        # Scarta le voci più vecchie, mantenendo comunque l'ultima
+        while self.used_bytes > self.budget_bytes and len(self.undo_entries) > 1:
+            _, size = self.undo_entries.popleft()
+            self.used_bytes -= size
+
+    def can_undo(self):
+        return bool(self.undo_entries) or self.current_gesture is not None and bool(self.current_gesture.commands)
+
+    def can_redo(self):
+        return bool(self.redo_entries)
+
+    def undo(self):
+        """Annulla l'ultima voce. Restituisce True se è stato annullato qualcosa."""
+        self.end_gesture()
+        if not self.undo_entries:
+            return False
+        command, size = self.undo_entries.pop()
+        command.undo()
+        self.redo_entries.append((command, size))
+        self._notify()
+        return True
+
+    def redo(self):
+        """Ripete l'ultima voce annullata. Restituisce True se è stato ripetuto qualcosa."""
+        self.end_gesture()
+        if not self.redo_entries:
+            return False
+        command, size = self.redo_entries.pop()
+        command.redo()
+        self.undo_entries.append((command, size))
+        self._notify()
+        return True
+
+    def discard_shapes(self, affects):
+        """
+        Elimina le voci (annullabili e ripetibili) che modificano almeno una forma per cui affects(forma) è True,
+        es. forme sostituite o eliminate da un altro annotatore; le altre voci restano utilizzabili.
+        """
+        def keep(command):
+            return not any(affects(shape) for shape in command.affected_shapes())
+        self.undo_entries = deque(entry for entry in self.undo_entries if keep(entry[0]))
+        self.redo_entries = [entry for entry in self.redo_entries if keep(entry[0])]
+        if self.current_gesture is not None and not keep(self.current_gesture):
+            self.current_gesture = None
+        self.used_bytes = sum(size for _, size in self.undo_entries) + sum(size for _, size in self.redo_entries)
+
+    def clear(self):
+        """Svuota la cronologia (es. al caricamento di una nuova immagine)."""
+        self.undo_entries.clear()
+        self.redo_entries = []
+        self.used_bytes = 0
+        self.current_gesture = None
@@ -1,38 +1,84 @@
 import tkinter as tk
-import cv2
-import numpy as np
+from tkinter import filedialog
 import os # Importa il modulo os per gestire i percorsi dei file
-# Importa le classi e le funzioni dai moduli personalizzati
-from interactive_shapes import InteractiveRectangle, InteractiveCircle, InteractiveEllipse, InteractivePolygon, InteractivePolyline, cv2_to_tk_image, HANDLE_SIZE, ROTATION_HANDLE_OFFSET
+import math
+import queue
+import threading
+import uuid
+# Importa le classi e le funzioni dai moduli personalizzati.
+# Questi moduli non importano OpenCV, NumPy né Pillow all'avvio: le librerie pesanti sono caricate al primo uso
+# (l'immagine iniziale le carica in background), e i moduli delle funzioni opzionali (raster, proposte, video,
+# sessioni, controllo qualità) sono importati dai metodi che li usano.
+from interactive_shapes import InteractiveRectangle, InteractiveCircle, InteractiveEllipse, InteractivePolygon, InteractivePolyline, cv2_to_tk_image, HANDLE_SIZE, ROTATION_HANDLE_OFFSET, SELECTION_TAG, COLOR_POLYGON_BORDER
 from mouse_events import MouseEventHandler
 from image_utils import create_blank_cv_image, load_cv_image
-from annotation_exporter import export_annotations_to_json # Importa la nuova funzione di esportazione
+from annotation_exporter import snapshot_shapes, shapes_from_snapshot, snapshot_to_annotation, annotation_to_snapshot
+from background_export import ExportWorker, PipelineExportJob, SessionSaveJob
+from export_pipeline import EXPORT_WRITERS, DEFAULT_EXPORT_FORMATS, format_report
+from undo_redo import UndoRedoStack, AddShapeCommand, RemoveShapeCommand, PointsCommand, GroupTransformCommand, LabelCommand, DEFAULT_UNDO_BUDGET_BYTES
+from label_table import LABELS, DEFAULT_LABEL_ID
+from group_transform import apply_group_transform, group_center
+from geometry_utils import SIMPLIFY_TOLERANCE
+from edge_snapping import EdgeSnapper
+from display_adjustments import DisplayAdjuster, DEFAULT_DISPLAY_SETTINGS, BRIGHTNESS_RANGE, CONTRAST_RANGE, GAMMA_RANGE, CHANNEL_VIEWS
+
+GROUP_SCALE_STEP = 1.1 # Fattore di scala per ogni pressione di +/-
+GROUP_ROTATION_STEP = math.radians(5) # Rotazione per ogni pressione di [ o ]
+STARTUP_POLL_MS = 20 # Intervallo (ms) con cui si controlla se l'immagine iniziale è stata caricata
+BLANK_IMAGE_SIZE = (800, 600) # Immagine vuota usata senza immagine iniziale (come le dimensioni iniziali del canvas)
+SYNC_BATCH_MS = 250 # Le modifiche di questo intervallo vengono inviate al servizio di annotazione in un unico delta
+SYNC_POLL_MS = 100 # Intervallo (ms) con cui si applicano le modifiche ricevute dagli altri annotatori
 
 # --- Classe Principale dell'Applicazione ---
 class ImageEditorApp:
     """
     Applicazione Tkinter per l'editing interattivo di immagini con rettangoli, cerchi, ovali, poligoni e polilinee trascinabili, ridimensionabili e ruotabili.
     """
-    def __init__(self, root, image_path=None):
+    def __init__(self, root, image_path=None, undo_budget_bytes=DEFAULT_UNDO_BUDGET_BYTES, service_url=None):
         self.root = root
         self.root.title("Editor di Forme Interattive")
 
         self.original_cv_image = None
         self.current_cv_image = None
         self.tk_image = None
+        self.image_item_id = None # ID dell'immagine di sfondo sul canvas (riutilizzato a ogni aggiornamento)
+        self.displayed_region = None # Parte dell'immagine (x0, y0, x1, y1) convertita e mostrata sul canvas
+        self.display_adjuster = DisplayAdjuster() # Luminosità/contrasto/gamma/CLAHE/canale: solo visualizzazione
 
         self.active_shape = None # La forma attualmente selezionata/trascinata (può essere Rectangle, Circle, Ellipse, Polygon, Polyline)
         self.shapes = []         # Lista di tutte le forme sull'immagine
+        self.selected_shape = None # Forma selezionata: con quella sotto il mouse è l'unica a mostrare le maniglie
+        self.hovered_shape = None  # Forma attualmente sotto il puntatore del mouse
+        self.selected_shapes = [] # Selezione multipla (riquadro o Maiusc+clic), trasformata come un gruppo
+        self.render_mode = "canvas" # "canvas": un elemento Tk per forma; "raster": forme composte nell'immagine
+        self.raster_overlay = None # Compositore usato in modalità "raster" (creato al primo utilizzo)
+        self.undo_stack = UndoRedoStack(undo_budget_bytes) # Cronologia delle modifiche (solo delta, memoria limitata)
+        self.snap_to_edges = False # Se True i vertici di poligoni e polilinee si agganciano al bordo più vicino
+        self.edge_snapper = EdgeSnapper() # Mappe di aggancio ai bordi, calcolate in background a ogni caricamento
+        self.proposal_engine = None # Segmentazione automatica in un pool di processi (creata alla prima richiesta)
+        self.proposals = [] # Poligoni proposti (non ancora forme dell'immagine): clic per accettare, tasto destro per rifiutare
+        self.video_source = None # Video aperto (None in modalità immagine)
+        self.video_frame_index = 0 # Fotogramma visualizzato
+        self.video_frame_shapes = {} # indice del fotogramma -> lista delle sue forme
+        self.video_track_shapes = True # Se True le forme propagate seguono il moto (flusso ottico sui vertici)
+        self.current_label_id = DEFAULT_LABEL_ID # Etichetta (id nella tabella LABELS) assegnata alle nuove forme
 
-        self.drag_state = None # Stato del trascinamento: "new_rect", "new_circle", "new_ellipse", "drawing_polygon", "drawing_polyline", "move_shape", "resize_shape", "rotate_rect", "move_vertex"
+        self.drag_state = None # Stato del trascinamento: "new_rect", "new_circle", "new_ellipse", "drawing_polygon", "drawing_polyline", "drawing_lasso", "move_shape", "resize_shape", "rotate_rect", "move_vertex"
         self.start_x = 0       # Coordinata X iniziale del clic del mouse
         self.start_y = 0       # Coordinata Y iniziale del clic del mouse
 
         self.current_draw_mode = "rectangle" # Modalità di disegno iniziale
         self.current_image_path = image_path # Memorizza il percorso dell'immagine corrente
+        self.simplify_tolerance = SIMPLIFY_TOLERANCE # Tolleranza (pixel) di semplificazione alla chiusura di poligoni/polilinee (None per disattivarla)
+        self.export_simplify_tolerance = None # Se impostata, l'esportazione scrive la geometria semplificata
+        self.export_keep_original = False # Se True, l'esportazione include anche i vertici a piena risoluzione
+        self.export_formats = list(DEFAULT_EXPORT_FORMATS) # Formati scritti (in un solo passaggio) da export_current_annotations
+        self.export_worker = ExportWorker(root) # Serializza e scrive le esportazioni in background
+        self.annotation_sync = None # Sincronizzazione con il servizio di annotazione (None se non collegato)
+        self._sync_scheduled = False # Invio al servizio già programmato
 
         # Crea il Canvas per visualizzare l'immagine e disegnare le forme
-        self.canvas = tk.Canvas(root, bg="black", width=800, height=600)
+        self.canvas = tk.Canvas(root, bg="black", width=BLANK_IMAGE_SIZE[0], height=BLANK_IMAGE_SIZE[1])
         self.canvas.pack(padx=10, pady=10)
 
         # Crea un'istanza del gestore eventi del mouse, passandogli un riferimento a questa app
@@ -43,6 +89,26 @@ class ImageEditorApp:
         self.canvas.bind("<B1-Motion>", self.mouse_handler.on_mouse_drag)       # Trascinamento con clic sinistro
         self.canvas.bind("<ButtonRelease-1>", self.mouse_handler.on_mouse_up) # Rilascio clic sinistro
         self.canvas.bind("<Double-Button-1>", self.mouse_handler.on_mouse_double_click) # Doppio clic sinistro per chiudere poligoni/finalizzare polilinee
+        self.canvas.bind("<Motion>", self.mouse_handler.on_mouse_move) # Movimento senza tasti: evidenzia la forma sotto il mouse
+        self.canvas.bind("<Shift-Button-1>", self.mouse_handler.on_shift_click) # Maiusc+clic: aggiunge/toglie una forma dalla selezione
+        self.canvas.bind("<Button-3>", self.mouse_handler.on_right_click) # Tasto destro: rifiuta la proposta sotto il mouse
+        self.canvas.bind("<Configure>", self._on_canvas_configure) # Finestra ridimensionata: può scoprire parti dell'immagine
+
+        # Scorciatoie da tastiera per annullare/ripetere
+        self._bind_shortcut("<Control-z>", self.undo)
+        self._bind_shortcut("<Control-y>", self.redo)
+        self._bind_shortcut("<Control-Z>", self.redo) # Ctrl+Shift+Z
+        self._bind_shortcut("<Delete>", lambda: self.remove_shape(self.selected_shape))
+        self._bind_shortcut("<Escape>", lambda: self.select_shape(None))
+        # Trasformazioni del gruppo selezionato: scala (+/-) e rotazione ([ e ])
+        self._bind_shortcut("<plus>", lambda: self.transform_selection(scale=GROUP_SCALE_STEP))
+        self._bind_shortcut("<minus>", lambda: self.transform_selection(scale=1 / GROUP_SCALE_STEP))
+        self._bind_shortcut("<bracketright>", lambda: self.transform_selection(angle=GROUP_ROTATION_STEP))
+        self._bind_shortcut("<bracketleft>", lambda: self.transform_selection(angle=-GROUP_ROTATION_STEP))
+        # Navigazione nei video: frecce per cambiare fotogramma, Maiusc+destra per propagare le forme
+        self._bind_shortcut("<Right>", lambda: self.show_video_frame(self.video_frame_index + 1))
+        self._bind_shortcut("<Left>", lambda: self.show_video_frame(self.video_frame_index - 1))
+        self._bind_shortcut("<Shift-Right>", self.propagate_to_next_frame)
         
         # Crea un frame per i pulsanti di selezione della forma
         self.button_frame = tk.Frame(root)
@@ -53,80 +119,859 @@ class ImageEditorApp:
         tk.Button(self.button_frame, text="Disegna Ovale", command=lambda: self.set_draw_mode("ellipse")).pack(side=tk.LEFT, padx=5)
         tk.Button(self.button_frame, text="Disegna Poligono", command=lambda: self.set_draw_mode("polygon")).pack(side=tk.LEFT, padx=5)
         tk.Button(self.button_frame, text="Disegna Polilinea", command=lambda: self.set_draw_mode("polyline")).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Lazo a Mano Libera", command=lambda: self.set_draw_mode("lasso")).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Seleziona", command=lambda: self.set_draw_mode("select")).pack(side=tk.LEFT, padx=5)
         
         # Nuovo pulsante per esportare le annotazioni
-        tk.Button(self.button_frame, text="Esporta Annotazioni JSON", command=self.export_current_annotations).pack(side=tk.LEFT, padx=20)
+        tk.Button(self.button_frame, text="Esporta Annotazioni", command=self.export_current_annotations).pack(side=tk.LEFT, padx=(20, 0))
+        formats_button = tk.Menubutton(self.button_frame, text="Formati", relief=tk.RAISED)
+        formats_menu = tk.Menu(formats_button, tearoff=0)
+        self.export_format_vars = {}
+        for name in EXPORT_WRITERS:
+            self.export_format_vars[name] = tk.BooleanVar(value=name in self.export_formats)
+            formats_menu.add_checkbutton(label=name, variable=self.export_format_vars[name],
+                                         command=lambda name=name: self.toggle_export_format(name))
+        formats_button.configure(menu=formats_menu)
+        formats_button.pack(side=tk.LEFT, padx=(0, 20))
+        tk.Button(self.button_frame, text="Salva Sessione", command=self.save_current_session).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Carica Sessione", command=self.load_current_session).pack(side=tk.LEFT, padx=5)
 
+        tk.Button(self.button_frame, text="Controllo Qualità", command=self.check_annotation_quality).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Semplifica Contorni", command=self.simplify_all_shapes).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Modalità Raster", command=self.toggle_render_mode).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Aggancio ai Bordi", command=self.toggle_edge_snapping).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Proponi Contorni", command=self.propose_shapes).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Rifinisci Rettangolo", command=self.refine_selected_rectangle).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Accetta Proposte", command=self.accept_all_proposals).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Rifiuta Proposte", command=self.reject_all_proposals).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Apri Video", command=self.open_video).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Propaga al Successivo", command=self.propagate_to_next_frame).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Annulla", command=self.undo).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.button_frame, text="Ripeti", command=self.redo).pack(side=tk.LEFT, padx=5)
 
-        # Carica un'immagine di esempio o crea uno sfondo nero
-        if image_path:
-            self._load_initial_image(image_path)
-        else:
-            self._create_initial_blank_image(800, 600)
+        # Regolazioni di visualizzazione (non modificano l'immagine né le annotazioni)
+        self.adjust_frame = tk.Frame(root)
+        self.adjust_frame.pack(pady=5)
+        self.adjust_vars = {}
+        for name, label, value_range, resolution in (("brightness", "Luminosità", BRIGHTNESS_RANGE, 1),
+                                                     ("contrast", "Contrasto", CONTRAST_RANGE, 0.05),
+                                                     ("gamma", "Gamma", GAMMA_RANGE, 0.05)):
+            self.adjust_vars[name] = tk.DoubleVar(value=getattr(DEFAULT_DISPLAY_SETTINGS, name))
+            tk.Scale(self.adjust_frame, label=label, from_=value_range[0], to=value_range[1], resolution=resolution,
+                     orient=tk.HORIZONTAL, length=150, variable=self.adjust_vars[name],
+                     command=lambda value, name=name: self.set_display_adjustment(**{name: float(value)})).pack(side=tk.LEFT, padx=5)
+        self.adjust_vars["clahe"] = tk.BooleanVar(value=DEFAULT_DISPLAY_SETTINGS.clahe)
+        tk.Checkbutton(self.adjust_frame, text="CLAHE", variable=self.adjust_vars["clahe"],
+                       command=lambda: self.set_display_adjustment(clahe=self.adjust_vars["clahe"].get())).pack(side=tk.LEFT, padx=5)
+        self.adjust_vars["channel"] = tk.StringVar(value=DEFAULT_DISPLAY_SETTINGS.channel)
+        tk.OptionMenu(self.adjust_frame, self.adjust_vars["channel"], *CHANNEL_VIEWS,
+                      command=lambda channel: self.set_display_adjustment(channel=channel)).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.adjust_frame, text="Reimposta Visualizzazione", command=self.reset_display_adjustments).pack(side=tk.LEFT, padx=5)
 
-        self.draw_all_shapes()
+        # Etichette di classe: quella delle nuove forme (e delle selezionate, con "Applica") e quelle visibili
+        self.label_frame = tk.Frame(root)
+        self.label_frame.pack(pady=5)
+        tk.Label(self.label_frame, text="Etichetta:").pack(side=tk.LEFT)
+        self.label_var = tk.StringVar(value=LABELS.name(self.current_label_id))
+        label_entry = tk.Entry(self.label_frame, textvariable=self.label_var, width=20)
+        label_entry.pack(side=tk.LEFT, padx=5)
+        label_entry.bind("<Return>", lambda event: self.apply_label())
+        tk.Button(self.label_frame, text="Applica Etichetta", command=self.apply_label).pack(side=tk.LEFT, padx=5)
+        visible_button = tk.Menubutton(self.label_frame, text="Etichette Visibili", relief=tk.RAISED)
+        self.visible_labels_menu = tk.Menu(visible_button, tearoff=0, postcommand=self._build_visible_labels_menu)
+        visible_button.configure(menu=self.visible_labels_menu)
+        visible_button.pack(side=tk.LEFT, padx=5)
+
+        # Riga di stato (avanzamento delle esportazioni in background)
+        self.status_var = tk.StringVar(value="")
+        tk.Label(root, textvariable=self.status_var, anchor="w").pack(fill=tk.X, padx=10)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+
+        # La finestra compare subito: l'immagine iniziale (o lo sfondo nero) viene decodificata in un thread
+        # dopo il primo disegno della finestra, e visualizzata appena pronta
+        self._startup_queue = queue.Queue()
+        self.status_var.set("Caricamento dell'immagine...")
+        self.root.after_idle(self._start_initial_load, image_path)
+        if service_url:
+            self.connect_annotation_service(service_url)
 
     def set_draw_mode(self, mode):
         """Imposta la modalità di disegno corrente."""
         self.current_draw_mode = mode
-        # Resetta la forma attiva e lo stato di trascinamento quando si cambia modalità
+        # Resetta la forma attiva, la selezione e lo stato di trascinamento quando si cambia modalità
         self.active_shape = None
+        if mode != "select": # In modalità selezione la selezione corrente viene mantenuta
+            self.selected_shape = None
+            self.selected_shapes = []
         self.drag_state = None
         self.draw_all_shapes() # Ridisegna per pulire eventuali stati di disegno parziali
         print(f"Modalità di disegno impostata su: {mode}")
 
-    def _load_initial_image(self, path):
-        """Carica un'immagine iniziale usando la funzione utility."""
-        img = load_cv_image(path)
-        if img is None:
-            self._create_initial_blank_image(800, 600)
+    def _start_initial_load(self, path):
+        # Chiamato dal primo ciclo di inattività di Tk, dopo la geometria e il disegno della finestra
+        threading.Thread(target=self._read_initial_image, args=(path,), name="startup-image", daemon=True).start()
+        self.root.after(STARTUP_POLL_MS, self._poll_initial_load)
+
+    def _read_initial_image(self, path):
+        """Eseguita nel thread di avvio: importa le librerie pesanti e decodifica l'immagine iniziale."""
+        image = load_cv_image(path) if path else None
+        if image is None:
+            self._startup_queue.put((create_blank_cv_image(*BLANK_IMAGE_SIZE), None))
         else:
-            self.original_cv_image = img
-            self.current_cv_image = self.original_cv_image.copy()
-            self.update_canvas_image()
+            self._startup_queue.put((image, path))
+        from PIL import ImageTk # Anche Pillow è pronto quando l'immagine viene visualizzata
 
-    def _create_initial_blank_image(self, width, height):
-        """Crea un'immagine nera vuota iniziale usando la funzione utility."""
-        self.original_cv_image = create_blank_cv_image(width, height)
+    def _poll_initial_load(self):
+        try:
+            image, key = self._startup_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(STARTUP_POLL_MS, self._poll_initial_load)
+            return
+        self.original_cv_image = image
         self.current_cv_image = self.original_cv_image.copy()
+        self.edge_snapper.set_image(self.original_cv_image, key=key)
         self.update_canvas_image()
+        self.draw_all_shapes()
+        self.status_var.set("")
 
-    def update_canvas_image(self):
-        """Converte l'immagine OpenCV corrente in un formato Tkinter e la visualizza sul canvas."""
-        self.tk_image = cv2_to_tk_image(self.current_cv_image)
-        self.canvas.config(width=self.tk_image.width(), height=self.tk_image.height())
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_image)
-        self.canvas.tag_lower(self.tk_image)
+    def update_canvas_image(self, cv_image=None):
+        """
+        Converte l'immagine OpenCV corrente (o quella indicata) in un formato Tkinter e la visualizza sul canvas.
+        Va chiamata solo quando l'immagine cambia: l'elemento di sfondo viene riutilizzato.
+        L'immagine corrente passa dalle regolazioni di visualizzazione; viene convertita solo la parte visibile.
+        """
+        image = self._display_image() if cv_image is None else cv_image
+        height, width = image.shape[:2]
+        self.canvas.config(width=width, height=height)
+        x0, y0, x1, y1 = self._visible_region(width, height)
+        self.tk_image = cv2_to_tk_image(image[y0:y1, x0:x1])
+        self.displayed_region = (x0, y0, x1, y1)
+        if self.image_item_id is None:
+            self.image_item_id = self.canvas.create_image(x0, y0, anchor=tk.NW, image=self.tk_image)
+        else:
+            self.canvas.itemconfigure(self.image_item_id, image=self.tk_image)
+            self.canvas.coords(self.image_item_id, x0, y0)
+        self.canvas.tag_lower(self.image_item_id)
+
+    def _visible_region(self, width, height):
+        """Parte (x0, y0, x1, y1) di un'immagine width x height visibile nel canvas, limitata allo schermo."""
+        view_width, view_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if view_width <= 1 or view_height <= 1: # Canvas non ancora visualizzato: tutta l'immagine
+            return 0, 0, width, height
+        view_width = min(view_width, self.root.winfo_screenwidth())
+        view_height = min(view_height, self.root.winfo_screenheight())
+        x0, y0 = max(int(self.canvas.canvasx(0)), 0), max(int(self.canvas.canvasy(0)), 0)
+        return x0, y0, min(x0 + view_width, width), min(y0 + view_height, height)
+
+    def _display_image(self):
+        """Immagine corrente con le regolazioni di visualizzazione (elaborata solo nella parte visibile)."""
+        height, width = self.current_cv_image.shape[:2]
+        return self.display_adjuster.apply(self.current_cv_image, self._visible_region(width, height), self._image_key())
+
+    def _bind_shortcut(self, sequence, command):
+        """
+        Collega una scorciatoia da tastiera alla finestra, ignorandola mentre si scrive in un campo di testo
+        (es. l'etichetta "cell-1" non deve scalare il gruppo selezionato, né Canc eliminare la forma).
+        """
+        def handler(event):
+            if isinstance(event.widget, tk.Entry):
+                return
+            command()
+        self.root.bind(sequence, handler)
+
+    def _on_canvas_configure(self, event):
+        if self.current_cv_image is None or self.displayed_region is None:
+            return
+        height, width = self.current_cv_image.shape[:2]
+        x0, y0, x1, y1 = self._visible_region(width, height)
+        shown = self.displayed_region
+        if x0 < shown[0] or y0 < shown[1] or x1 > shown[2] or y1 > shown[3]:
+            self.refresh_display() # È diventata visibile una parte non ancora convertita
+
+    def refresh_display(self):
+        """Ridisegna lo sfondo (es. dopo una modifica delle regolazioni), in entrambe le modalità di rendering."""
+        if self.render_mode == "raster":
+            self._invalidate_raster() # Lo sfondo della composizione è cambiato
+            self.draw_all_shapes()
+        else:
+            self.update_canvas_image()
+
+    def set_display_adjustment(self, **changes):
+        """Modifica le regolazioni di visualizzazione; ridisegna solo se qualcosa è cambiato."""
+        if self.display_adjuster.set(**changes) and self.current_cv_image is not None:
+            self.refresh_display()
+
+    def reset_display_adjustments(self):
+        """Ripristina la visualizzazione dell'immagine originale."""
+        changed = self.display_adjuster.reset()
+        for name, value in DEFAULT_DISPLAY_SETTINGS._asdict().items():
+            self.adjust_vars[name].set(value) # Le regolazioni sono già ripristinate: i controlli non ridisegnano
+        if changed and self.current_cv_image is not None:
+            self.refresh_display()
+
+    def _shows_handles(self, shape):
+        """Le maniglie sono visibili solo per la forma selezionata, attiva o sotto il mouse."""
+        return shape is self.selected_shape or shape is self.active_shape or shape is self.hovered_shape
 
     def draw_all_shapes(self):
-        """Ridisegna l'immagine di sfondo e tutte le forme interattive sul canvas."""
-        self.update_canvas_image() 
-        for shape in self.shapes: # Itera su tutte le forme
-            shape.draw() 
+        """
+        Ridisegna tutte le forme interattive sul canvas.
+        Le forme non selezionate mostrano solo il corpo, senza maniglie.
+        In modalità "raster" solo la forma selezionata/attiva resta un elemento del canvas:
+        tutte le altre vengono composte nell'immagine di sfondo.
+        """
+        if self.render_mode == "raster":
+            self._draw_raster()
+        else:
+            for shape in self.shapes: # Itera su tutte le forme
+                shape.draw(show_handles=self._shows_handles(shape))
+        for proposal in self.proposals: # Le proposte restano elementi del canvas, sopra le forme
+            proposal.draw(show_handles=False)
+        self._apply_selection_tags()
+
+    def _apply_selection_tags(self):
+        """Assegna il tag "selected" agli elementi delle forme del gruppo (spostabili con un solo canvas.move)."""
+        self.canvas.dtag(SELECTION_TAG, SELECTION_TAG)
+        for shape in self.selected_shapes:
+            body = shape.get_body_id()
+            for item in [body] + shape.handle_ids:
+                if item:
+                    self.canvas.addtag_withtag(SELECTION_TAG, item)
+            if body:
+                self.canvas.itemconfigure(body, dash=(4, 2)) # Contorno tratteggiato per il gruppo (non sulle maniglie)
+
+    def _draw_raster(self):
+        live = {id(shape) for shape in self.selected_shapes}
+        live.update(id(shape) for shape in (self.selected_shape, self.active_shape) if shape is not None)
+        live_shapes = [shape for shape in self.shapes if id(shape) in live]
+        # Le forme delle etichette nascoste non vengono composte (i loro eventuali elementi del canvas sono già nascosti)
+        baked_shapes = [shape for shape in self.shapes if id(shape) not in live and LABELS.is_visible(shape.label_id)]
+        for shape in baked_shapes:
+            if shape.get_body_id() is not None or shape.handle_ids:
+                shape.delete_shapes() # Passa dal canvas all'immagine composta
+        if self.raster_overlay is None:
+            from raster_overlay import RasterOverlay
+            self.raster_overlay = RasterOverlay()
+        composite, changed = self.raster_overlay.render(self._display_image(), baked_shapes)
+        if changed:
+            self.update_canvas_image(composite)
+        for shape in live_shapes:
+            shape.draw(show_handles=self._shows_handles(shape))
+
+    def toggle_render_mode(self):
+        """Alterna il rendering con elementi del canvas e quello raster (per scene con migliaia di forme)."""
+        if self.render_mode == "canvas":
+            self.render_mode = "raster"
+            self.hovered_shape = None # In modalità raster l'evidenziazione al passaggio del mouse è disattivata
+        else:
+            self.render_mode = "canvas"
+            self._invalidate_raster()
+            self.update_canvas_image() # Ripristina lo sfondo senza forme composte
+        self.draw_all_shapes()
+        print(f"Modalità di rendering impostata su: {self.render_mode}")
+
+    def _invalidate_raster(self):
+        """Scarta la composizione raster (va chiamata quando l'immagine o tutte le forme cambiano)."""
+        if self.raster_overlay is not None:
+            self.raster_overlay.invalidate()
+
+    def toggle_edge_snapping(self):
+        """Attiva/disattiva l'aggancio dei vertici ai bordi dell'immagine."""
+        self.snap_to_edges = not self.snap_to_edges
+        state = "attivo" if self.snap_to_edges else "disattivato"
+        if self.snap_to_edges and not self.edge_snapper.is_ready():
+            state += " (mappa dei bordi in calcolo)"
+        print(f"Aggancio ai bordi {state}")
+
+    def snap_point(self, x, y):
+        """Restituisce il punto in cui posizionare un vertice: agganciato al bordo più vicino se l'aggancio è attivo."""
+        if self.snap_to_edges:
+            return self.edge_snapper.snap(x, y)
+        return x, y
+
+    def _image_key(self):
+        """Chiave dell'immagine corrente per le cache (percorso del file, o identità dell'immagine vuota)."""
+        if self.video_source is not None:
+            return (self.current_image_path, self.video_frame_index)
+        return self.current_image_path or id(self.original_cv_image)
+
+    # --- Video ---
+    def open_video(self, path=None):
+        """Apre un file video locale (senza estrarne i fotogrammi su disco) e mostra il primo fotogramma."""
+        if path is None:
+            path = filedialog.askopenfilename(title="Apri Video",
+                                              filetypes=[("Video", "*.mp4 *.avi *.mov *.mkv"), ("Tutti i file", "*.*")])
+            if not path:
+                return
+        from video_source import VideoSource
+        try:
+            source = VideoSource(path)
+        except IOError as e:
+            print(f"Errore: {e}")
+            return
+        if self.video_source is not None:
+            self.video_source.close()
+        self._flush_sync() # Prima di togliere le forme dell'immagine corrente
+        for shape in self.shapes:
+            shape.delete_shapes()
+        self.video_source = source
+        self.current_image_path = path
+        self.video_frame_shapes = {}
+        self.video_frame_index = 0
+        self.shapes = []
+        if self.annotation_sync is not None:
+            self.annotation_sync.set_image(self._output_filename(""))
+        self.show_video_frame(0)
+        print(f"Video aperto: {path} ({source.frame_count} fotogrammi, {source.fps:.2f} fps)")
+
+    def show_video_frame(self, index, carry_shapes=False):
+        """
+        Visualizza il fotogramma index con le sue forme. Se carry_shapes è True e il fotogramma
+        non ha ancora annotazioni, vi copia le forme di quello corrente (tracciate se video_track_shapes).
+        """
+        if self.video_source is None:
+            return
+        frame = self.video_source.get_frame(index)
+        if frame is None:
+            return
+
+        self._flush_sync() # Le modifiche degli ultimi SYNC_BATCH_MS appartengono al fotogramma che si lascia
+        previous_frame = self.original_cv_image
+        self.video_frame_shapes[self.video_frame_index] = self.shapes
+        shapes = self.video_frame_shapes.get(index)
+        if carry_shapes and not shapes and self.shapes:
+            from video_source import copy_shapes, track_shapes
+            shapes = copy_shapes(self.canvas, self.shapes)
+            if self.video_track_shapes:
+                track_shapes(previous_frame, frame, shapes)
+        for shape in self.shapes:
+            shape.delete_shapes()
+        self.reject_all_proposals()
+
+        # Ogni fotogramma ha la sua lista di forme: la cronologia non si estende tra fotogrammi diversi
+        self.shapes = shapes if shapes is not None else []
+        self.video_frame_index = index
+        self.undo_stack.clear()
+        self.active_shape = None
+        self.drag_state = None
+        self.selected_shape = None
+        self.hovered_shape = None
+        self.selected_shapes = []
+        if self.annotation_sync is not None:
+            self.annotation_sync.set_image(self._output_filename("")) # Ogni fotogramma è un'immagine del servizio
+
+        self.original_cv_image = frame
+        self.current_cv_image = frame.copy()
+        self.edge_snapper.set_image(frame, key=self._image_key())
+        self._invalidate_raster()
+        self.update_canvas_image()
+        self.draw_all_shapes()
+        self.status_var.set(f"Fotogramma {index + 1}/{self.video_source.frame_count}")
+
+    def propagate_to_next_frame(self):
+        """Passa al fotogramma successivo portando con sé le forme di quello corrente."""
+        self.show_video_frame(self.video_frame_index + 1, carry_shapes=True)
+
+    def propose_shapes(self):
+        """Chiede in background le proposte di contorni per l'immagine corrente (dalla cache se già calcolate)."""
+        if self.original_cv_image is None:
+            return
+        image_key = self._image_key()
+        self.status_var.set("Calcolo delle proposte in corso...")
+        self._get_proposal_engine().request_proposals(self.original_cv_image, image_key,
+                                               lambda polygons: self._show_proposals(polygons, image_key))
+
+    def refine_selected_rectangle(self):
+        """Rifinisce il rettangolo selezionato in un poligono aderente all'oggetto (proposto come sostituto)."""
+        rectangle = self.selected_shape
+        if not isinstance(rectangle, InteractiveRectangle):
+            print("Seleziona un rettangolo da rifinire.")
+            return
+        image_key = self._image_key()
+        self.status_var.set("Rifinitura del rettangolo in corso...")
+        self._get_proposal_engine().request_refinement(
+            self.original_cv_image, rectangle.get_bbox(),
+            lambda points: self._show_proposals([points] if points else [], image_key, source_shape=rectangle))
+
+    def _get_proposal_engine(self):
+        if self.proposal_engine is None:
+            from auto_proposals import ProposalEngine
+            self.proposal_engine = ProposalEngine(self.root)
+        return self.proposal_engine
+
+    def _show_proposals(self, polygons, image_key, source_shape=None):
+        # Chiamato nel thread dell'interfaccia quando il pool ha terminato
+        from auto_proposals import COLOR_PROPOSAL
+        if image_key != self._image_key():
+            return # Nel frattempo è stata caricata un'altra immagine
+        if source_shape is None:
+            self.reject_all_proposals() # Le nuove proposte dell'immagine sostituiscono le precedenti
+        for points in polygons:
+            proposal = InteractivePolygon(self.canvas, points=list(points), color=COLOR_PROPOSAL)
+            proposal.is_closed = True
+            proposal.source_shape = source_shape
+            self.proposals.append(proposal)
+        self.status_var.set(f"Proposte: {len(self.proposals)} (clic per accettare, tasto destro per rifiutare)")
+        self.draw_all_shapes()
+
+    def proposal_at(self, x, y):
+        """Restituisce la proposta che contiene il punto (quella disegnata per ultima), o None."""
+        for proposal in reversed(self.proposals):
+            if proposal.contains_point(x, y):
+                return proposal
+        return None
+
+    def accept_proposal(self, proposal):
+        """Trasforma una proposta in una forma dell'immagine (un'unica voce di undo; sostituisce il rettangolo rifinito)."""
+        self.undo_stack.begin_gesture()
+        self._accept_proposal(proposal)
+        self.undo_stack.end_gesture()
+        self.set_selection([proposal])
+
+    def _accept_proposal(self, proposal):
+        self.proposals.remove(proposal)
+        proposal.delete_shapes()
+        proposal.color = COLOR_POLYGON_BORDER
+        proposal.fill_color = "#F0F0F0" # Come le forme disegnate a mano (riempimento per la cliccabilità)
+        source_shape = proposal.source_shape
+        proposal.source_shape = None # Il riferimento serve solo finché la forma è una proposta
+        # Il contorno rifinito conserva l'etichetta del rettangolo di partenza; le altre proposte ricevono quella corrente
+        proposal.label_id = source_shape.label_id if source_shape is not None else self.current_label_id
+
+        if source_shape in self.shapes:
+            command = RemoveShapeCommand(self.shapes, source_shape, self.shapes.index(source_shape))
+            command.redo()
+            self.undo_stack.push(command)
+        self.shapes.append(proposal)
+        self.undo_stack.push(AddShapeCommand(self.shapes, proposal, len(self.shapes) - 1))
+
+    def reject_proposal(self, proposal):
+        """Scarta una proposta."""
+        self.proposals.remove(proposal)
+        proposal.delete_shapes()
+
+    def accept_all_proposals(self):
+        """Accetta tutte le proposte (un'unica voce di undo)."""
+        self.undo_stack.begin_gesture()
+        for proposal in list(self.proposals):
+            self._accept_proposal(proposal)
+        self.undo_stack.end_gesture()
+        self.set_selection([])
+
+    def reject_all_proposals(self):
+        """Scarta tutte le proposte."""
+        for proposal in list(self.proposals):
+            self.reject_proposal(proposal)
+
+    def select_shape(self, shape):
+        """Seleziona una forma (o nessuna con None), aggiornando solo le maniglie interessate."""
+        previous = self.selected_shape
+        self.selected_shape = shape
+        if self.selected_shapes:
+            self.selected_shapes = [shape] if shape is not None else []
+            self.draw_all_shapes() # Il gruppo precedente perde il tratteggio
+            return
+        if self.render_mode == "raster":
+            self.draw_all_shapes() # La forma selezionata passa dall'immagine composta al canvas (e viceversa)
+            return
+        if previous is not None and previous is not shape and not self._shows_handles(previous):
+            previous.delete_handles()
+        if shape is not None:
+            shape.draw_handles()
+
+    def set_hovered_shape(self, shape):
+        """Aggiorna la forma sotto il mouse mostrando/nascondendo solo le sue maniglie."""
+        previous = self.hovered_shape
+        if previous is shape or self.render_mode == "raster":
+            return
+        self.hovered_shape = shape
+        if previous is not None and not self._shows_handles(previous):
+            previous.delete_handles()
+        if shape is not None and not shape.handle_ids:
+            shape.draw_handles()
+
+    def set_selection(self, shapes):
+        """Imposta la selezione multipla; l'ultima forma diventa la forma selezionata principale."""
+        self.selected_shapes = list(shapes)
+        self.selected_shape = self.selected_shapes[-1] if self.selected_shapes else None
+        self.draw_all_shapes()
+
+    def transform_selection(self, dx=0, dy=0, scale=1.0, angle=0.0):
+        """
+        Trasforma tutte le forme selezionate in un'unica passata vettoriale
+        (scala e rotazione attorno al centro del gruppo) e registra l'operazione per l'undo.
+        """
+        shapes = self.selected_shapes or ([self.selected_shape] if self.selected_shape is not None else [])
+        if not shapes:
+            return
+        origin = group_center(shapes)
+        clamped = apply_group_transform(shapes, dx, dy, scale, angle, origin)
+        self.undo_stack.push(GroupTransformCommand(shapes, dx, dy, scale, angle, origin, clamped))
+        self.draw_all_shapes()
+
+    # --- Etichette ---
+    def apply_label(self):
+        """
+        Rende il nome scritto nel campo "Etichetta" l'etichetta delle nuove forme e lo assegna alle forme selezionate
+        (un'unica voce di undo). Un nome nuovo viene aggiunto alla tabella delle etichette.
+        """
+        label_id = LABELS.intern(self.label_var.get())
+        self.label_var.set(LABELS.name(label_id))
+        self.current_label_id = label_id
+        self.set_label_visible(label_id, True)
+        shapes = [shape for shape in self.selected_shapes if shape.label_id != label_id]
+        if shapes:
+            command = LabelCommand(shapes, [shape.label_id for shape in shapes], label_id)
+            command.redo()
+            self.undo_stack.push(command)
+        self.status_var.set(f"Etichetta corrente: {LABELS.name(label_id)} ({len(shapes)} forme aggiornate)")
+
+    def set_label_visible(self, label_id, visible):
+        """
+        Mostra o nasconde tutte le forme di un'etichetta. In modalità canvas è un'unica itemconfigure
+        sul tag dell'etichetta, senza ridisegnare; in modalità raster la composizione viene aggiornata.
+        Le forme nascoste escono dalla selezione e vengono ignorate dai clic.
+        """
+        if not LABELS.set_visible(label_id, visible):
+            return
+        self.canvas.itemconfigure(LABELS.tag(label_id), state=LABELS.item_state(label_id))
+        selection_changed = not visible and self._deselect_hidden_shapes()
+        if self.render_mode == "raster" or selection_changed:
+            self.draw_all_shapes() # Raster: ricompone lo sfondo; canvas: toglie maniglie e tratteggio della selezione
+
+    def _deselect_hidden_shapes(self):
+        """Toglie dalla selezione (e dal passaggio del mouse) le forme nascoste. Restituisce True se qualcosa è cambiato."""
+        is_hidden = lambda shape: shape is not None and not LABELS.is_visible(shape.label_id)
+        changed = False
+        if any(is_hidden(shape) for shape in self.selected_shapes):
+            self.selected_shapes = [shape for shape in self.selected_shapes if not is_hidden(shape)]
+            changed = True
+        if is_hidden(self.selected_shape):
+            self.selected_shape = self.selected_shapes[-1] if self.selected_shapes else None
+            changed = True
+        if is_hidden(self.hovered_shape):
+            self.hovered_shape = None
+            changed = True
+        if is_hidden(self.active_shape):
+            self.active_shape = None
+            changed = True
+        return changed
+
+    def _build_visible_labels_menu(self):
+        """Ricostruisce il menu "Etichette Visibili" con tutte le etichette registrate (anche quelle caricate da file)."""
+        self.visible_labels_menu.delete(0, tk.END)
+        for label_id, name in enumerate(LABELS.names()):
+            variable = tk.BooleanVar(value=LABELS.is_visible(label_id))
+            self.visible_labels_menu.add_checkbutton(
+                label=name, variable=variable,
+                command=lambda label_id=label_id, variable=variable: self.set_label_visible(label_id, variable.get()))
+
+    def shape_at(self, x, y):
+        """Restituisce la forma più in alto il cui corpo si trova sotto il punto indicato (o None)."""
+        items = self.canvas.find_overlapping(x, y, x, y)
+        if not items:
+            return None
+        body_to_shape = {shape.get_body_id(): shape for shape in self.shapes if LABELS.is_visible(shape.label_id)}
+        for item in reversed(items): # find_overlapping restituisce gli elementi dal basso verso l'alto
+            shape = body_to_shape.get(item)
+            if shape is not None:
+                return shape
+        return None
+
+    def undo(self):
+        """Annulla l'ultima modifica registrata nella cronologia."""
+        if self.undo_stack.undo():
+            self._after_history_change()
+
+    def redo(self):
+        """Ripete l'ultima modifica annullata."""
+        if self.undo_stack.redo():
+            self._after_history_change()
+
+    def _after_history_change(self):
+        # La forma attiva potrebbe non esistere più: interrompe l'eventuale disegno in corso
+        self.active_shape = None
+        self.drag_state = None
+        if self.selected_shape not in self.shapes:
+            self.selected_shape = None
+        if self.hovered_shape not in self.shapes:
+            self.hovered_shape = None
+        self.selected_shapes = [shape for shape in self.selected_shapes if shape in self.shapes]
+        self._deselect_hidden_shapes() # Un'etichetta ripristinata può essere nascosta
+        self.draw_all_shapes()
+
+    def remove_shape(self, shape):
+        """Rimuove una forma dall'immagine registrando l'operazione nella cronologia."""
+        if shape is None or shape not in self.shapes:
+            return
+        command = RemoveShapeCommand(self.shapes, shape, self.shapes.index(shape))
+        command.redo()
+        self.undo_stack.push(command)
+        if self.active_shape is shape:
+            self.active_shape = None
+            self.drag_state = None
+        if self.selected_shape is shape:
+            self.selected_shape = None
+        if self.hovered_shape is shape:
+            self.hovered_shape = None
+        if shape in self.selected_shapes:
+            self.selected_shapes.remove(shape)
+        self.draw_all_shapes()
+
+    def simplify_all_shapes(self, tolerance=None):
+        """Semplifica su richiesta tutti i poligoni e le polilinee (un'unica voce di undo)."""
+        tolerance = tolerance or self.simplify_tolerance or SIMPLIFY_TOLERANCE
+        self.undo_stack.begin_gesture()
+        removed = 0
+        for shape in self.shapes:
+            if isinstance(shape, (InteractivePolygon, InteractivePolyline)):
+                old_points, old_original = shape.points, shape.original_points
+                if shape.simplify(tolerance):
+                    removed += len(old_points) - len(shape.points)
+                    self.undo_stack.push(PointsCommand(shape, old_points, shape.points, old_original))
+        self.undo_stack.end_gesture()
+        self.draw_all_shapes()
+        print(f"Semplificazione completata: rimossi {removed} vertici (tolleranza {tolerance} px)")
+
+    def check_annotation_quality(self):
+        """
+        Controlla le forme correnti (duplicati, sovrapposizioni, forme degeneri, bordi dell'immagine),
+        stampa i problemi trovati e seleziona le forme coinvolte.
+        """
+        annotations = [snapshot_to_annotation(i, snapshot) for i, snapshot in enumerate(snapshot_shapes(self.shapes))]
+        width = height = None
+        if self.current_cv_image is not None:
+            height, width = self.current_cv_image.shape[:2]
+        from annotation_qa import run_qa
+        issues = run_qa(annotations, width, height)
+        counts = {}
+        involved = set()
+        for issue in issues:
+            counts[issue.kind] = counts.get(issue.kind, 0) + 1
+            involved.update(issue.ids)
+            print(issue.message)
+        self.set_selection([self.shapes[i] for i in sorted(involved)]) # Gli id sono gli indici in self.shapes
+        if issues:
+            self.status_var.set("Controllo qualità: " + ", ".join(f"{kind} {count}" for kind, count in counts.items()))
+        else:
+            self.status_var.set("Controllo qualità: nessun problema trovato")
+
+    def toggle_export_format(self, name):
+        """Aggiunge o toglie un formato da quelli scritti da export_current_annotations (menu "Formati")."""
+        if self.export_format_vars[name].get():
+            if name not in self.export_formats:
+                self.export_formats.append(name)
+        elif name in self.export_formats:
+            self.export_formats.remove(name)
 
     def export_current_annotations(self):
         """
-        Esporta le annotazioni correnti delle forme disegnate in un file JSON.
-        Il nome del file sarà basato sul nome dell'immagine caricata, o un default.
+        Esporta le annotazioni correnti delle forme disegnate in tutti i formati scelti, in background
+        e con un solo passaggio sulle forme (export_pipeline.py).
+        I nomi dei file saranno basati sul nome dell'immagine caricata, o un default.
         """
         if self.current_cv_image is None:
             print("Nessuna immagine caricata per esportare le annotazioni.")
             return
+        if not self.export_formats:
+            print("Nessun formato di esportazione selezionato.")
+            return
 
-        # Prepara il nome del file JSON
+        base_filename = self._output_filename("")
+        image_name = os.path.basename(self.current_image_path) if self.current_image_path else None
+
+        # Copia immutabile delle forme: serializzazione e scrittura avvengono nel thread di lavoro,
+        # quindi si può continuare a disegnare durante l'esportazione
+        self.export_worker.submit(PipelineExportJob(
+            base_filename,
+            snapshot_shapes(self.shapes),
+            self.current_cv_image.shape[1], # Larghezza immagine
+            self.current_cv_image.shape[0], # Altezza immagine
+            self.export_formats,
+            image_name=image_name,
+            labels=LABELS.names(), # Stessi id di classe per tutte le immagini della sessione
+            simplify_tolerance=self.export_simplify_tolerance,
+            include_original=self.export_keep_original,
+            on_progress=self._on_export_progress,
+            on_done=self._on_export_done
+        ))
+        self.status_var.set(f"Esportazione in corso: {base_filename} ({', '.join(self.export_formats)})")
+
+    def _output_filename(self, suffix):
+        """Nome del file di output basato sul nome dell'immagine caricata, o un default."""
         if self.current_image_path:
             base_name = os.path.splitext(os.path.basename(self.current_image_path))[0]
-            json_filename = f"{base_name}_annotations.json"
         else:
-            json_filename = "blank_image_annotations.json"
-        
-        # Chiama la funzione di esportazione dal modulo annotation_exporter
-        export_annotations_to_json(
-            self.shapes, 
-            self.current_cv_image.shape[1], # Larghezza immagine
-            self.current_cv_image.shape[0], # Altezza immagine
-            json_filename
-        )
+            base_name = "blank_image"
+        if self.video_source is not None:
+            base_name += f"_frame{self.video_frame_index:06d}" # Un file di annotazioni per fotogramma
+        return f"{base_name}{suffix}"
+
+    def save_current_session(self):
+        """Salva le forme nel formato di sessione binario (in background, come le esportazioni)."""
+        if self.current_cv_image is None:
+            print("Nessuna immagine caricata per salvare la sessione.")
+            return
+        from session_format import SESSION_EXTENSION
+        session_filename = self._output_filename("_session" + SESSION_EXTENSION)
+        self.export_worker.submit(SessionSaveJob(
+            session_filename,
+            snapshot_shapes(self.shapes),
+            self.current_cv_image.shape[1],
+            self.current_cv_image.shape[0],
+            on_progress=self._on_export_progress,
+            on_done=self._on_export_done
+        ))
+        self.status_var.set(f"Salvataggio in corso: {session_filename}")
+
+    def load_current_session(self):
+        """Sostituisce le forme correnti con quelle del file di sessione dell'immagine (se esiste)."""
+        from session_format import load_session_snapshot, SessionFormatError, SESSION_EXTENSION
+        session_filename = self._output_filename("_session" + SESSION_EXTENSION)
+        try:
+            snapshot, _, _ = load_session_snapshot(session_filename)
+        except (IOError, SessionFormatError) as e:
+            print(f"Errore durante il caricamento della sessione: {e}")
+            return
+
+        for shape in self.shapes:
+            shape.delete_shapes()
+        self.shapes[:] = shapes_from_snapshot(self.canvas, snapshot) # Stessa lista: i comandi di undo ne tengono un riferimento
+        self.undo_stack.clear()
+        self._invalidate_raster()
+        self._after_history_change()
+        self.schedule_sync()
+        print(f"Sessione caricata da {session_filename}: {len(self.shapes)} forme")
+
+    def _on_export_progress(self, job, fraction):
+        """Aggiorna la riga di stato (chiamato nel thread dell'interfaccia)."""
+        self.status_var.set(f"Esportazione in corso: {job.filename} ({fraction:.0%})")
+
+    def _on_export_done(self, job, status, error):
+        """Riporta l'esito di un'esportazione (chiamato nel thread dell'interfaccia)."""
+        if status == "done" and getattr(job, "report", None) is not None:
+            print(f"Annotazioni esportate con successo in {', '.join(job.report.outputs)}")
+            print(f"Tempi di esportazione: {format_report(job.report)}")
+            self.status_var.set(f"Annotazioni esportate in {', '.join(job.report.outputs)}")
+        elif status == "done":
+            print(f"Annotazioni esportate con successo in {job.filename}")
+            self.status_var.set(f"Annotazioni esportate in {job.filename}")
+        elif status == "error":
+            print(f"Errore durante l'esportazione delle annotazioni: {error}")
+            self.status_var.set(f"Errore durante l'esportazione: {error}")
+        # "cancelled": sostituita da un salvataggio più recente dello stesso file, nessun messaggio
+
+    # --- Servizio di annotazione condiviso ---
+    def connect_annotation_service(self, url):
+        """
+        Collega l'editor al servizio di annotazione (annotation_service.py): le forme dell'immagine corrente
+        diventano quelle del servizio, ogni modifica registrata nella cronologia viene inviata (a gruppi,
+        vedi SYNC_BATCH_MS) e le modifiche degli altri annotatori vengono applicate appena arrivano.
+        """
+        from annotation_service import AnnotationSync
+        if self.annotation_sync is not None:
+            self.annotation_sync.close()
+        self.annotation_sync = AnnotationSync(url, self._output_filename(""))
+        self.undo_stack.on_change = self.schedule_sync # Gesti conclusi (rilascio del mouse), undo e redo
+        self.root.after(SYNC_POLL_MS, self._poll_sync)
+        print(f"Collegato al servizio di annotazione {url} come {self.annotation_sync.client_id}")
+
+    def schedule_sync(self):
+        """Programma l'invio delle modifiche: quelle dei prossimi SYNC_BATCH_MS ms partono insieme."""
+        if self.annotation_sync is None or self._sync_scheduled:
+            return
+        self._sync_scheduled = True
+        self.root.after(SYNC_BATCH_MS, self._push_sync)
+
+    def _push_sync(self):
+        self._sync_scheduled = False
+        if self.annotation_sync is None:
+            return
+        # Forma ancora in costruzione (es. poligono aperto), o stato del servizio non ancora ricevuto
+        # (le forme locali potrebbero essere sostituite): si riprova più tardi
+        if self.drag_state is not None or self.annotation_sync.initial:
+            self.schedule_sync()
+            return
+        self._submit_sync()
+
+    def _flush_sync(self):
+        """Accoda subito le modifiche non ancora inviate, senza attendere SYNC_BATCH_MS (es. prima di lasciare l'immagine)."""
+        if self.annotation_sync is not None and not self.annotation_sync.initial:
+            self._submit_sync()
+
+    def _submit_sync(self):
+        # Le copie delle forme e il confronto con lo stato sincronizzato si fanno qui, nel thread dell'interfaccia;
+        # al thread di invio arriva solo il delta
+        current = {}
+        for shape, snapshot in zip(self.shapes, snapshot_shapes(self.shapes)):
+            if shape.sync_uid is None:
+                shape.sync_uid = uuid.uuid4().hex
+            current[shape.sync_uid] = snapshot_to_annotation(0, snapshot) # Gli id sono assegnati dal servizio
+        self.annotation_sync.submit(current)
+
+    def _poll_sync(self):
+        """Applica le modifiche ricevute dal servizio (mai durante un trascinamento o un disegno in corso)."""
+        if self.annotation_sync is None:
+            return
+        if self.drag_state is None:
+            upsert, remove, full = self.annotation_sync.take_remote()
+            if upsert or remove or full:
+                self._apply_remote_changes(upsert, remove, full)
+        if self.annotation_sync.error is not None:
+            self.status_var.set(f"Servizio di annotazione non raggiungibile: {self.annotation_sync.error}")
+        self.root.after(SYNC_POLL_MS, self._poll_sync)
+
+    def _apply_remote_changes(self, upsert, remove, full):
+        """
+        Sostituisce, aggiunge ed elimina le forme modificate dagli altri annotatori (identificate da sync_uid).
+        Dalla cronologia vengono tolte solo le voci che riguardano le forme sostituite o eliminate
+        (si riferiscono a oggetti che non esistono più); le altre modifiche locali restano annullabili.
+        """
+        initial = full and self.annotation_sync.initial
+        if initial:
+            self.annotation_sync.initial = False
+        # Alla prima risposta le forme del servizio sostituiscono quelle locali; se il servizio non ne ha,
+        # quelle locali restano e vengono inviate
+        drop_unsynced = initial and bool(upsert)
+        touched = set(upsert) | set(remove)
+        dropped = set() # id() delle forme locali mai sincronizzate sostituite dallo stato del servizio
+        created = {}
+        if upsert:
+            uids = list(upsert)
+            for uid, shape in zip(uids, shapes_from_snapshot(self.canvas, [annotation_to_snapshot(upsert[uid]) for uid in uids])):
+                shape.sync_uid = uid
+                created[uid] = shape
+        shapes = []
+        for shape in self.shapes:
+            uid = shape.sync_uid
+            if uid in remove or uid in created or (uid is None and drop_unsynced):
+                shape.delete_shapes()
+                dropped.add(id(shape))
+                if uid in created:
+                    shapes.append(created.pop(uid)) # Stessa posizione nell'ordine di disegno
+            else:
+                shapes.append(shape)
+        shapes.extend(created.values())
+        self.shapes[:] = shapes # Stessa lista: i comandi di undo ne tengono un riferimento
+        # Anche le voci delle forme eliminate localmente (non più nella lista) ma modificate da altri
+        self.undo_stack.discard_shapes(lambda shape: shape.sync_uid in touched or id(shape) in dropped)
+        self._invalidate_raster()
+        self._after_history_change()
+        if initial:
+            self.schedule_sync()
+
+    def on_close(self):
+        """Alla chiusura attende il completamento delle esportazioni in corso, poi distrugge la finestra."""
+        if self.annotation_sync is not None:
+            self._flush_sync()
+            self.annotation_sync.close() # Attende (per un tempo limitato) l'invio delle modifiche in coda
+        self.export_worker.shutdown(wait=True)
+        if self.proposal_engine is not None:
+            self.proposal_engine.shutdown()
+        if self.video_source is not None:
+            self.video_source.close()
+        self.root.destroy()
 
 
 # --- Funzione Main (punto di ingresso del programma) ---
@@ -135,7 +980,10 @@ if __name__ == "__main__":
     # Puoi caricare un'immagine esistente fornendo il percorso:
     # Esempio: image_path = "percorso/alla/tua/immagine.jpg"
     image_path = None 
+    # Per annotare insieme ad altri: avviare annotation_service.py e impostare, ad esempio,
+    # ANNOTATION_SERVICE_URL=http://127.0.0.1:8765
+    service_url = os.environ.get("ANNOTATION_SERVICE_URL")
 
     root = tk.Tk()
-    app = ImageEditorApp(root, image_path)
+    app = ImageEditorApp(root, image_path, service_url=service_url)
     root.mainloop()
@@ -0,0 +1,199 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from interactive_shapes import InteractivePolygon, InteractivePolyline
+from annotation_exporter import snapshot_shapes, shapes_from_snapshot
+
+# --- Configurazioni Globali per i Video ---
+VIDEO_CACHE_FRAMES = 64 # Fotogrammi decodificati conservati nella cache LRU
+VIDEO_READ_AHEAD = 8 # Fotogrammi successivi decodificati in anticipo dal thread in background
+VIDEO_SEEK_INTERVAL = 30 # Distanza tra due punti di posizionamento dell'indice (circa un GOP tipico)
+FLOW_WINDOW_SIZE = 21 # Finestra (pixel) di Lucas-Kanade
+FLOW_PYRAMID_LEVELS = 3 # Livelli della piramide di Lucas-Kanade (spostamenti ampi)
+FLOW_MAX_ERROR = 1.0 # Errore massimo (pixel) del controllo avanti-indietro per accettare un punto tracciato
+
+class VideoSource:
+    """
+    Legge i fotogrammi di un file video locale senza estrarli su disco.
+    - Indice dei punti di posizionamento: il posizionamento avviene sempre su un punto dell'indice
+      (multiplo di seek_interval) seguito da una decodifica in avanti, quindi è esatto e di costo limitato
+      anche con i backend che si posizionano solo sui fotogrammi chiave.
+    - Cache LRU dei fotogrammi decodificati.
+    - Lettura anticipata: dopo ogni richiesta, un thread decodifica i fotogrammi successivi.
+    """
+    def __init__(self, path, cache_size=VIDEO_CACHE_FRAMES, read_ahead=VIDEO_READ_AHEAD,
+                 seek_interval=VIDEO_SEEK_INTERVAL):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Impossibile aprire il video {path}")
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 0.0
+        self.cache_size = cache_size
+        self.read_ahead = read_ahead
+        self.seek_interval = seek_interval
+        # Punti di posizionamento verificati: fotogramma -> True se il backend vi si posiziona esattamente
+        self.seek_points = {0: True}
+
+        self._cache = OrderedDict() # indice del fotogramma -> immagine BGR
+        self._decoder_lock = threading.Lock() # Il VideoCapture è usato da un thread alla volta
+        self._cache_lock = threading.Lock()
+        self._position = 0 # Indice del prossimo fotogramma che il decoder restituirà
+        self._wanted = threading.Event() # Segnala al thread di lettura anticipata che c'è lavoro
+        self._read_ahead_until = 0 # Ultimo fotogramma (escluso) da leggere in anticipo
+        self._closed = False
+        self._thread = threading.Thread(target=self._read_ahead_loop, name="video-read-ahead", daemon=True)
+        self._thread.start()
+
+    # --- Cache ---
+    def _cache_get(self, index):
+        with self._cache_lock:
+            frame = self._cache.get(index)
+            if frame is not None:
+                self._cache.move_to_end(index)
+            return frame
+
+    def _cache_put(self, index, frame):
+        with self._cache_lock:
+            self._cache[index] = frame
+            self._cache.move_to_end(index)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # --- Decodifica (con self._decoder_lock acquisito) ---
+    def _seek(self, index):
+        """Posiziona il decoder sul punto dell'indice che precede index e decodifica in avanti fino a index."""
+        if index < self._position or index - self._position > self.seek_interval:
+            seek_point = index - index % self.seek_interval
+            while seek_point > 0 and self.seek_points.get(seek_point) is False:
+                seek_point -= self.seek_interval # Punto non affidabile con questo backend: usa il precedente
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, seek_point)
+            if seek_point not in self.seek_points:
+                self.seek_points[seek_point] = int(self.capture.get(cv2.CAP_PROP_POS_FRAMES)) == seek_point
+                if not self.seek_points[seek_point]:
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    seek_point = 0
+            self._position = seek_point
+        while self._position < index: # grab() avanza senza convertire il fotogramma in BGR
+            if not self.capture.grab():
+                return False
+            self._position += 1
+        return True
+
+    def _decode(self, index):
+        if not self._seek(index):
+            return None
+        ok, frame = self.capture.read()
+        if not ok:
+            return None
+        self._position += 1
+        self._cache_put(index, frame)
+        return frame
+
+    # --- Interfaccia pubblica ---
+    def get_frame(self, index):
+        """
+        Restituisce il fotogramma index (immagine BGR), dalla cache se possibile, e avvia la lettura
+        anticipata dei successivi. Restituisce None se il fotogramma non esiste.
+        """
+        if index < 0 or (self.frame_count and index >= self.frame_count):
+            return None
+        frame = self._cache_get(index)
+        if frame is None:
+            with self._decoder_lock:
+                frame = self._cache_get(index) # Potrebbe averlo appena letto il thread di lettura anticipata
+                if frame is None:
+                    frame = self._decode(index)
+        if frame is not None and self.read_ahead:
+            self._read_ahead_until = index + 1 + self.read_ahead
+            self._wanted.set()
+        return frame
+
+    def _read_ahead_loop(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            if self._closed:
+                return
+            while not self._closed:
+                with self._decoder_lock:
+                    index = self._position # Continua da dove si trova il decoder: nessun posizionamento
+                    if index >= self._read_ahead_until or (self.frame_count and index >= self.frame_count):
+                        break
+                    if self._cache_get(index) is None:
+                        if self._decode(index) is None:
+                            break
+                    elif not self._seek(index + 1):
+                        break
+                if self._wanted.is_set():
+                    break # Nuova richiesta: ricomincia con i nuovi limiti
+
+    def close(self):
+        """Ferma la lettura anticipata e rilascia il file video."""
+        self._closed = True
+        self._wanted.set()
+        self._thread.join()
+        with self._decoder_lock:
+            self.capture.release()
+        with self._cache_lock:
+            self._cache.clear()
+
+# --- Propagazione delle forme tra fotogrammi ---
+def copy_shapes(canvas, shapes):
+    """Copia indipendente delle forme (geometria e stile), da usare su un altro fotogramma."""
+    copies = shapes_from_snapshot(canvas, snapshot_shapes(shapes))
+    for copy, shape in zip(copies, shapes):
+        copy.color = shape.color
+        copy.border_width = shape.border_width
+        if hasattr(shape, "fill_color"):
+            copy.fill_color = shape.fill_color
+    return copies
+
+def _tracking_points(shape):
+    """Punti da tracciare per una forma: i vertici di poligoni e polilinee, riquadro e centro per le altre."""
+    if isinstance(shape, (InteractivePolygon, InteractivePolyline)):
+        return list(shape.points)
+    x_min, y_min, x_max, y_max = shape.get_bbox()
+    return [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max), ((x_min + x_max) / 2, (y_min + y_max) / 2)]
+
+def track_shapes(previous_frame, next_frame, shapes):
+    """
+    Sposta le forme seguendo il moto tra due fotogrammi con il flusso ottico sparso di Lucas-Kanade.
+    Tutti i punti di tutte le forme sono tracciati con un'unica chiamata; i punti non affidabili
+    (controllo avanti-indietro) seguono lo spostamento mediano della loro forma.
+    Poligoni e polilinee si deformano vertice per vertice; rettangoli, cerchi e ovali vengono traslati.
+    """
+    if not shapes:
+        return
+    layout = []
+    points = []
+    for shape in shapes:
+        shape_points = _tracking_points(shape)
+        layout.append((shape, len(points), len(shape_points)))
+        points.extend(shape_points)
+    if not points:
+        return
+
+    previous_gray = cv2.cvtColor(previous_frame, cv2.COLOR_BGR2GRAY)
+    next_gray = cv2.cvtColor(next_frame, cv2.COLOR_BGR2GRAY)
+    p0 = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+    lk_params = dict(winSize=(FLOW_WINDOW_SIZE, FLOW_WINDOW_SIZE), maxLevel=FLOW_PYRAMID_LEVELS)
+    p1, status, _ = cv2.calcOpticalFlowPyrLK(previous_gray, next_gray, p0, None, **lk_params)
+    back, back_status, _ = cv2.calcOpticalFlowPyrLK(next_gray, previous_gray, p1, None, **lk_params)
+    error = np.linalg.norm((back - p0).reshape(-1, 2), axis=1)
+    reliable = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < FLOW_MAX_ERROR)
+    displacement = (p1 - p0).reshape(-1, 2)
+
+    for shape, start, count in layout:
+        shape_ok = reliable[start:start + count]
+        if not shape_ok.any():
+            continue # Nessun punto affidabile: la forma resta dov'è (l'annotatore la correggerà)
+        shape_displacement = displacement[start:start + count]
+        dx, dy = np.median(shape_displacement[shape_ok], axis=0)
+        if isinstance(shape, (InteractivePolygon, InteractivePolyline)):
+            shape_displacement = np.where(shape_ok[:, None], shape_displacement, (dx, dy))
+            new_points = np.asarray(shape.points, dtype=np.float64) + shape_displacement
+            shape.set_points([(int(round(x)), int(round(y))) for x, y in new_points.tolist()]) # I vertici originali non seguono più la forma
+        else:
+            shape.move(int(round(dx)), int(round(dy)))